@@ -6,20 +6,40 @@ así como una API RESTful para recibir y procesar lecturas NFC desde una aplicac
 También incluye autenticación de usuarios y manejo de sesiones.
 """
 from werkzeug.security import generate_password_hash
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, abort
-from flask_socketio import SocketIO, emit
+from werkzeug.exceptions import RequestEntityTooLarge
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_file, abort, Response, g, has_request_context
+from flask_socketio import SocketIO, emit, join_room, leave_room, rooms
 from flask_cors import CORS
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import os
 import sqlite3
+import time
 from io import BytesIO
 import base64
 # CORRECCIÓN: Asegúrate de que el nombre del archivo de autenticación sea el correcto.
 from autentificacion import validar_credenciales, iniciar_sesion, cerrar_sesion, verificar_sesion, obtener_permisos_usuario, obtener_roles_modulos, obtener_rutas_modulos
 from db import obtener_conexion
+from toma_inventario import RegistroTomas, TIPOS_UBICACION
+import documentos_envio
+import retiros_tienda
+import reportes
+import registro_cambios
+from ejecutor_bd import EjecutorBD
+import telemetria
+from deduplicacion import VentanaDuplicados
+from spool_escaneos import SpoolEscaneos
+from limite_ingesta import LimitadorIngesta, MAX_BYTES_ESCANEO, MAX_BYTES_PETICION
+import metricas
+import consultas_lentas
+import consultas_repetidas
+import perfilado
+import migraciones
 from pathlib import Path
 import unicodedata
+
+# Cada sentencia sobre la base de inventario queda medida en /metrics.
+obtener_conexion = metricas.instrumentar(obtener_conexion, 'inventario')
 # ============================================================================
 # FUNCIÓN AUXILIAR PARA VARIABLES DE SESIÓN
 # ============================================================================
@@ -35,56 +55,141 @@ def session_vars():
 # ============================================================================
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('FLASK_SECRET_KEY', 'nfc-reader-secret-key-dev-only')
+app.config['MAX_CONTENT_LENGTH'] = MAX_BYTES_PETICION
 CORS(app, origins=["http://localhost:8100", "http://localhost:4200", "capacitor://localhost", "ionic://localhost", "http://localhost"])
-socketio = SocketIO(app, cors_allowed_origins="*")
+# Con varios procesos, los eventos de Socket.IO se reparten por una cola de mensajes
+# (redis://..., amqp://... o zmq+tcp://host:5555+5556 con broker_socketio.py).
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+socketio = SocketIO(app, cors_allowed_origins="*", message_queue=SOCKETIO_MESSAGE_QUEUE,
+                    async_mode=os.environ.get('SOCKETIO_ASYNC_MODE') or None)
+# Bajo eventlet/gevent las consultas SQLite se ejecutan en un grupo acotado de hilos
+# para que una escritura esperando el bloqueo no detenga a los demás clientes.
+# ITEC_BD_EN_HILOS=0 las deja en el bucle de eventos (sólo para comparar rendimiento).
+ejecutor_bd = EjecutorBD(socketio.async_mode, activo=os.environ.get('ITEC_BD_EN_HILOS', '1') == '1')
 
 DATABASE_FILE = 'nfc_readings.db'
 APK_FILE = 'static/NFC_Reader.apk'
 APK_EXISTS = os.path.exists(APK_FILE)
+CDC_TOKEN = os.environ.get('CDC_TOKEN')
+SYNC_TOKEN = os.environ.get('SYNC_TOKEN')
+CDC_RETENCION_DIAS = int(os.environ.get('CDC_RETENCION_DIAS', 7))
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN')
+# Spool de escaneos: 'respaldo' sólo si la base está ocupada, 'siempre' para todo escaneo simple, 'no' lo desactiva.
+SPOOL_MODO = os.environ.get('ITEC_SPOOL_MODO', 'respaldo')
+SPOOL_ESPERA_BD = float(os.environ.get('ITEC_SPOOL_ESPERA_BD', 0.5))
+SPOOL_INTERVALO = float(os.environ.get('ITEC_SPOOL_INTERVALO', 1))
 
 # ============================================================================
 # CLASE DE BASE DE DATOS (NFC Readings)
 # ============================================================================
 class NFCDatabase:
-    """Manejo de base de datos SQLite para lecturas NFC"""
-    def __init__(self):
-        self.init_database()
+    """
+    Manejo de base de datos SQLite para lecturas NFC. Las lecturas viven en el
+    archivo de telemetría (ver telemetria.py), separado del inventario.
+    """
+    def __init__(self, ruta=telemetria.TELEMETRIA_DATABASE_FILE):
+        # Sólo guarda la ruta: el esquema y la migración de lecturas los hace
+        # init_database(), llamado desde init_inventory_db() una vez por despliegue.
+        self.ruta = ruta
     
     def init_database(self):
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS nfc_readings (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT, device_info TEXT, nfc_data TEXT,
-                    timestamp TEXT, formatted_time TEXT, ip_address TEXT, user_agent TEXT
-                )''')
+        with telemetria.conexion(self.ruta) as conn:
+            telemetria.crear_tablas(conn)
+        movidas = telemetria.migrar_lecturas(DATABASE_FILE, self.ruta)
+        if movidas:
+            print(f"INFO: {movidas} lecturas movidas de '{DATABASE_FILE}' a '{self.ruta}'.")
+        if telemetria.reconstruir_rollups(self.ruta, solo_si_vacios=True):
+            print("INFO: Agregados de escaneos calculados desde las lecturas existentes.")
     
-    def save_reading(self, device_info, nfc_data, ip_address, user_agent):
-        timestamp = datetime.now().isoformat()
-        formatted_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        with sqlite3.connect(DATABASE_FILE) as conn:
-            cursor = conn.cursor()
-            cursor.execute('INSERT INTO nfc_readings (device_info, nfc_data, timestamp, formatted_time, ip_address, user_agent) VALUES (?, ?, ?, ?, ?, ?)',
-                           (json.dumps(device_info), json.dumps(nfc_data), timestamp, formatted_time, ip_address, user_agent))
-            reading_id = cursor.lastrowid
-        return {'id': reading_id, 'device_info': device_info, 'nfc_data': nfc_data, 'timestamp': timestamp, 'formatted_time': formatted_time, 'ip_address': ip_address}
+    def save_reading(self, device_info, nfc_data, ip_address, user_agent, client_scan_id=None, timestamp=None, timeout=None,
+                     antes_de_confirmar=None):
+        """
+        Guarda una lectura. Si ya existe una con el mismo client_scan_id no se
+        escribe nada y se devuelve la original con 'duplicado': True.
+        'timeout' limita la espera si la base está bloqueada (ver spool de escaneos).
+        'antes_de_confirmar(lectura)' corre sólo para una lectura nueva, antes del
+        commit: si lanza una excepción la lectura no queda guardada.
+        """
+        with telemetria.conexion(self.ruta, timeout) as conn:
+            reading = self._insertar(conn, device_info, nfc_data, ip_address, user_agent, client_scan_id, timestamp)
+            if antes_de_confirmar and not reading.get('duplicado'):
+                antes_de_confirmar(reading)
+            return reading
     
-    def get_all_readings(self, limit=100):
-        with sqlite3.connect(DATABASE_FILE) as conn:
+    def save_readings_lote(self, entradas):
+        """
+        Guarda en una sola transacción las entradas del spool de escaneos.
+        Devuelve [(entrada, lectura)] sólo de las que no estaban ya guardadas.
+        """
+        guardadas = []
+        with telemetria.conexion(self.ruta) as conn:
+            for e in entradas:
+                reading = self._insertar(conn, e.get('device_info'), e.get('nfc_data'), e.get('ip_address'),
+                                         e.get('user_agent'), e.get('client_scan_id'), e.get('timestamp'))
+                if not reading.get('duplicado'):
+                    guardadas.append((e, reading))
+        return guardadas
+    
+    def _insertar(self, conn, device_info, nfc_data, ip_address, user_agent, client_scan_id=None, timestamp=None):
+        return telemetria.insertar_lectura(conn, device_info, nfc_data, ip_address, user_agent,
+                                           _id_dispositivo(device_info, ip_address), client_scan_id, timestamp)
+    
+    def buscar_por_client_scan_id(self, client_scan_id):
+        with telemetria.conexion(self.ruta) as conn:
+            return telemetria.lectura_por_client_scan_id(conn, client_scan_id)
+    
+    def get_all_readings(self, limit=100, desde=None, hasta=None):
+        """
+        Lecturas más recientes, opcionalmente en [desde, hasta) (ISO 8601). Si el
+        archivo caliente no alcanza, se adjuntan los archivos mensuales del rango,
+        del más reciente al más antiguo, hasta completar 'limit'.
+        """
+        condiciones, params = [], []
+        if desde:
+            condiciones.append('timestamp >= ?')
+            params.append(desde)
+        if hasta:
+            condiciones.append('timestamp < ?')
+            params.append(hasta)
+        filtro = f" WHERE {' AND '.join(condiciones)}" if condiciones else ''
+
+        with telemetria.conexion(self.ruta) as conn:
             conn.row_factory = sqlite3.Row
             cursor = conn.cursor()
-            cursor.execute('SELECT * FROM nfc_readings ORDER BY timestamp DESC LIMIT ?', (limit,))
-            return [{k: (json.loads(row[k]) if k in ['device_info', 'nfc_data'] else row[k]) for k in row.keys()} for row in cursor.fetchall()]
+            cursor.execute(f'SELECT * FROM nfc_readings{filtro} ORDER BY timestamp DESC LIMIT ?', (*params, limit))
+            filas = cursor.fetchall()
+            for _, archivo in telemetria.meses_archivados(conn, desde, hasta):
+                if len(filas) >= limit:
+                    break
+                with telemetria.archivo_adjunto(conn, archivo) as alias:
+                    filas += conn.execute(f'SELECT * FROM {alias}.nfc_readings{filtro} ORDER BY timestamp DESC LIMIT ?',
+                                          (*params, limit - len(filas))).fetchall()
+            return [{k: (json.loads(row[k]) if k in ['device_info', 'nfc_data'] else row[k]) for k in row.keys()} for row in filas]
     
     def get_stats(self):
-        with sqlite3.connect(DATABASE_FILE) as conn:
+        with telemetria.conexion(self.ruta) as conn:
             cursor = conn.cursor()
-            total_readings = cursor.execute('SELECT COUNT(*) FROM nfc_readings').fetchone()[0]
-            unique_devices = cursor.execute('SELECT COUNT(DISTINCT ip_address) FROM nfc_readings').fetchone()[0]
+            # Lo archivado se cuenta desde el resumen de cada mes, sin abrir los archivos.
+            total_readings = cursor.execute(
+                'SELECT (SELECT COUNT(*) FROM nfc_readings) + (SELECT COALESCE(SUM(lecturas), 0) FROM archivos_telemetria)').fetchone()[0]
+            unique_devices = cursor.execute('''
+                SELECT COUNT(*) FROM (SELECT ip_address FROM nfc_readings WHERE ip_address IS NOT NULL
+                                      UNION SELECT ip_address FROM archivos_telemetria_ips)''').fetchone()[0]
             last_reading = cursor.execute('SELECT formatted_time FROM nfc_readings ORDER BY timestamp DESC LIMIT 1').fetchone()
+            if not last_reading:
+                for _, archivo in telemetria.meses_archivados(conn)[:1]:
+                    with telemetria.archivo_adjunto(conn, archivo) as alias:
+                        last_reading = conn.execute(f'SELECT formatted_time FROM {alias}.nfc_readings ORDER BY timestamp DESC LIMIT 1').fetchone()
             return {'total_readings': total_readings, 'unique_devices': unique_devices, 'last_reading_time': last_reading[0] if last_reading else 'Ninguna'}
 
 db = NFCDatabase()
+# Escaneos recientes de este proceso: por client_scan_id y por equipo + contenido (doble toque).
+recientes_por_id = VentanaDuplicados(segundos=None)
+recientes_por_contenido = VentanaDuplicados()
+# Escaneos aceptados con 202 mientras la base está ocupada; ver _guardar_o_encolar.
+spool = SpoolEscaneos()
+limitador = LimitadorIngesta()
+tomas = RegistroTomas()
 
 # ============================================================================
 # FUNCIONES AUXILIARES
@@ -98,27 +203,226 @@ def generar_nombre_usuario(primer_nombre: str, apellido_pat: str, apellido_mat:
     pn, ap, am = _slugify(primer_nombre), _slugify(apellido_pat), _slugify(apellido_mat)
     return f"{pn[0] if pn else ''}{ap}{am[0] if am else ''}"
 
+def _resolver_productos(cur, codigos):
+    """
+    Resuelve códigos escaneados a producto_id en una sola consulta por bloque.
+    El número de serie tiene prioridad; si no coincide, un código numérico se toma como ID.
+    """
+    codigos = list(dict.fromkeys((c or '').strip() for c in codigos if (c or '').strip()))
+    por_serie, por_id = {}, {}
+    for i in range(0, len(codigos), 400):
+        bloque = codigos[i:i + 400]
+        ids = [int(c) for c in bloque if c.isdigit()]
+        marcadores_serie = ','.join('?' * len(bloque))
+        marcadores_id = ','.join('?' * len(ids)) or 'NULL'
+        for producto_id, numero_serie in cur.execute(
+                f"SELECT producto_id, numero_serie FROM productos WHERE numero_serie IN ({marcadores_serie}) OR producto_id IN ({marcadores_id})",
+                (*bloque, *ids)):
+            if numero_serie is not None:
+                por_serie[numero_serie] = producto_id
+            por_id[str(producto_id)] = producto_id
+    return {c: por_serie.get(c, por_id.get(c)) for c in codigos}
+
+def _resolver_producto(cur, codigo):
+    """Busca el producto de un único código escaneado."""
+    return _resolver_productos(cur, [codigo]).get((codigo or '').strip())
+
+# ----------------------------------------------------------------------------
+# Salas de Socket.IO: cada cliente recibe sólo lo que le interesa
+# ----------------------------------------------------------------------------
+SALA_TODOS = 'todos'
+TIPOS_ESCANEO = telemetria.TIPOS_ESCANEO
+FILTROS_SALA = {
+    'tienda_id': 'tienda',
+    'dispositivo': 'dispositivo',
+    'tipo': 'tipo',
+    'toma_id': 'toma',
+    'documento_envio_id': 'documento_envio',
+    'reporte_id': 'reporte',
+}
+
+def _sala(filtro, valor):
+    return f'{FILTROS_SALA[filtro]}:{valor}'
+
+def _salas_de_filtros(data):
+    """Traduce {'tienda_id': 3, 'tipo': ['NFC', 'QR']} a nombres de sala; ignora filtros desconocidos."""
+    salas = []
+    for filtro, valores in (data or {}).items():
+        if filtro not in FILTROS_SALA:
+            continue
+        for valor in valores if isinstance(valores, list) else [valores]:
+            if filtro == 'tipo':
+                valor = str(valor).upper()
+                if valor not in TIPOS_ESCANEO:
+                    continue
+            elif filtro in SALAS_RESTRINGIDAS:
+                try:
+                    valor = int(valor)
+                except (TypeError, ValueError):
+                    continue
+            salas.append(_sala(filtro, valor))
+    return salas
+
+# Salas con datos de tomas, documentos y reportes: como sus páginas, son sólo para
+# administradores, y únicamente de registros que existen.
+SALAS_RESTRINGIDAS = {
+    'toma_id': "SELECT 1 FROM tomas_inventario WHERE toma_id = ?",
+    'documento_envio_id': "SELECT 1 FROM documentos_envio WHERE documento_id = ?",
+    'reporte_id': "SELECT 1 FROM reportes WHERE reporte_id = ?",
+}
+
+def _existen_registros(conn, pedidos):
+    for filtro, valor in pedidos:
+        if not conn.execute(SALAS_RESTRINGIDAS[filtro], (valor,)).fetchone():
+            return False
+    return True
+
+def _salas_autorizadas(data):
+    """False si el cliente pide una sala restringida sin ser administrador o de un registro inexistente."""
+    pedidos = []
+    for filtro, valores in (data or {}).items():
+        if filtro not in SALAS_RESTRINGIDAS:
+            continue
+        for valor in valores if isinstance(valores, list) else [valores]:
+            try:
+                pedidos.append((filtro, int(valor)))
+            except (TypeError, ValueError):
+                return False
+    if not pedidos:
+        return True
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return False
+    return ejecutor_bd.ejecutar(_en_conexion, _existen_registros, pedidos)
+
+def _id_dispositivo(device_info, ip_address):
+    """Identificador estable del equipo que escanea; si la app no lo envía se usa la IP."""
+    if isinstance(device_info, dict):
+        for clave in ('deviceId', 'device_id', 'uuid', 'id'):
+            if device_info.get(clave):
+                return str(device_info[clave])
+    return ip_address or 'desconocido'
+
+def _emitir_lectura(evento, reading, tipo, dispositivo, tienda_id=None):
+    """Emite una lectura sólo a las salas interesadas (más la sala general de los paneles sin filtro)."""
+    salas = [SALA_TODOS, _sala('tipo', tipo.upper()), _sala('dispositivo', dispositivo)]
+    if tienda_id is not None:
+        salas.append(_sala('tienda_id', tienda_id))
+    socketio.emit(evento, reading, to=salas)
+
+# ----------------------------------------------------------------------------
+# Escaneos duplicados (reintentos de la app y dobles toques del lector)
+# ----------------------------------------------------------------------------
+def _client_scan_id(data):
+    valor = data.get('client_scan_id') or data.get('clientScanId')
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    if not valor or len(valor) > 128:
+        raise ValueError('client_scan_id debe tener entre 1 y 128 caracteres.')
+    return valor
+
+def _escaneo_duplicado(client_scan_id, clave_contenido):
+    """
+    Lectura original si el escaneo es un reintento (mismo client_scan_id, en
+    memoria o en la base) o si el mismo equipo envió el mismo contenido dentro
+    de la ventana de deduplicación. None si es un escaneo nuevo.
+    """
+    if client_scan_id:
+        previa = recientes_por_id.buscar(client_scan_id)
+        if previa is None:
+            previa = ejecutor_bd.ejecutar(db.buscar_por_client_scan_id, client_scan_id)
+        if previa is not None:
+            return previa
+    if clave_contenido is not None:
+        return recientes_por_contenido.buscar(clave_contenido)
+    return None
+
+def _recordar_escaneo(reading, client_scan_id, clave_contenido):
+    original = {'id': reading['id'], 'timestamp': reading['timestamp'], 'duplicado': True}
+    if client_scan_id:
+        recientes_por_id.registrar(client_scan_id, original)
+    if clave_contenido is not None:
+        recientes_por_contenido.registrar(clave_contenido, original)
+
+# ----------------------------------------------------------------------------
+# Límites de ingesta (tamaño del escaneo y tasa por equipo)
+# ----------------------------------------------------------------------------
+def _escaneo_demasiado_grande():
+    """
+    413 si el cuerpo supera ITEC_MAX_BYTES_ESCANEO. Se revisa antes de leer el
+    JSON; como raw_data guarda el cuerpo completo, también acota lo que se almacena.
+    Sin Content-Length (subida por partes) se lee el cuerpo, pero nunca más de
+    MAX_CONTENT_LENGTH bytes.
+    """
+    if request.content_length is not None:
+        tamano = request.content_length
+    else:
+        try:
+            tamano = len(request.get_data())
+        except RequestEntityTooLarge:
+            tamano = MAX_BYTES_ESCANEO + 1
+    if tamano <= MAX_BYTES_ESCANEO:
+        return None
+    limitador.registrar_demasiado_grande()
+    return jsonify({'success': False, 'message': f'El escaneo supera el tamaño máximo de {MAX_BYTES_ESCANEO} bytes.'}), 413
+
+def _equipo_limitado(device_info):
+    """429 con Retry-After si el equipo o su IP agotaron su balde de escaneos; None si puede seguir."""
+    espera = limitador.consumir(_id_dispositivo(device_info, request.remote_addr), request.remote_addr)
+    if not espera:
+        return None
+    respuesta = jsonify({'success': False, 'message': f'Demasiados escaneos desde este equipo; reintente en {espera} s.'})
+    respuesta.headers['Retry-After'] = str(espera)
+    return respuesta, 429
+
+def _bd_ocupada(error):
+    mensaje = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in mensaje or 'busy' in mensaje)
+
+def _guardar_o_encolar(entrada):
+    """
+    Guarda la lectura o, si la base de telemetría sigue bloqueada tras
+    SPOOL_ESPERA_BD segundos (o con ITEC_SPOOL_MODO=siempre), la deja en el
+    spool en disco. Devuelve (lectura, None) o (None, entrada_del_spool).
+    """
+    if SPOOL_MODO != 'siempre':
+        try:
+            reading = ejecutor_bd.ejecutar(
+                db.save_reading, entrada['device_info'], entrada['nfc_data'], entrada['ip_address'], entrada['user_agent'],
+                entrada.get('client_scan_id'), timeout=SPOOL_ESPERA_BD if SPOOL_MODO == 'respaldo' else None)
+            return reading, None
+        except sqlite3.OperationalError as e:
+            if SPOOL_MODO == 'no' or not _bd_ocupada(e):
+                raise
+    encolada = ejecutor_bd.ejecutar(spool.agregar, dict(entrada, timestamp=datetime.now().isoformat()))
+    return None, encolada
+
+def _usuario_id_sesion(cur):
+    """ID del usuario en sesión. Se guarda en la sesión para no consultarlo en cada POST."""
+    if session.get('usuario_id') is None:
+        fila = cur.execute("SELECT usuario_id FROM usuarios WHERE nombre_usuario = ?", (session.get('usuario'),)).fetchone()
+        if fila:
+            session['usuario_id'] = fila[0]
+    return session.get('usuario_id')
+
 # ============================================================================
 # INICIALIZACIÓN DE LA BASE DE DATOS DE INVENTARIO
 # ============================================================================
 def init_inventory_db():
     """
-    Verifica las tablas de inventario. No crea tablas que ya existen.
-    Asegura que la tabla 'tipos_movimiento' tenga datos básicos si está vacía.
+    Prepara la base de telemetría (tablas, lecturas heredadas y agregados),
+    aplica las migraciones pendientes de la base de inventario (ver migraciones/)
+    y pone al día los triggers del registro de cambios.
     """
+    db.init_database()
     with obtener_conexion() as conn:
-        cur = conn.cursor()
-        cur.execute("CREATE TABLE IF NOT EXISTS tipos_movimiento (tipo_movimiento_id INTEGER PRIMARY KEY, nombre TEXT NOT NULL UNIQUE)")
-        
-        if cur.execute("SELECT COUNT(*) FROM tipos_movimiento").fetchone()[0] == 0:
-            print("INFO: Poblando la tabla 'tipos_movimiento' con valores por defecto.")
-            try:
-                cur.executemany("INSERT INTO tipos_movimiento (tipo_movimiento_id, nombre) VALUES (?, ?)", [
-                    (1, 'Asignación'), (2, 'Devolución'), (3, 'Baja'), (4, 'Préstamo')
-                ])
-                conn.commit()
-            except sqlite3.IntegrityError:
-                pass
+        # WAL: las lecturas de las páginas no bloquean a las escrituras de inventario.
+        # El modo queda guardado en el archivo; el checkpoint automático se deja por defecto.
+        conn.execute("PRAGMA journal_mode = WAL")
+        migraciones.aplicar(conn)
+        # Se revisan en cada arranque para que sigan las columnas que agreguen las migraciones.
+        registro_cambios.actualizar_triggers(conn)
+        registro_cambios.compactar(conn, CDC_RETENCION_DIAS)
         
         print("INFO: Base de datos de inventario verificada.")
 
@@ -1177,6 +1481,139 @@ def enviar_producto_tienda(producto_id):
 
     return render_template('enviar_producto_tienda.html', producto=producto, tiendas=tiendas, **session_vars())
 
+# ============================================================================
+# RUTAS - DOCUMENTOS DE ENVÍO A TIENDA (VARIOS PRODUCTOS POR ENVÍO)
+# ============================================================================
+@app.route('/envios/documentos', methods=['GET', 'POST'])
+def lista_documentos_envio():
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        try:
+            with obtener_conexion() as conn:
+                documento_id = documentos_envio.crear_documento(conn, request.form.get('tienda_id'), _usuario_id_sesion(conn.cursor()))
+            return redirect(url_for('detalle_documento_envio', documento_id=documento_id))
+        except ValueError as e:
+            flash(str(e), 'warning')
+        except Exception as e:
+            flash(f'Error al crear el documento de envío: {e}', 'danger')
+        return redirect(url_for('lista_documentos_envio'))
+
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        documentos = cur.execute("""
+            SELECT d.*, t.nombre_tienda, COUNT(l.producto_id) AS total_lineas, COALESCE(SUM(l.cantidad), 0) AS total_unidades
+            FROM documentos_envio d
+            JOIN tiendas t ON d.tienda_id = t.tienda_id
+            LEFT JOIN documentos_envio_lineas l ON d.documento_id = l.documento_id
+            GROUP BY d.documento_id
+            ORDER BY d.documento_id DESC
+        """).fetchall()
+        tiendas = cur.execute("SELECT tienda_id, nombre_tienda FROM tiendas ORDER BY nombre_tienda").fetchall()
+
+    return render_template('lista_documentos_envio.html', documentos=documentos, tiendas=tiendas, **session_vars())
+
+@app.route('/envios/documentos/<int:documento_id>', methods=['GET', 'POST'])
+def detalle_documento_envio(documento_id):
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        codigo = (request.form.get('codigo') or '').strip()
+        try:
+            with obtener_conexion() as conn:
+                producto_id = _resolver_producto(conn.cursor(), codigo)
+                if producto_id is None:
+                    flash(f'No se encontró un producto con el código "{codigo}".', 'warning')
+                else:
+                    documentos_envio.agregar_lineas(conn, documento_id, [(producto_id, request.form.get('cantidad', 1))])
+        except ValueError as e:
+            flash(str(e), 'warning')
+        except Exception as e:
+            flash(f'Error al agregar la línea: {e}', 'danger')
+        return redirect(url_for('detalle_documento_envio', documento_id=documento_id))
+
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        documento = conn.execute("""
+            SELECT d.*, t.nombre_tienda FROM documentos_envio d
+            JOIN tiendas t ON d.tienda_id = t.tienda_id
+            WHERE d.documento_id = ?
+        """, (documento_id,)).fetchone()
+        if not documento:
+            flash('Documento de envío no encontrado.', 'danger')
+            return redirect(url_for('lista_documentos_envio'))
+        lineas = documentos_envio.obtener_lineas(conn, documento_id)
+
+    return render_template('detalle_documento_envio.html', documento=documento, lineas=lineas, **session_vars())
+
+@app.route('/envios/documentos/<int:documento_id>/confirmar', methods=['POST'])
+def confirmar_documento_envio(documento_id):
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return redirect(url_for('dashboard'))
+
+    try:
+        with obtener_conexion() as conn:
+            exito, mensaje, faltantes = documentos_envio.confirmar(conn, documento_id, _usuario_id_sesion(conn.cursor()))
+        for f in faltantes:
+            flash(f"{f['nombre'] or f['producto_id']}: solicitado {f['solicitado']}, disponible {f['disponible']}.", 'warning')
+        flash(mensaje, 'success' if exito else 'danger')
+    except Exception as e:
+        flash(f'Error al procesar el envío: {e}', 'danger')
+    return redirect(url_for('detalle_documento_envio', documento_id=documento_id))
+
+@app.route('/api/envios', methods=['POST'])
+def api_crear_envio():
+    """
+    Crea un documento de envío con todas sus líneas y opcionalmente lo confirma.
+    Cuerpo: {"tienda_id": 1, "lineas": [{"codigo": "SN-1", "cantidad": 2}, ...], "confirmar": true}
+    """
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'El cuerpo debe ser un objeto JSON.'}), 400
+    lineas = data.get('lineas') or []
+    if not isinstance(lineas, list) or not all(isinstance(l, dict) for l in lineas):
+        return jsonify({'success': False, 'message': "'lineas' debe ser una lista de objetos {codigo, cantidad}."}), 400
+    try:
+        cantidades = [int(l.get('cantidad', 1)) for l in lineas]
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Las cantidades deben ser números enteros.'}), 400
+    if any(c <= 0 for c in cantidades):
+        return jsonify({'success': False, 'message': 'Las cantidades deben ser mayores que cero.'}), 400
+    try:
+        with obtener_conexion() as conn:
+            cur = conn.cursor()
+            codigos = [str(l.get('codigo', l.get('producto_id', ''))) for l in lineas]
+            resueltos = _resolver_productos(cur, codigos)
+            desconocidos = [c for c in codigos if resueltos.get(c.strip()) is None]
+            if desconocidos:
+                return jsonify({'success': False, 'message': 'Hay códigos sin producto asociado.', 'desconocidos': desconocidos}), 400
+
+            documento_id = documentos_envio.crear_documento(conn, data.get('tienda_id'), _usuario_id_sesion(cur))
+            # Si algo falla después de crear el borrador se elimina: la API crea el documento completo o nada.
+            exito = False
+            try:
+                documentos_envio.agregar_lineas(conn, documento_id, [(resueltos[c.strip()], n) for c, n in zip(codigos, cantidades)])
+                if not data.get('confirmar'):
+                    exito = True
+                    return jsonify({'success': True, 'documento_id': documento_id, 'estado': 'Borrador'}), 201
+                exito, mensaje, faltantes = documentos_envio.confirmar(conn, documento_id, _usuario_id_sesion(cur))
+            finally:
+                if not exito:
+                    documentos_envio.eliminar_borrador(conn, documento_id)
+        if not exito:
+            return jsonify({'success': False, 'message': mensaje, 'faltantes': faltantes}), 409
+        return jsonify({'success': True, 'message': mensaje, 'documento_id': documento_id, 'faltantes': faltantes}), 201
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error procesando el envío: {str(e)}'}), 500
+
 # ============================================================================
 # RUTA - REPORTE DE UBICACIÓN DE INVENTARIO
 # ============================================================================
@@ -1268,31 +1705,16 @@ def stock_tiendas():
             conn.row_factory = sqlite3.Row
             cur = conn.cursor()
 
-            # Primero, obtenemos todas las tiendas
-            tiendas = cur.execute("SELECT * FROM tiendas ORDER BY nombre_tienda").fetchall()
-
-            for tienda in tiendas:
-                # Por cada tienda, calculamos el stock de sus productos
-                productos_en_tienda = cur.execute("""
-                    SELECT
-                        p.producto_id,
-                        p.nombre as nombre_producto,
-                        SUM(CASE WHEN et.envio_id IS NOT NULL THEN et.cantidad_enviada ELSE 0 END) -
-                        SUM(CASE WHEN rt.retiro_id IS NOT NULL AND rt.estado = 'Completado' THEN rt.cantidad_retirada ELSE 0 END) as stock_en_tienda
-                    FROM productos p
-                    LEFT JOIN envios_tienda et ON p.producto_id = et.producto_id AND et.tienda_id = ?
-                    LEFT JOIN retiros_tienda rt ON p.producto_id = rt.producto_id AND rt.tienda_id = ?
-                    WHERE et.tienda_id = ? OR rt.tienda_id = ?
-                    GROUP BY p.producto_id, p.nombre
-                    HAVING stock_en_tienda > 0
-                """, (tienda['tienda_id'], tienda['tienda_id'], tienda['tienda_id'], tienda['tienda_id'])).fetchall()
-
-                if productos_en_tienda:
+            # Una sola consulta agrupada por tienda y producto (antes, una por tienda).
+            sql, parametros = reportes.consulta_stock_tiendas()
+            for fila in cur.execute(sql, parametros).fetchall():
+                if not stock_por_tienda or stock_por_tienda[-1]['tienda_id'] != fila['tienda_id']:
                     stock_por_tienda.append({
-                        'tienda_id': tienda['tienda_id'],
-                        'nombre_tienda': tienda['nombre_tienda'],
-                        'productos': productos_en_tienda
+                        'tienda_id': fila['tienda_id'],
+                        'nombre_tienda': fila['nombre_tienda'],
+                        'productos': []
                     })
+                stock_por_tienda[-1]['productos'].append(fila)
     except Exception as e:
         flash(f'Error al cargar el stock de tiendas: {e}', 'danger')
 
@@ -1396,8 +1818,148 @@ def confirmar_recepcion_retiro(retiro_id):
         # Asegurarnos de cerrar la conexión
         if conn:
             conn.close()
-    
+
     return redirect(url_for('lista_retiros_pendientes'))
+
+@app.route('/retiros/confirmar-lote', methods=['POST'])
+def confirmar_retiros_lote():
+    """
+    Confirma varios retiros a la vez. Acepta el formulario de la lista de pendientes
+    (casillas 'retiro_ids' o 'todos') o JSON {"retiro_ids": [...]} / {"todos": true}.
+    """
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        if request.is_json:
+            return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+        return redirect(url_for('dashboard'))
+
+    if request.is_json:
+        data = request.json or {}
+        if not isinstance(data, dict):
+            return jsonify({'success': False, 'message': 'El cuerpo debe ser un objeto JSON.'}), 400
+        todos, retiro_ids = bool(data.get('todos')), data.get('retiro_ids') or []
+    else:
+        todos, retiro_ids = bool(request.form.get('todos')), request.form.getlist('retiro_ids')
+
+    try:
+        if not todos and not retiro_ids:
+            raise ValueError('No se seleccionó ningún retiro.')
+        if not todos:
+            if not isinstance(retiro_ids, list):
+                raise ValueError("'retiro_ids' debe ser una lista de identificadores.")
+            try:
+                retiro_ids = [int(r) for r in retiro_ids]
+            except (TypeError, ValueError):
+                raise ValueError('Los identificadores de retiro deben ser números enteros.')
+        with obtener_conexion() as conn:
+            resumen = retiros_tienda.confirmar_lote(conn, None if todos else retiro_ids, _usuario_id_sesion(conn.cursor()))
+    except ValueError as e:
+        if request.is_json:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        flash(str(e), 'warning')
+        return redirect(url_for('lista_retiros_pendientes'))
+    except Exception as e:
+        if request.is_json:
+            return jsonify({'success': False, 'message': f'Error al confirmar los retiros: {str(e)}'}), 500
+        flash(f'Error al confirmar los retiros: {e}', 'danger')
+        return redirect(url_for('lista_retiros_pendientes'))
+
+    if request.is_json:
+        return jsonify({'success': True, 'resumen': resumen})
+    flash(f"Se confirmaron {resumen['confirmados']} retiros ({resumen['unidades_recibidas']} unidades en {resumen['productos_actualizados']} productos).", 'success')
+    if resumen['omitidos']:
+        flash(f"{resumen['omitidos']} retiros ya estaban procesados o no existen.", 'warning')
+    return redirect(url_for('lista_retiros_pendientes'))
+
+# ============================================================================
+# RUTAS - TOMA DE INVENTARIO (CONTEO FÍSICO POR ESCANEO)
+# ============================================================================
+def _reporte_toma_con_nombres(cur, toma):
+    """Agrega el nombre de cada producto al reporte de diferencias de una toma."""
+    reporte = toma.reporte()
+    ids = {item['producto_id'] for clave in ('faltantes', 'duplicados', 'inesperados') for item in reporte[clave]}
+    nombres = {}
+    if ids:
+        marcadores = ','.join('?' * len(ids))
+        nombres = {f[0]: f[1] for f in cur.execute(f"SELECT producto_id, nombre FROM productos WHERE producto_id IN ({marcadores})", tuple(ids))}
+    for clave in ('faltantes', 'duplicados', 'inesperados'):
+        for item in reporte[clave]:
+            item['nombre'] = nombres.get(item['producto_id'], f"Producto {item['producto_id']}")
+    return reporte
+
+@app.route('/inventario/tomas', methods=['GET', 'POST'])
+def lista_tomas_inventario():
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        flash('No tienes permisos para acceder a esta sección.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        tipo_ubicacion = request.form.get('tipo_ubicacion')
+        ubicacion = (request.form.get('ubicacion') or '').strip()
+        try:
+            with obtener_conexion() as conn:
+                toma = tomas.abrir(conn, tipo_ubicacion, ubicacion, _usuario_id_sesion(conn.cursor()))
+            flash(f'Toma de inventario #{toma.toma_id} abierta.', 'success')
+            return redirect(url_for('detalle_toma_inventario', toma_id=toma.toma_id))
+        except ValueError as e:
+            flash(str(e), 'warning')
+        except Exception as e:
+            flash(f'Error al abrir la toma de inventario: {e}', 'danger')
+        return redirect(url_for('lista_tomas_inventario'))
+
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        lista = cur.execute("""
+            SELECT ti.*, t.nombre_tienda
+            FROM tomas_inventario ti
+            LEFT JOIN tiendas t ON ti.tipo_ubicacion = 'Tienda' AND t.tienda_id = ti.ubicacion
+            ORDER BY ti.toma_id DESC
+        """).fetchall()
+        tiendas = cur.execute("SELECT tienda_id, nombre_tienda FROM tiendas ORDER BY nombre_tienda").fetchall()
+        ubicaciones = [f[0] for f in cur.execute("SELECT DISTINCT ubicacion_fisica FROM productos WHERE ubicacion_fisica IS NOT NULL ORDER BY ubicacion_fisica")]
+
+    return render_template('lista_tomas_inventario.html', tomas=lista, tiendas=tiendas, ubicaciones=ubicaciones, tipos_ubicacion=TIPOS_UBICACION, **session_vars())
+
+@app.route('/inventario/tomas/<int:toma_id>')
+def detalle_toma_inventario(toma_id):
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        flash('No tienes permisos para acceder a esta sección.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    with obtener_conexion() as conn:
+        toma = tomas.obtener(conn, toma_id)
+        if not toma:
+            flash('Toma de inventario no encontrada.', 'danger')
+            return redirect(url_for('lista_tomas_inventario'))
+        reporte = _reporte_toma_con_nombres(conn.cursor(), toma)
+
+    return render_template('detalle_toma_inventario.html', reporte=reporte, **session_vars())
+
+@app.route('/inventario/tomas/<int:toma_id>/cerrar', methods=['POST'])
+def cerrar_toma_inventario(toma_id):
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return redirect(url_for('dashboard'))
+
+    with obtener_conexion() as conn:
+        toma = tomas.obtener(conn, toma_id)
+        if toma:
+            tomas.cerrar(conn, toma)
+            flash(f'Toma de inventario #{toma_id} cerrada.', 'success')
+        else:
+            flash('Toma de inventario no encontrada.', 'danger')
+    return redirect(url_for('detalle_toma_inventario', toma_id=toma_id))
+
+@app.route('/api/tomas-inventario/<int:toma_id>')
+def api_reporte_toma_inventario(toma_id):
+    """Reporte en vivo de diferencias de una toma de inventario."""
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+    with obtener_conexion() as conn:
+        toma = tomas.obtener(conn, toma_id)
+        if not toma:
+            return jsonify({'success': False, 'message': 'Toma de inventario no encontrada.'}), 404
+        return jsonify({'success': True, 'reporte': _reporte_toma_con_nombres(conn.cursor(), toma)})
+
 # ============================================================================
 # RUTAS - GESTIÓN DE INVENTARIO (ADAPTADO A TU ESQUEMA DE BD)
 # ============================================================================
@@ -1478,6 +2040,133 @@ def crear_asignacion():
 
     return render_template('crear_asignacion.html', productos=productos, usuarios=usuarios, tipos_movimiento=tipos_movimiento, usuario=session.get('nombre'), permiso=session.get('permiso'), fecha=datetime.now().strftime('%d/%m/%Y %H:%M'))
 
+def _asignar_lote_db(conn, usuario_id, codigos, tipo_movimiento_id, responsable_id, comentarios=None):
+    """
+    Registra un movimiento para varios productos escaneados en una sola transacción.
+    Devuelve una lista con el resultado de cada código, en el orden recibido.
+    """
+    cur = conn.cursor()
+    if not cur.execute("SELECT 1 FROM usuarios WHERE usuario_id = ?", (usuario_id,)).fetchone():
+        raise ValueError('El usuario asignado no existe.')
+    tipo = cur.execute("SELECT nombre FROM tipos_movimiento WHERE tipo_movimiento_id = ?", (tipo_movimiento_id,)).fetchone()
+    if not tipo:
+        raise ValueError('El tipo de movimiento no existe.')
+    tipo_nombre = _slugify(tipo[0])
+    if 'asignacion' in tipo_nombre or 'baja' in tipo_nombre:
+        delta = -1
+    elif 'devolucion' in tipo_nombre:
+        delta = 1
+    else:
+        delta = 0
+
+    # Resolución de todos los códigos en una consulta, antes de abrir la transacción.
+    resueltos = _resolver_productos(cur, codigos)
+
+    resultados, vistos, movimientos = [], set(), []
+    fecha = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for codigo in codigos:
+            codigo = (codigo or '').strip()
+            producto_id = resueltos.get(codigo)
+            if producto_id is None:
+                resultados.append({'codigo': codigo, 'producto_id': None, 'resultado': 'no_encontrado'})
+                continue
+            if producto_id in vistos:
+                resultados.append({'codigo': codigo, 'producto_id': producto_id, 'resultado': 'duplicado'})
+                continue
+            vistos.add(producto_id)
+
+            # La verificación de stock y el descuento son una sola sentencia.
+            if delta < 0:
+                actualizado = conn.execute("UPDATE productos SET stock_actual = stock_actual - 1 WHERE producto_id = ? AND stock_actual >= 1",
+                                           (producto_id,)).rowcount
+                if not actualizado:
+                    resultados.append({'codigo': codigo, 'producto_id': producto_id, 'resultado': 'sin_stock'})
+                    continue
+            elif delta > 0:
+                conn.execute("UPDATE productos SET stock_actual = stock_actual + 1 WHERE producto_id = ?", (producto_id,))
+
+            movimientos.append((usuario_id, producto_id, fecha, tipo_movimiento_id, responsable_id, comentarios))
+            resultados.append({'codigo': codigo, 'producto_id': producto_id, 'resultado': 'registrado'})
+
+        conn.executemany("INSERT INTO historico_asignaciones (usuario_id, producto_id, fecha_asignacion, tipo_movimiento_id, responsable_id, comentarios) VALUES (?, ?, ?, ?, ?, ?)",
+                         movimientos)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return resultados
+
+def _leer_codigos(texto):
+    """Separa los códigos pegados o escaneados en un área de texto (líneas, comas o punto y coma)."""
+    return [c.strip() for c in (texto or '').replace(',', '\n').replace(';', '\n').splitlines() if c.strip()]
+
+@app.route('/inventario/asignaciones/lote', methods=['GET', 'POST'])
+def crear_asignacion_lote():
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        flash('No tienes permisos para acceder a esta sección.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    resultados = None
+    if request.method == 'POST':
+        codigos = _leer_codigos(request.form.get('codigos'))
+        if not request.form.get('usuario_id') or not codigos:
+            flash('Debes indicar el usuario asignado y al menos un código.', 'danger')
+        else:
+            try:
+                with obtener_conexion() as conn:
+                    resultados = _asignar_lote_db(conn, request.form.get('usuario_id'), codigos,
+                                                  request.form.get('tipo_movimiento_id', 1), _usuario_id_sesion(conn.cursor()),
+                                                  request.form.get('comentarios'))
+                registrados = sum(1 for r in resultados if r['resultado'] == 'registrado')
+                flash(f'Se registraron {registrados} de {len(resultados)} productos.', 'success' if registrados == len(resultados) else 'warning')
+            except ValueError as e:
+                flash(str(e), 'warning')
+            except Exception as e:
+                flash(f'Error al registrar las asignaciones: {e}', 'danger')
+
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        cur = conn.cursor()
+        usuarios = cur.execute("SELECT u.usuario_id, p.primer_nombre || ' ' || p.apellido_pat as nombre_completo FROM usuarios u JOIN personas p ON u.persona_rut = p.rut ORDER BY nombre_completo").fetchall()
+        tipos_movimiento = cur.execute("SELECT tipo_movimiento_id, nombre FROM tipos_movimiento ORDER BY nombre").fetchall()
+
+    return render_template('asignacion_lote.html', usuarios=usuarios, tipos_movimiento=tipos_movimiento, resultados=resultados, form=request.form, **session_vars())
+
+@app.route('/api/asignaciones/lote', methods=['POST'])
+def api_asignacion_lote():
+    """
+    Asigna varios productos escaneados a un usuario.
+    Cuerpo: {"usuario_id": 5, "codigos": ["SN-1", "SN-2"], "tipo_movimiento_id": 1, "comentarios": "..."}
+    """
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+
+    data = request.json or {}
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'message': 'El cuerpo debe ser un objeto JSON.'}), 400
+    codigos = data.get('codigos')
+    if not isinstance(codigos, list) or not all(isinstance(c, str) and c.strip() for c in codigos):
+        return jsonify({'success': False, 'message': "'codigos' debe ser una lista de códigos no vacíos."}), 400
+    if not data.get('usuario_id') or not codigos:
+        return jsonify({'success': False, 'message': 'usuario_id y codigos son obligatorios.'}), 400
+    try:
+        with obtener_conexion() as conn:
+            resultados = _asignar_lote_db(conn, data['usuario_id'], codigos, data.get('tipo_movimiento_id', 1),
+                                          _usuario_id_sesion(conn.cursor()), data.get('comentarios'))
+        return jsonify({
+            'success': True,
+            'registrados': sum(1 for r in resultados if r['resultado'] == 'registrado'),
+            'resultados': resultados
+        })
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error registrando asignaciones: {str(e)}'}), 500
+
 
 # ============================================================================
 # RUTAS - GESTIÓN DE MANTENIMIENTOS
@@ -1641,8 +2330,114 @@ app.add_url_rule('/crear_lecturas', 'crear_lecturas', placeholder_route)
 app.add_url_rule('/lista_lecturas', 'lista_lecturas', placeholder_route)
 app.add_url_rule('/crear_personas', 'crear_personas', placeholder_route)
 #app.add_url_rule('/lista_personas', 'lista_personas', placeholder_route)
-app.add_url_rule('/crear_reportes', 'crear_reportes', placeholder_route)
-app.add_url_rule('/lista_reportes', 'lista_reportes', placeholder_route)
+
+# ============================================================================
+# RUTAS - REPORTES EN SEGUNDO PLANO (ver reportes.py)
+# ============================================================================
+def _avance_reporte(reporte):
+    return {k: reporte[k] for k in ('reporte_id', 'estado', 'progreso', 'etapa', 'filas', 'error')}
+
+@app.route('/crear_reportes', methods=['GET', 'POST'])
+def crear_reportes():
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        flash('No tienes permisos para acceder.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    if request.method == 'POST':
+        try:
+            with obtener_conexion() as conn:
+                reporte_id, reutilizado = reportes.solicitar(conn, request.form.get('tipo'), request.form,
+                                                             _usuario_id_sesion(conn.cursor()))
+            if reutilizado:
+                flash(f'Ya había un reporte igual reciente o en curso (#{reporte_id}); se muestra ese.', 'info')
+            else:
+                flash(f'Reporte #{reporte_id} en cola. Puedes dejar esta página; el resultado queda en la lista de reportes.', 'success')
+            return redirect(url_for('detalle_reporte', reporte_id=reporte_id))
+        except ValueError as e:
+            flash(str(e), 'warning')
+        except Exception as e:
+            flash(f'Error al solicitar el reporte: {e}', 'danger')
+        return redirect(url_for('crear_reportes'))
+
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        tiendas = conn.execute("SELECT tienda_id, nombre_tienda FROM tiendas ORDER BY nombre_tienda").fetchall()
+    return render_template('crear_reporte.html', tipos=reportes.TIPOS, tiendas=tiendas, **session_vars())
+
+@app.route('/lista_reportes')
+def lista_reportes():
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        flash('No tienes permisos para acceder.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        lista = reportes.listar(conn)
+    return render_template('lista_reportes.html', reportes=lista, **session_vars())
+
+@app.route('/reportes/<int:reporte_id>')
+def detalle_reporte(reporte_id):
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        flash('No tienes permisos para acceder.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        reporte = reportes.obtener(conn, reporte_id)
+    if not reporte:
+        flash('Reporte no encontrado.', 'danger')
+        return redirect(url_for('lista_reportes'))
+    pagina = max(request.args.get('pagina', 1, type=int), 1)
+    columnas, filas = reportes.leer_pagina(reporte_id, pagina) if reporte['estado'] == 'Listo' else ([], [])
+    return render_template('detalle_reporte.html', reporte=reporte, columnas=columnas, filas=filas, pagina=pagina,
+                           por_pagina=reportes.FILAS_POR_PAGINA, **session_vars())
+
+@app.route('/reportes/<int:reporte_id>/descargar')
+def descargar_reporte(reporte_id):
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        flash('No tienes permisos para acceder.', 'danger')
+        return redirect(url_for('dashboard'))
+
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        reporte = reportes.obtener(conn, reporte_id)
+    if not reporte or reporte['estado'] != 'Listo' or not os.path.exists(reportes.ruta_resultado(reporte_id)):
+        abort(404)
+    nombre = f"{reporte['tipo']}_{reporte['reporte_id']}_{reporte['fecha_fin'][:10]}.csv"
+    return send_file(os.path.abspath(reportes.ruta_resultado(reporte_id)), as_attachment=True,
+                     download_name=nombre, mimetype='text/csv')
+
+@app.route('/api/reportes', methods=['POST'])
+def api_solicitar_reporte():
+    """Pide un reporte: {"tipo": "stock_tiendas", "parametros": {"tienda_id": 3}}. Responde sin esperar el cálculo."""
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+    data = request.get_json(silent=True) or {}
+    if not isinstance(data, dict) or not isinstance(data.get('parametros') or {}, dict):
+        return jsonify({'success': False, 'message': "'parametros' debe ser un objeto, p. ej. {\"tienda_id\": 3}."}), 400
+    try:
+        with obtener_conexion() as conn:
+            conn.row_factory = sqlite3.Row
+            reporte_id, reutilizado = reportes.solicitar(conn, data.get('tipo'), data.get('parametros'),
+                                                         _usuario_id_sesion(conn.cursor()))
+            reporte = reportes.obtener(conn, reporte_id)
+        return jsonify({'success': True, 'reutilizado': reutilizado, **_avance_reporte(reporte)}), 200 if reutilizado else 202
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error al solicitar el reporte: {str(e)}'}), 500
+
+@app.route('/api/reportes/<int:reporte_id>')
+def api_estado_reporte(reporte_id):
+    """Estado y avance de un reporte (lo mismo que se emite en 'reporte_progreso')."""
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        reporte = reportes.obtener(conn, reporte_id)
+    if not reporte:
+        return jsonify({'success': False, 'message': 'Reporte no encontrado.'}), 404
+    return jsonify({'success': True, **_avance_reporte(reporte)})
 
 
 # ============================================================================
@@ -1651,7 +2446,7 @@ app.add_url_rule('/lista_reportes', 'lista_reportes', placeholder_route)
 @app.route('/dashboard_api')
 def dashboard_api():
     """Página principal con panel de control"""
-    stats = db.get_stats()
+    stats = ejecutor_bd.ejecutar(db.get_stats)
     return render_template('dashboard_api.html', stats=stats, apk_exists=APK_EXISTS)
 
 @app.route('/realtime_dashboard')
@@ -1662,12 +2457,30 @@ def realtime_dashboard():
 @app.route('/history')
 def history():
     """Historial de lecturas"""
-    readings = db.get_all_readings(limit=50)
+    readings = ejecutor_bd.ejecutar(db.get_all_readings, limit=50)
     return render_template('history.html', readings=readings)
 
 # ============================================================================
 # RUTAS API - ESCANEOS (NFC/QR/BARCODE)
 # ============================================================================
+def _respuesta_bd_ocupada():
+    """503 con Retry-After: el dispositivo debe reintentar más tarde, no de inmediato."""
+    respuesta = jsonify({'success': False, 'message': 'La base de datos está ocupada; reintente en unos segundos.'})
+    respuesta.headers['Retry-After'] = '2'
+    return respuesta, 503
+
+def _respuesta_escaneo_duplicado(tipo_scan, content, previa):
+    return {
+        'success': True,
+        'duplicate': True,
+        'message': f'Escaneo {tipo_scan} ya registrado.',
+        'data': {
+            'reading_id': previa['id'],
+            'content': content,
+            'timestamp': previa['timestamp']
+        }
+    }
+
 def _procesar_escaneo(data, tipo_scan):
     """Procesa y guarda cualquier tipo de escaneo (NFC, QR, Barcode)."""
     device_info = data.get('deviceInfo', {})
@@ -1682,11 +2495,80 @@ def _procesar_escaneo(data, tipo_scan):
     
     ip_address = request.remote_addr
     user_agent = request.headers.get('User-Agent', '')
-    
-    reading = db.save_reading(device_info, scan_data, ip_address, user_agent)
-    socketio.emit('new_scan_reading', reading)
-    
-    return {
+    dispositivo = _id_dispositivo(device_info, ip_address)
+
+    # Un reintento o un doble toque devuelve la lectura original sin escribir ni emitir.
+    # Las lecturas de una toma de inventario o de un documento de envío cuentan unidades:
+    # dos escaneos seguidos del mismo código son dos unidades, así que sólo se deduplican
+    # por client_scan_id.
+    client_scan_id = _client_scan_id(data)
+    cuenta_unidades = data.get('toma_id') is not None or data.get('documento_envio_id') is not None
+    clave_contenido = None if cuenta_unidades else (dispositivo, tipo_scan.upper(), content)
+    previa = _escaneo_duplicado(client_scan_id, clave_contenido)
+    if previa:
+        return _respuesta_escaneo_duplicado(tipo_scan, content, previa)
+
+    # Escaneo dirigido a una toma de inventario: se valida antes de guardar la lectura.
+    toma_id = data.get('toma_id')
+    toma = None
+    if toma_id is not None:
+        toma = ejecutor_bd.ejecutar(_en_conexion, tomas.obtener, int(toma_id))
+        if not toma or toma.estado != 'Abierta':
+            raise ValueError(f'La toma de inventario {toma_id} no existe o está cerrada.')
+
+    # Escaneo dirigido a un documento de envío: cada lectura suma una unidad del producto.
+    documento_id = data.get('documento_envio_id')
+    if documento_id is not None:
+        documento_id = int(documento_id)
+        producto_id = ejecutor_bd.ejecutar(_en_conexion, lambda conn: _resolver_producto(conn.cursor(), content))
+        if producto_id is None:
+            raise ValueError(f'No se encontró un producto con el código "{content}".')
+
+    # La toma y el documento se actualizan con la lectura ya insertada pero aún sin
+    # confirmar: un reintento con el mismo client_scan_id resulta duplicado antes de
+    # llegar a ellos, y si la toma se cerró o el documento ya no admite unidades la
+    # lectura se descarta en vez de difundirse.
+    cambios = None
+    def registrar_en_destinos(reading):
+        nonlocal cambios
+        with obtener_conexion() as conn:
+            if toma:
+                cambios = tomas.registrar_escaneo(conn, toma, content, _resolver_producto(conn.cursor(), content), reading['id'])
+            if documento_id is not None:
+                documentos_envio.agregar_lineas(conn, documento_id, [(producto_id, 1)])
+
+    tienda_id = data.get('tienda_id', device_info.get('tienda_id') if isinstance(device_info, dict) else None)
+    if toma is None and documento_id is None:
+        # Escaneo simple: si la base está ocupada queda en el spool y se confirma con 202.
+        reading, encolada = _guardar_o_encolar({
+            'device_info': device_info, 'nfc_data': scan_data, 'ip_address': ip_address, 'user_agent': user_agent,
+            'client_scan_id': client_scan_id, 'evento': 'new_scan_reading', 'tipo': tipo_scan,
+            'dispositivo': dispositivo, 'tienda_id': tienda_id,
+        })
+        if encolada:
+            _recordar_escaneo({'id': None, 'timestamp': encolada['timestamp']}, client_scan_id, clave_contenido)
+            return {
+                'success': True,
+                'queued': True,
+                'message': f'Escaneo {tipo_scan} recibido; se guardará en cuanto la base de datos esté disponible.',
+                'data': {
+                    'reading_id': None,
+                    'spool_id': encolada['spool_id'],
+                    'content': content,
+                    'timestamp': encolada['timestamp']
+                }
+            }
+    else:
+        reading = ejecutor_bd.ejecutar(db.save_reading, device_info, scan_data, ip_address, user_agent, client_scan_id,
+                                       antes_de_confirmar=registrar_en_destinos)
+    if reading.get('duplicado'):
+        # Otro proceso guardó el mismo client_scan_id entre la verificación y el INSERT.
+        return _respuesta_escaneo_duplicado(tipo_scan, content, reading)
+
+    _recordar_escaneo(reading, client_scan_id, clave_contenido)
+    _emitir_lectura('new_scan_reading', reading, tipo_scan, dispositivo, tienda_id)
+
+    respuesta = {
         'success': True,
         'message': f'Escaneo {tipo_scan} procesado correctamente.',
         'data': {
@@ -1696,25 +2578,78 @@ def _procesar_escaneo(data, tipo_scan):
         }
     }
 
+    if toma:
+        resumen = toma.resumen()
+        socketio.emit('toma_inventario_update', {'toma_id': toma.toma_id, 'cambios': cambios, 'resumen': resumen},
+                      to=_sala('toma_id', toma.toma_id))
+        respuesta['toma'] = {'cambios': cambios, 'resumen': resumen}
+
+    if documento_id is not None:
+        socketio.emit('documento_envio_update', {'documento_id': documento_id, 'producto_id': producto_id},
+                      to=_sala('documento_envio_id', documento_id))
+        respuesta['documento_envio'] = {'documento_id': documento_id, 'producto_id': producto_id}
+
+    return respuesta
+
 @app.route('/api/scan', methods=['POST'])
 def generic_scan_endpoint():
     """Endpoint genérico para cualquier tipo de escaneo."""
+    rechazo = _escaneo_demasiado_grande()
+    if rechazo:
+        return rechazo
     try:
         data = request.json
+        rechazo = _equipo_limitado(data.get('deviceInfo', {}))
+        if rechazo:
+            return rechazo
         scan_type = data.get('type', 'unknown').lower()
         
         if scan_type not in ['nfc', 'qr', 'barcode']:
             scan_type = 'unknown'
             
         response_data = _procesar_escaneo(data, scan_type)
-        return jsonify(response_data), 200
+        return jsonify(response_data), 202 if response_data.get('queued') else 200
         
     except Exception as e:
+        if _bd_ocupada(e):
+            return _respuesta_bd_ocupada()
         return jsonify({
             'success': False,
             'message': f'Error procesando escaneo: {str(e)}'
         }), 400
 
+# ============================================================================
+# RUTAS API - TENDENCIAS (AGREGADOS POR MINUTO / HORA / DÍA)
+# ============================================================================
+# Ventana por defecto de cada granularidad si no se indica 'desde'.
+VENTANA_TENDENCIAS = {'minuto': timedelta(hours=6), 'hora': timedelta(days=7), 'dia': timedelta(days=90)}
+
+def _tendencias_db(granularidad, desde, hasta, agrupar, filtros):
+    with telemetria.conexion(db.ruta) as conn:
+        return telemetria.series_tendencia(conn, granularidad, desde, hasta, agrupar, filtros)
+
+@app.route('/api/tendencias')
+def api_tendencias():
+    """
+    Series de escaneos por período, leídas de los agregados. Parámetros:
+    granularidad=minuto|hora|dia, desde/hasta (ISO 8601), agrupar=tipo|dispositivo|ip_address
+    y filtros opcionales tipo, dispositivo, ip_address.
+    Ej.: /api/tendencias?granularidad=dia&agrupar=tipo (últimos 90 días por tipo de escaneo).
+    """
+    granularidad = request.args.get('granularidad', 'hora')
+    if granularidad not in VENTANA_TENDENCIAS:
+        return jsonify({'success': False, 'message': 'Granularidad no válida (minuto, hora o dia).'}), 400
+    desde = request.args.get('desde') or (datetime.now() - VENTANA_TENDENCIAS[granularidad]).isoformat()
+    hasta = request.args.get('hasta')
+    filtros = {c: request.args.get(c) for c in telemetria.AGRUPACIONES_ROLLUP if request.args.get(c)}
+    try:
+        series = ejecutor_bd.ejecutar(_tendencias_db, granularidad, desde, hasta, request.args.get('agrupar') or None, filtros)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'Error obteniendo tendencias: {str(e)}'}), 500
+    return jsonify({'success': True, 'granularidad': granularidad, 'desde': desde, 'hasta': hasta, 'series': series})
+
 # ============================================================================
 # RUTAS DE DESCARGA Y ESTADO DE APK
 # ============================================================================
@@ -1723,7 +2658,8 @@ def get_readings():
     """API para obtener lecturas (para la app móvil)"""
     try:
         limit = request.args.get('limit', 50, type=int)
-        readings = db.get_all_readings(limit=limit)
+        readings = ejecutor_bd.ejecutar(db.get_all_readings, limit=limit,
+                                        desde=request.args.get('desde'), hasta=request.args.get('hasta'))
         
         return jsonify({
             'success': True,
@@ -1741,7 +2677,7 @@ def get_readings():
 def get_stats():
     """API para obtener estadísticas"""
     try:
-        stats = db.get_stats()
+        stats = ejecutor_bd.ejecutar(db.get_stats)
         return jsonify({
             'success': True,
             'stats': stats
@@ -1752,14 +2688,140 @@ def get_stats():
             'message': f'Error obteniendo estadísticas: {str(e)}'
         }), 500
 
+@app.route('/api/sync')
+def sync_catalogo():
+    """
+    Sincronización incremental del catálogo para la app móvil (productos, tiendas, estados).
+    El dispositivo envía la última secuencia recibida (?since=0 la primera vez) y repite
+    con el valor 'hasta' mientras 'mas' sea verdadero.
+    Requiere sesión iniciada o 'Authorization: Bearer <SYNC_TOKEN>' (la app móvil);
+    también se acepta el token CDC_TOKEN.
+    """
+    autorizacion = request.headers.get('Authorization')
+    if autorizacion:
+        if autorizacion not in {f'Bearer {t}' for t in (SYNC_TOKEN, CDC_TOKEN) if t}:
+            return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+    elif not verificar_sesion():
+        return jsonify({'success': False, 'message': 'Se requiere autenticación.'}), 401
+    try:
+        desde = request.args.get('since', 0, type=int)
+        limite = min(max(request.args.get('limit', registro_cambios.LIMITE_PAGINA_SYNC, type=int), 1), 5000)
+        with obtener_conexion() as conn:
+            pagina = registro_cambios.leer_cambios(conn, desde, limite)
+        return jsonify({'success': True, **pagina})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error sincronizando catálogo: {str(e)}'
+        }), 500
+
+# ============================================================================
+# RUTAS API - FLUJO DE CAMBIOS DE INVENTARIO (CDC)
+# ============================================================================
+def _autorizado_cdc():
+    """El flujo de cambios es para administradores o consumidores con el token CDC_TOKEN."""
+    if CDC_TOKEN and request.headers.get('Authorization') == f'Bearer {CDC_TOKEN}':
+        return True
+    return verificar_sesion() and obtener_permisos_usuario() == 'admin'
+
+def _parametros_cdc():
+    desde = request.headers.get('Last-Event-ID', type=int)
+    if desde is None:
+        desde = request.args.get('since', 0, type=int)
+    tablas = [t for t in (request.args.get('tablas') or '').split(',') if t] or None
+    return desde, tablas
+
+def _hueco_cdc(desde, compactado):
+    """
+    410 Gone si la compactación ya eliminó cambios posteriores a 'desde': el
+    consumidor debe reconstruir su estado y seguir desde 'compactado_hasta'.
+    """
+    return jsonify({
+        'success': False,
+        'message': f'Los cambios posteriores a {desde} ya se compactaron; reconstruya el estado y continúe desde {compactado}.',
+        'compactado_hasta': compactado
+    }), 410
+
+@app.route('/api/cdc')
+def cdc_pagina():
+    """Página de eventos de cambio posteriores a ?since=<seq> (consulta puntual)."""
+    if not _autorizado_cdc():
+        return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+    desde, tablas = _parametros_cdc()
+    limite = min(max(request.args.get('limit', registro_cambios.LIMITE_PAGINA_CDC, type=int), 1), 5000)
+    with obtener_conexion() as conn:
+        eventos = registro_cambios.leer_eventos(conn, desde, limite, tablas)
+        # Se mira después de leer: si se compactó entremedio, la página puede estar incompleta.
+        compactado = registro_cambios.compactado_hasta(conn)
+    if desde < compactado:
+        return _hueco_cdc(desde, compactado)
+    return jsonify({
+        'success': True,
+        'eventos': eventos,
+        'hasta': eventos[-1]['seq'] if eventos else desde,
+        'mas': len(eventos) == limite
+    })
+
+@app.route('/api/cdc/stream')
+def cdc_stream():
+    """
+    Flujo Server-Sent Events de cambios de inventario, en orden de secuencia.
+    Cada evento lleva 'id: <seq>', así que el EventSource del navegador reanuda solo
+    (cabecera Last-Event-ID); otros clientes pueden usar ?since=<seq>.
+    Si la compactación dejó un hueco se responde 410 (el navegador no reintenta);
+    si ocurre con el flujo abierto se envía un evento 'reinicio' y se cierra.
+    """
+    if not _autorizado_cdc():
+        return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+    desde, tablas = _parametros_cdc()
+    with obtener_conexion() as conn:
+        compactado = registro_cambios.compactado_hasta(conn)
+    if desde < compactado:
+        return _hueco_cdc(desde, compactado)
+
+    def generar(desde):
+        conn = obtener_conexion()
+        ultimo_envio = time.monotonic()
+        try:
+            yield 'retry: 3000\n\n'
+            while True:
+                eventos = registro_cambios.leer_eventos(conn, desde, registro_cambios.LIMITE_PAGINA_CDC, tablas)
+                compactado = registro_cambios.compactado_hasta(conn)
+                conn.commit()  # cierra la transacción de lectura para ver lo que escriban otros
+                if desde < compactado:
+                    yield f"event: reinicio\ndata: {json.dumps({'compactado_hasta': compactado})}\n\n"
+                    return
+                for evento in eventos:
+                    desde = evento['seq']
+                    yield f"id: {evento['seq']}\nevent: cambio\ndata: {json.dumps(evento, ensure_ascii=False)}\n\n"
+                if eventos:
+                    ultimo_envio = time.monotonic()
+                    if len(eventos) == registro_cambios.LIMITE_PAGINA_CDC:
+                        continue
+                elif time.monotonic() - ultimo_envio > 15:
+                    yield ': keepalive\n\n'
+                    ultimo_envio = time.monotonic()
+                socketio.sleep(1)
+        finally:
+            conn.close()
+
+    return Response(generar(desde), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/submit-nfc', methods=['POST'])
 def submit_nfc_reading():
     """API para recibir lecturas NFC desde la app móvil"""
+    rechazo = _escaneo_demasiado_grande()
+    if rechazo:
+        return rechazo
     try:
         data = request.json
         
         # Información del dispositivo
         device_info = data.get('device_info', {})
+        rechazo = _equipo_limitado(device_info)
+        if rechazo:
+            return rechazo
         
         # Datos NFC
         nfc_data = data.get('nfc_data', {})
@@ -1768,11 +2830,40 @@ def submit_nfc_reading():
         ip_address = request.remote_addr
         user_agent = request.headers.get('User-Agent', '')
         
-        # Guardar en base de datos
-        reading = db.save_reading(device_info, nfc_data, ip_address, user_agent)
+        dispositivo = _id_dispositivo(device_info, ip_address)
+        
+        # Reintentos y dobles toques devuelven la lectura original
+        client_scan_id = _client_scan_id(data)
+        clave_contenido = (dispositivo, 'NFC', json.dumps(nfc_data, sort_keys=True))
+        tienda_id = data.get('tienda_id', device_info.get('tienda_id') if isinstance(device_info, dict) else None)
+        reading = _escaneo_duplicado(client_scan_id, clave_contenido)
+        if not reading:
+            # Guardar en base de datos (o en el spool si está ocupada)
+            reading, encolada = _guardar_o_encolar({
+                'device_info': device_info, 'nfc_data': nfc_data, 'ip_address': ip_address, 'user_agent': user_agent,
+                'client_scan_id': client_scan_id, 'evento': 'new_nfc_reading', 'tipo': 'NFC',
+                'dispositivo': dispositivo, 'tienda_id': tienda_id,
+            })
+            if encolada:
+                _recordar_escaneo({'id': None, 'timestamp': encolada['timestamp']}, client_scan_id, clave_contenido)
+                return jsonify({
+                    'success': True,
+                    'queued': True,
+                    'message': 'Lectura NFC recibida; se guardará en cuanto la base de datos esté disponible',
+                    'reading_id': None,
+                    'spool_id': encolada['spool_id']
+                }), 202
+        if reading.get('duplicado'):
+            return jsonify({
+                'success': True,
+                'duplicate': True,
+                'message': 'Lectura NFC ya registrada',
+                'reading_id': reading['id']
+            }), 200
+        _recordar_escaneo(reading, client_scan_id, clave_contenido)
         
-        # Emitir evento WebSocket para actualización en tiempo real
-        socketio.emit('new_nfc_reading', reading)
+        # Emitir evento WebSocket a las salas interesadas en este equipo / tienda / tipo
+        _emitir_lectura('new_nfc_reading', reading, 'NFC', dispositivo, tienda_id)
         
         return jsonify({
             'success': True,
@@ -1781,11 +2872,21 @@ def submit_nfc_reading():
         }), 200
         
     except Exception as e:
+        if _bd_ocupada(e):
+            return _respuesta_bd_ocupada()
         return jsonify({
             'success': False,
             'message': f'Error procesando lectura NFC: {str(e)}'
         }), 400
 
+@app.route('/api/ingesta/estado')
+def estado_ingesta():
+    """Contadores de limitación y escaneos pendientes en el spool (de este proceso)."""
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        return jsonify({'success': False, 'message': 'No autorizado.'}), 403
+    return jsonify({'success': True, 'pid': os.getpid(), 'limitacion': limitador.contadores(),
+                    'spool_segmentos_pendientes': spool.pendientes()})
+
 @app.route('/download-app')
 def download_instructions():
     """Instrucciones para descargar la app"""
@@ -1817,24 +2918,303 @@ def apk_status():
         'apk_size': os.path.getsize(APK_FILE) if APK_EXISTS else 0
     })
 
+# ============================================================================
+# MÉTRICAS (PROMETHEUS)
+# ============================================================================
+@app.before_request
+def _iniciar_medicion():
+    g.inicio_peticion = time.perf_counter()
+
+@app.after_request
+def _registrar_medicion(response):
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is not None:
+        # La plantilla de la ruta (no la URL) para no crear una serie por cada ID.
+        ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        metricas.http_duracion.observar(time.perf_counter() - inicio, ruta, request.method)
+        metricas.http_peticiones.inc(ruta, request.method, str(response.status_code))
+    return response
+
+_emit_socketio = socketio.emit
+
+def _emit_contado(evento, *args, **kwargs):
+    metricas.socketio_emisiones.inc(evento)
+    return _emit_socketio(evento, *args, **kwargs)
+
+# También cuenta los emit() de los manejadores, que Flask-SocketIO delega en socketio.emit.
+socketio.emit = _emit_contado
+
+metricas.Contador('itec_ingesta_aceptados_total', 'Escaneos aceptados por el limitador de tasa.', funcion=lambda: limitador.total_aceptados)
+metricas.Contador('itec_ingesta_limitados_total', 'Escaneos rechazados con 429 por el limitador de tasa.', funcion=lambda: limitador.total_limitados)
+metricas.Contador('itec_ingesta_demasiado_grandes_total', 'Escaneos rechazados con 413 por tamaño.', funcion=lambda: limitador.total_demasiado_grandes)
+metricas.Medidor('itec_spool_segmentos_pendientes', 'Segmentos del spool de escaneos por cargar.', funcion=spool.pendientes)
+
+@app.route('/metrics')
+def metrics():
+    """
+    Métricas de este proceso en formato Prometheus. Acceso con
+    'Authorization: Bearer <METRICAS_TOKEN>', sesión de administrador o, si no
+    se definió METRICAS_TOKEN, desde la propia máquina.
+    """
+    if METRICAS_TOKEN:
+        autorizado = request.headers.get('Authorization') == f'Bearer {METRICAS_TOKEN}'
+    else:
+        autorizado = request.remote_addr in ('127.0.0.1', '::1')
+    if not autorizado and not (verificar_sesion() and obtener_permisos_usuario() == 'admin'):
+        abort(403)
+    return Response(metricas.exportar(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+def _ruta_actual():
+    # Las consultas de ejecutor_bd y de las tareas de fondo no tienen petición asociada.
+    if has_request_context() and request.url_rule:
+        return f'{request.method} {request.url_rule.rule}'
+    return None
+
+consultas_lentas.instalar(_ruta_actual)
+
+@app.route('/admin/consultas-lentas', methods=['GET', 'POST'])
+def admin_consultas_lentas():
+    """Consultas que superaron ITEC_CONSULTA_LENTA_MS en este proceso, por tiempo total."""
+    if not verificar_sesion() or obtener_permisos_usuario() != 'admin':
+        flash('No tienes permisos para acceder.', 'danger')
+        return redirect(url_for('dashboard'))
+    if request.method == 'POST':
+        consultas_lentas.reiniciar()
+        flash('Se reinició el acumulado de consultas lentas.', 'success')
+        return redirect(url_for('admin_consultas_lentas'))
+    return render_template('consultas_lentas.html',
+                           consultas=consultas_lentas.peores(),
+                           umbral_ms=consultas_lentas.UMBRAL_MS,
+                           archivo_log=consultas_lentas.ARCHIVO_LOG,
+                           pid=os.getpid(),
+                           **session_vars())
+
+# ============================================================================
+# SENTENCIAS POR PETICIÓN Y CONSULTAS EN BUCLE (ver consultas_repetidas.py)
+# ============================================================================
+consultas_repetidas.instalar(app)
+
+# ============================================================================
+# PERFILADO A PEDIDO (ver perfilado.py)
+# ============================================================================
+def _es_admin():
+    return verificar_sesion() and obtener_permisos_usuario() == 'admin'
+
+perfilado.instalar(app, _es_admin, lambda: session.get('usuario'))
+_perfilar_evento = perfilado.evento_socketio(_es_admin, lambda: session.get('usuario'))
+
+@app.route('/admin/perfiles')
+def admin_perfiles():
+    """Perfiles guardados; con ?id= muestra además las funciones más costosas de uno."""
+    if not _es_admin():
+        flash('No tienes permisos para acceder.', 'danger')
+        return redirect(url_for('dashboard'))
+    seleccionado = None
+    if request.args.get('id'):
+        seleccionado = perfilado.obtener(request.args['id'])
+        if seleccionado is None:
+            flash('El perfil no existe o ya fue eliminado.', 'warning')
+    return render_template('perfiles.html', perfiles=perfilado.listar(), seleccionado=seleccionado,
+                           parametro=perfilado.PARAMETRO, cabecera=perfilado.CABECERA, **session_vars())
+
+@app.route('/admin/perfiles/<perfil_id>/descargar')
+def descargar_perfil(perfil_id):
+    """Archivo .prof del perfil, para abrir con pstats o snakeviz."""
+    if not _es_admin():
+        abort(403)
+    if perfilado.obtener(perfil_id) is None or not os.path.exists(perfilado.ruta_prof(perfil_id)):
+        abort(404)
+    return send_file(os.path.abspath(perfilado.ruta_prof(perfil_id)), as_attachment=True,
+                     download_name=f'{perfil_id}.prof', mimetype='application/octet-stream')
+
 # ============================================================================
 # EVENTOS DE WEBSOCKET
 # ============================================================================
 @socketio.on('connect')
+@_perfilar_evento
 def handle_connect():
     print(f'Cliente conectado: {request.sid}')
+    metricas.socketio_clientes.inc()
+    # Sin suscripción explícita el cliente recibe todo, como los paneles existentes.
+    join_room(SALA_TODOS)
     emit('status', {'message': 'Conectado al servidor I-Tec'})
-    emit('stats_update', db.get_stats())
+    emit('stats_update', ejecutor_bd.ejecutar(db.get_stats))
 
 @socketio.on('disconnect')
+@_perfilar_evento
 def handle_disconnect():
     print(f'Cliente desconectado: {request.sid}')
+    metricas.socketio_clientes.dec()
+
+@socketio.on('suscribir')
+@_perfilar_evento
+def handle_suscribir(data):
+    """
+    Limita los eventos que recibe el cliente. Ejemplo:
+    {'tienda_id': 3, 'tipo': ['NFC', 'QR']} o {'dispositivo': 'abc123'} o {'toma_id': 7}.
+    Cada valor puede ser único o lista; los filtros se suman (unión de salas).
+    Las salas de tomas, documentos y reportes exigen sesión de administrador.
+    """
+    if not isinstance(data, dict):
+        emit('error', {'message': 'Suscripción sin filtros válidos.', 'filtros': list(FILTROS_SALA)})
+        return
+    if not _salas_autorizadas(data):
+        emit('error', {'message': 'No autorizado.'})
+        return
+    salas = _salas_de_filtros(data)
+    if not salas:
+        emit('error', {'message': 'Suscripción sin filtros válidos.', 'filtros': list(FILTROS_SALA)})
+        return
+    leave_room(SALA_TODOS)
+    for sala in salas:
+        join_room(sala)
+    emit('suscrito', {'salas': [s for s in rooms() if s != request.sid]})
+
+@socketio.on('desuscribir')
+@_perfilar_evento
+def handle_desuscribir(data=None):
+    """Quita las salas indicadas (o todas) y, si no queda ninguna, vuelve a recibir todo."""
+    actuales = [s for s in rooms() if s not in (request.sid, SALA_TODOS)]
+    quitar = _salas_de_filtros(data) if data else actuales
+    for sala in quitar:
+        leave_room(sala)
+    if not [s for s in actuales if s not in quitar]:
+        join_room(SALA_TODOS)
+    emit('suscrito', {'salas': [s for s in rooms() if s != request.sid]})
+
+# ============================================================================
+# PUNTO DE ENTRADA PARA SERVIDORES DE PRODUCCIÓN
+# ============================================================================
+def _archivar_telemetria_periodicamente():
+    """Tarea de fondo: mueve las lecturas antiguas a los archivos mensuales (ver telemetria.archivar)."""
+    while True:
+        try:
+            movidas = ejecutor_bd.ejecutar(telemetria.archivar, db.ruta)
+            if movidas:
+                print(f"INFO: Lecturas archivadas por mes: {movidas}")
+            ejecutor_bd.ejecutar(_compactar_rollups)
+        except Exception as e:
+            print(f"ERROR: No se pudo archivar la telemetría: {e}")
+        socketio.sleep(telemetria.TELEMETRIA_INTERVALO_ARCHIVO)
+
+def _compactar_rollups():
+    with telemetria.conexion(db.ruta) as conn:
+        telemetria.compactar_rollups(conn)
+
+def _drenar_spool_periodicamente():
+    """Carga en la base los escaneos del spool y emite sus eventos; también reprocesa lo que dejó un corte."""
+    while True:
+        try:
+            ejecutor_bd.ejecutar(spool.rotar)
+            for entrada, reading in ejecutor_bd.ejecutar(spool.drenar, db.save_readings_lote):
+                recientes_por_id.registrar(entrada['client_scan_id'], {'id': reading['id'], 'timestamp': reading['timestamp'], 'duplicado': True})
+                _emitir_lectura(entrada['evento'], reading, entrada['tipo'], entrada['dispositivo'], entrada.get('tienda_id'))
+        except Exception as e:
+            if not _bd_ocupada(e):
+                print(f"ERROR: No se pudo drenar el spool de escaneos: {e}")
+        socketio.sleep(SPOOL_INTERVALO)
+
+def _en_conexion(funcion, *args):
+    """Ejecuta funcion(conn, *args) con una conexión propia (para el grupo de hilos de ejecutor_bd)."""
+    with obtener_conexion() as conn:
+        conn.row_factory = sqlite3.Row
+        return funcion(conn, *args)
+
+def _emitir_avance_reporte(reporte_id, estado, progreso, etapa=None, filas=None, error=None):
+    socketio.emit('reporte_progreso', {'reporte_id': reporte_id, 'estado': estado, 'progreso': progreso,
+                                       'etapa': etapa, 'filas': filas, 'error': error},
+                  to=_sala('reporte_id', reporte_id))
+
+def _calcular_reporte(reporte):
+    """Calcula un reporte etapa por etapa; cada consulta corre en el grupo de hilos de ejecutor_bd."""
+    reporte_id, intento = reporte['reporte_id'], reporte['intento']
+    etapas = reportes.etapas(reporte)
+    filas = 0
+    try:
+        for i, (descripcion, sql, parametros) in enumerate(etapas):
+            progreso = int(i * 100 / len(etapas))
+            ejecutor_bd.ejecutar(_en_conexion, reportes.avanzar, reporte_id, intento, progreso, descripcion)
+            _emitir_avance_reporte(reporte_id, 'En proceso', progreso, descripcion, filas)
+            filas += ejecutor_bd.ejecutar(_en_conexion, reportes.calcular_etapa, reporte_id, intento, sql, parametros, i == 0)
+        ejecutor_bd.ejecutar(_en_conexion, reportes.terminar, reporte_id, intento, filas)
+        _emitir_avance_reporte(reporte_id, 'Listo', 100, filas=filas)
+        ejecutor_bd.ejecutar(_en_conexion, reportes.podar)
+    except reportes.ReporteReasignado as e:
+        # Otro trabajador lo tomó al vencer el latido: el resultado queda a cargo de ese intento.
+        print(f"INFO: {e}")
+    except Exception as e:
+        print(f"ERROR: No se pudo calcular el reporte #{reporte_id}: {e}")
+        ejecutor_bd.ejecutar(_en_conexion, reportes.fallar, reporte_id, intento, str(e))
+        _emitir_avance_reporte(reporte_id, 'Error', 0, filas=filas, error=str(e))
+
+def _trabajador_reportes():
+    """Tarea de fondo: toma los reportes pendientes de a uno y los calcula."""
+    while True:
+        try:
+            reporte = ejecutor_bd.ejecutar(_en_conexion, reportes.tomar_siguiente)
+            if reporte is not None:
+                _calcular_reporte(reporte)
+                continue
+        except Exception as e:
+            if not _bd_ocupada(e):
+                print(f"ERROR: Falló el trabajador de reportes: {e}")
+        socketio.sleep(reportes.INTERVALO)
+
+def _renovar_latidos_reportes():
+    """Tarea de fondo: mantiene vivo el latido de los reportes que calcula este proceso (ver reportes.py)."""
+    while True:
+        try:
+            ejecutor_bd.ejecutar(_en_conexion, reportes.renovar_latidos)
+        except Exception as e:
+            if not _bd_ocupada(e):
+                print(f"ERROR: No se pudo renovar el latido de los reportes: {e}")
+        socketio.sleep(reportes.INTERVALO_LATIDO)
+
+def iniciar_trabajadores_reportes():
+    """
+    Inicia los trabajadores de reportes y su latido. Varios procesos pueden
+    correrlos a la vez: los reportes de un proceso caído se retoman cuando vence
+    su latido, no al arrancar, para no quitarle el trabajo a otro que sigue vivo.
+    """
+    if reportes.TRABAJADORES <= 0:
+        return
+    socketio.start_background_task(_renovar_latidos_reportes)
+    for _ in range(reportes.TRABAJADORES):
+        socketio.start_background_task(_trabajador_reportes)
+
+def iniciar_drenaje_spool():
+    """Cada proceso drena su propio spool, así que se inicia en todos (no sólo en el de tareas de fondo)."""
+    if SPOOL_MODO != 'no':
+        socketio.start_background_task(_drenar_spool_periodicamente)
+
+def iniciar_tareas_fondo():
+    if telemetria.TELEMETRIA_INTERVALO_ARCHIVO > 0:
+        socketio.start_background_task(_archivar_telemetria_periodicamente)
+    iniciar_trabajadores_reportes()
+
+def crear_app(config=None, inicializar_bd=True, tareas_fondo=True):
+    """
+    Devuelve la aplicación lista para un servidor WSGI (gunicorn con eventlet/gevent,
+    ver wsgi.py y servidor_produccion.py). Con varios procesos conviene inicializar
+    la base de datos una sola vez antes de arrancarlos y pasar inicializar_bd=False,
+    y dejar las tareas de fondo a uno solo de ellos.
+    """
+    if config:
+        app.config.update(config)
+    if inicializar_bd:
+        init_inventory_db()
+    if tareas_fondo:
+        iniciar_tareas_fondo()
+    iniciar_drenaje_spool()
+    return app
 
 # ============================================================================
 # EJECUCIÓN PRINCIPAL
 # ============================================================================
 if __name__ == '__main__':
     init_inventory_db()
+    iniciar_tareas_fondo()
+    iniciar_drenaje_spool()
 
     print("=" * 60)
     print("🚀 I-Tec NFC Scanner - Servidor Unificado")
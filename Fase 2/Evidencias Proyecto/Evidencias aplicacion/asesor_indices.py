@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Asesor de índices: ejecuta EXPLAIN QUERY PLAN sobre cada sentencia SQL literal
+de app.py y marca las que recorren una tabla completa (SCAN sin índice) o
+necesitan un B-tree temporal para ORDER BY / GROUP BY.
+
+Las sentencias se extraen con ast (literales de texto que empiezan con SELECT,
+INSERT, UPDATE, DELETE o WITH); las armadas con f-strings o .format() se
+omiten. Las de la clase NFCDatabase se explican contra la base de telemetría.
+
+Para que una ruta nueva no agregue recorridos completos sin que nadie lo note:
+    python asesor_indices.py --bd nfc_readings.db --base asesor_indices_base.json --actualizar-base
+    python asesor_indices.py --bd nfc_readings.db --base asesor_indices_base.json
+El segundo comando termina con código 1 si aparece un recorrido que no está en la base.
+"""
+import argparse
+import ast
+import json
+import os
+import re
+import sqlite3
+import sys
+
+DIRECTORIO_APP = os.path.dirname(os.path.abspath(__file__))
+PALABRAS_SQL = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+# Catálogos de pocas filas: recorrerlos completos es más barato que mantener un índice.
+TABLAS_PEQUENAS = {'areas', 'roles', 'estados_equipo', 'tipos_producto', 'tipos_movimiento',
+                   'tiendas', 'proveedores', 'modulos_venta', 'software_catalogo'}
+CLASES_TELEMETRIA = {'NFCDatabase'}
+
+
+def extraer_sentencias(ruta):
+    """[(linea, funcion, es_telemetria, sql)] con las sentencias SQL literales del archivo."""
+    with open(ruta, encoding='utf-8') as f:
+        arbol = ast.parse(f.read(), ruta)
+    sentencias = []
+
+    def visitar(nodo, funcion, telemetria):
+        if isinstance(nodo, ast.JoinedStr):
+            return  # f-string: el SQL final depende de la ejecución.
+        if isinstance(nodo, ast.ClassDef):
+            telemetria = telemetria or nodo.name in CLASES_TELEMETRIA
+        if isinstance(nodo, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            funcion = nodo.name
+        if isinstance(nodo, ast.Constant) and isinstance(nodo.value, str):
+            texto = nodo.value.strip()
+            palabra = texto.split(None, 1)[0].upper() if texto else ''
+            if palabra in PALABRAS_SQL and '{' not in texto:
+                sentencias.append((nodo.lineno, funcion, telemetria, texto))
+        for hijo in ast.iter_child_nodes(nodo):
+            visitar(hijo, funcion, telemetria)
+
+    visitar(arbol, None, False)
+    return sentencias
+
+
+def _parametros(sql):
+    """Valores NULL para cada marcador (? o :nombre) fuera de los literales de texto."""
+    sin_literales = re.sub(r"'(?:[^']|'')*'", "''", sql)
+    nombres = re.findall(r'[:@$]([A-Za-z_]\w*)', sin_literales)
+    if nombres:
+        return {n: None for n in nombres}
+    return (None,) * sin_literales.count('?')
+
+
+def explicar(conn, sql):
+    """Filas de detalle del plan; lanza sqlite3.Error si la sentencia no es válida en esta base."""
+    return [fila[3] for fila in conn.execute('EXPLAIN QUERY PLAN ' + sql, _parametros(sql)).fetchall()]
+
+
+def _alias(sql):
+    """{alias: tabla} de las cláusulas FROM/JOIN; SQLite muestra el alias en el plan."""
+    alias = {}
+    for tabla, nombre in re.findall(r'\b(?:FROM|JOIN)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.IGNORECASE):
+        alias[tabla] = tabla
+        if nombre and nombre.upper() not in ('WHERE', 'JOIN', 'LEFT', 'INNER', 'ON', 'GROUP', 'ORDER', 'LIMIT', 'USING'):
+            alias[nombre] = tabla
+    return alias
+
+
+def hallazgos(plan, sql='', ignorar=TABLAS_PEQUENAS):
+    """Recorridos completos y B-trees temporales del plan (salvo si sólo tocan tablas pequeñas)."""
+    alias = _alias(sql)
+    encontrados = []
+    tablas = set()
+    for detalle in plan:
+        m = re.match(r'(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS \w+)?(.*)', detalle)
+        if m:
+            tabla = alias.get(m.group(2), m.group(2))
+            tablas.add(tabla)
+            if m.group(1) == 'SCAN' and 'USING' not in m.group(3) and tabla not in ignorar and not tabla.startswith('sqlite_'):
+                encontrados.append(f'SCAN {tabla}')
+        elif detalle.startswith('USE TEMP B-TREE') and not tablas <= set(ignorar):
+            encontrados.append(detalle)
+    return encontrados
+
+
+def _clave(sql, hallazgo):
+    return re.sub(r'\s+', ' ', sql) + ' || ' + hallazgo
+
+
+def analizar(archivos, conn_inventario, conn_telemetria=None, ignorar=TABLAS_PEQUENAS):
+    resultados = []
+    for archivo in archivos:
+        todo_telemetria = os.path.basename(archivo) == 'telemetria.py'
+        for linea, funcion, telemetria, sql in extraer_sentencias(archivo):
+            conn = conn_telemetria if (telemetria or todo_telemetria) and conn_telemetria else conn_inventario
+            r = {'archivo': os.path.basename(archivo), 'linea': linea, 'funcion': funcion, 'sql': re.sub(r'\s+', ' ', sql)}
+            try:
+                r['plan'] = explicar(conn, sql)
+                r['hallazgos'] = hallazgos(r['plan'], sql, ignorar)
+            except sqlite3.Error as e:
+                r['omitida'] = str(e)
+            resultados.append(r)
+    return resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Marca las sentencias SQL de la app que recorren tablas completas.')
+    parser.add_argument('--bd', default='nfc_readings.db', help='Base de inventario (se abre en sólo lectura).')
+    parser.add_argument('--telemetria', default='nfc_telemetria.db', help='Base de telemetría (para NFCDatabase).')
+    parser.add_argument('--archivo', nargs='+', default=[os.path.join(DIRECTORIO_APP, 'app.py')])
+    parser.add_argument('--ignorar', nargs='*', default=sorted(TABLAS_PEQUENAS), help='Tablas que se pueden recorrer completas.')
+    parser.add_argument('--base', help='JSON con los recorridos ya aceptados.')
+    parser.add_argument('--actualizar-base', action='store_true', help='Guarda los hallazgos actuales como aceptados.')
+    parser.add_argument('--salida', help='Guarda el detalle (planes incluidos) en JSON.')
+    parser.add_argument('--todas', action='store_true', help='Muestra también las sentencias sin hallazgos.')
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(f'file:{args.bd}?mode=ro', uri=True)
+    conn_telemetria = sqlite3.connect(f'file:{args.telemetria}?mode=ro', uri=True) if os.path.exists(args.telemetria) else None
+    resultados = analizar(args.archivo, conn, conn_telemetria, set(args.ignorar))
+
+    aceptados = set()
+    if args.base and os.path.exists(args.base) and not args.actualizar_base:
+        with open(args.base, encoding='utf-8') as f:
+            aceptados = set(json.load(f))
+
+    comparar = bool(args.base) and not args.actualizar_base
+    nuevos = 0
+    omitidas = 0
+    for r in resultados:
+        if 'omitida' in r:
+            omitidas += 1
+            print(f"OMITIDA {r['archivo']}:{r['linea']} ({r['funcion']}): {r['omitida']}")
+            continue
+        if not r['hallazgos'] and not args.todas:
+            continue
+        marcas = []
+        for h in r['hallazgos']:
+            if comparar and _clave(r['sql'], h) not in aceptados:
+                nuevos += 1
+                h += ' [NUEVO]'
+            marcas.append(h)
+        print(f"{r['archivo']}:{r['linea']} ({r['funcion']}): {', '.join(marcas) or 'OK'}")
+        print(f"    {r['sql'][:160]}")
+
+    con_hallazgos = sum(1 for r in resultados if r.get('hallazgos'))
+    print(f"\n{len(resultados)} sentencias, {con_hallazgos} con recorridos completos o B-tree temporal, {omitidas} omitidas.")
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, ensure_ascii=False, indent=2)
+    if args.base and args.actualizar_base:
+        claves = sorted({_clave(r['sql'], h) for r in resultados for h in r.get('hallazgos', [])})
+        with open(args.base, 'w', encoding='utf-8') as f:
+            json.dump(claves, f, ensure_ascii=False, indent=2)
+        print(f"Base actualizada: {len(claves)} recorridos aceptados en {args.base}.")
+    elif nuevos:
+        print(f"{nuevos} recorridos nuevos respecto de {args.base}.")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
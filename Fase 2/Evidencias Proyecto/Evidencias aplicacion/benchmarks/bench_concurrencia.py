@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de capacidad de conexiones concurrentes en la ingesta de escaneos.
+
+Levanta el servidor de producción (un proceso) en un directorio temporal y, para
+cada nivel de concurrencia, N clientes envían escaneos a /api/scan mientras otro
+hilo retiene periódicamente el bloqueo de escritura de la base de telemetría
+(como un reporte largo o un checkpoint). En paralelo se sondea /api/apk-status, que no
+toca la base: si su latencia sube, el bucle de eventos quedó bloqueado.
+
+Se comparan dos configuraciones del mismo modo asíncrono:
+    antes   ITEC_BD_EN_HILOS=0  (SQLite dentro del bucle de eventos)
+    despues ITEC_BD_EN_HILOS=1  (SQLite en el grupo de hilos de ejecutor_bd)
+
+La capacidad es el mayor nivel de concurrencia con errores < 1 % y p95 del sondeo
+por debajo de --umbral-ms.
+
+Uso:
+    python benchmarks/bench_concurrencia.py --modo eventlet --niveles 10 50 100 200 --salida resultado.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+DIRECTORIO_APP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _percentil(valores, p):
+    if not valores:
+        return None
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def _peticion(url, datos=None, timeout=30):
+    cuerpo = json.dumps(datos).encode() if datos is not None else None
+    req = urllib.request.Request(url, data=cuerpo, headers={'Content-Type': 'application/json'})
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            ok = resp.status < 300
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return ok, (time.perf_counter() - inicio) * 1000
+
+
+def _esperar_servidor(base, segundos=30):
+    limite = time.time() + segundos
+    while time.time() < limite:
+        if _peticion(f'{base}/api/apk-status', timeout=1)[0]:
+            return
+        time.sleep(0.2)
+    raise RuntimeError(f'El servidor no respondió en {base}')
+
+
+def _bloqueador(ruta_bd, detener, bloqueo, pausa):
+    """Retiene el bloqueo exclusivo de la base 'bloqueo' segundos cada 'pausa' segundos."""
+    conn = sqlite3.connect(ruta_bd, isolation_level=None)
+    while not detener.is_set():
+        conn.execute('BEGIN EXCLUSIVE')
+        time.sleep(bloqueo)
+        conn.execute('COMMIT')
+        detener.wait(pausa)
+    conn.close()
+
+
+def medir_nivel(base, ruta_bd, clientes, duracion, bloqueo, pausa):
+    detener = threading.Event()
+    latencias, sondeos = [], []
+    errores = [0]
+    lock = threading.Lock()
+
+    def cliente(n):
+        i = 0
+        while not detener.is_set():
+            ok, ms = _peticion(f'{base}/api/scan', {
+                'type': 'nfc', 'content': f'BENCH-{n}-{i}',
+                'deviceInfo': {'deviceId': f'bench-{n}', 'platform': 'benchmark'},
+            })
+            with lock:
+                latencias.append(ms)
+                if not ok:
+                    errores[0] += 1
+            i += 1
+
+    def sondeo():
+        while not detener.is_set():
+            ok, ms = _peticion(f'{base}/api/apk-status', timeout=10)
+            sondeos.append(ms)
+            time.sleep(0.05)
+
+    hilos = [threading.Thread(target=cliente, args=(n,), daemon=True) for n in range(clientes)]
+    hilos.append(threading.Thread(target=sondeo, daemon=True))
+    hilos.append(threading.Thread(target=_bloqueador, args=(ruta_bd, detener, bloqueo, pausa), daemon=True))
+    for h in hilos:
+        h.start()
+    time.sleep(duracion)
+    detener.set()
+    for h in hilos:
+        h.join(timeout=40)
+
+    total = len(latencias)
+    return {
+        'clientes': clientes,
+        'peticiones': total,
+        'peticiones_por_segundo': round(total / duracion, 1),
+        'errores': errores[0],
+        'tasa_error': round(errores[0] / total, 4) if total else 1.0,
+        'escaneo_p50_ms': _percentil(latencias, 50),
+        'escaneo_p95_ms': _percentil(latencias, 95),
+        'sondeo_p95_ms': _percentil(sondeos, 95),
+        'sondeo_max_ms': max(sondeos) if sondeos else None,
+    }
+
+
+def ejecutar_configuracion(nombre, modo, en_hilos, args):
+    directorio = tempfile.mkdtemp(prefix=f'itec_bench_{nombre}_')
+    # Sin límite por equipo ni por IP: cada cliente envía lo más rápido que puede.
+    env = dict(os.environ, SOCKETIO_ASYNC_MODE=modo, ITEC_BD_EN_HILOS='1' if en_hilos else '0',
+               ITEC_LIMITE_ESCANEOS_SEG='0', ITEC_LIMITE_ESCANEOS_IP_SEG='0')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    servidor = subprocess.Popen(
+        [sys.executable, os.path.join(DIRECTORIO_APP, 'servidor_produccion.py'),
+         '--procesos', '1', '--host', '127.0.0.1', '--puerto', str(args.puerto)],
+        cwd=directorio, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{args.puerto}'
+    try:
+        _esperar_servidor(base)
+        niveles = []
+        for clientes in args.niveles:
+            r = medir_nivel(base, os.path.join(directorio, env.get('TELEMETRIA_DATABASE_FILE', 'nfc_telemetria.db')), clientes,
+                            args.duracion, args.bloqueo, args.pausa)
+            print(f'  [{nombre}] {clientes:>4} clientes: {r["peticiones_por_segundo"]:>7} req/s, '
+                  f'errores {r["tasa_error"]:.2%}, sondeo p95 {r["sondeo_p95_ms"]:.0f} ms')
+            niveles.append(r)
+    finally:
+        servidor.terminate()
+        servidor.wait(timeout=15)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    capaces = [r['clientes'] for r in niveles
+               if r['tasa_error'] < 0.01 and (r['sondeo_p95_ms'] or 0) < args.umbral_ms]
+    return {'configuracion': nombre, 'modo': modo, 'bd_en_hilos': en_hilos,
+            'capacidad_clientes': max(capaces) if capaces else 0, 'niveles': niveles}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Capacidad de conexiones concurrentes antes/después de ejecutor_bd.')
+    parser.add_argument('--modo', choices=['eventlet', 'gevent'], default='eventlet')
+    parser.add_argument('--niveles', type=int, nargs='+', default=[10, 50, 100, 200])
+    parser.add_argument('--duracion', type=float, default=10, help='Segundos por nivel de concurrencia.')
+    parser.add_argument('--bloqueo', type=float, default=1.0, help='Segundos que se retiene el bloqueo de escritura.')
+    parser.add_argument('--pausa', type=float, default=2.0, help='Segundos entre bloqueos.')
+    parser.add_argument('--umbral-ms', type=float, default=250)
+    parser.add_argument('--puerto', type=int, default=5099)
+    parser.add_argument('--salida', help='Archivo JSON con el resultado.')
+    args = parser.parse_args()
+
+    resultado = {'fecha': time.strftime('%Y-%m-%d %H:%M:%S'), 'parametros': vars(args), 'configuraciones': []}
+    for nombre, en_hilos in (('antes', False), ('despues', True)):
+        print(f'Midiendo "{nombre}" ({args.modo}, ITEC_BD_EN_HILOS={int(en_hilos)})...')
+        resultado['configuraciones'].append(ejecutar_configuracion(nombre, args.modo, en_hilos, args))
+
+    for c in resultado['configuraciones']:
+        print(f'{c["configuracion"]:>8}: capacidad {c["capacidad_clientes"]} clientes concurrentes')
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
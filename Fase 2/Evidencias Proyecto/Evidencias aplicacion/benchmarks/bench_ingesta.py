@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Prueba de carga de la ingesta de escaneos y de su difusión a los paneles.
+
+Levanta el servidor de producción (un proceso) en un directorio temporal, con
+bases SQLite nuevas, y durante --duracion segundos:
+    - N dispositivos envían escaneos a /api/scan y /api/submit-nfc (alternando
+      o sólo los indicados en --endpoints), cada uno a --tasa escaneos por
+      segundo (0 = lo más rápido posible);
+    - M paneles conectados por Socket.IO reciben new_scan_reading/new_nfc_reading.
+
+Cada escaneo lleva un contenido único; el panel que lo recibe calcula la
+latencia de punta a punta (envío del dispositivo -> evento en el panel). Al
+terminar se espera --gracia segundos y los escaneos aceptados que un panel no
+recibió cuentan como eventos perdidos.
+
+La app no tiene un endpoint de ingesta por lotes; si se agrega, basta con
+sumarlo a ENDPOINTS.
+
+Requiere python-socketio (cliente) para los paneles; con --paneles 0 no hace falta.
+
+Uso:
+    python benchmarks/bench_ingesta.py --dispositivos 50 --tasa 2 --paneles 5 --duracion 30 --salida ingesta.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from bench_concurrencia import DIRECTORIO_APP, _esperar_servidor, _percentil
+
+# endpoint -> (ruta, armar cuerpo(dispositivo, contenido), evento emitido)
+ENDPOINTS = {
+    'scan': ('/api/scan', lambda d, c: {
+        'type': 'nfc', 'content': c, 'deviceInfo': {'deviceId': d, 'platform': 'benchmark'}}, 'new_scan_reading'),
+    'submit-nfc': ('/api/submit-nfc', lambda d, c: {
+        'nfc_data': {'type': 'NFC', 'content': c}, 'device_info': {'deviceId': d, 'platform': 'benchmark'}}, 'new_nfc_reading'),
+}
+
+
+def _enviar(url, datos, timeout=30):
+    """(código HTTP o None si no hubo respuesta, milisegundos)."""
+    req = urllib.request.Request(url, data=json.dumps(datos).encode(), headers={'Content-Type': 'application/json'})
+    inicio = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+            estado = resp.status
+    except urllib.error.HTTPError as e:
+        estado = e.code
+    except (urllib.error.URLError, OSError):
+        estado = None
+    return estado, (time.perf_counter() - inicio) * 1000
+
+
+def _resumen(valores):
+    return {
+        'n': len(valores),
+        'p50_ms': _round(_percentil(valores, 50)),
+        'p95_ms': _round(_percentil(valores, 95)),
+        'p99_ms': _round(_percentil(valores, 99)),
+        'max_ms': _round(max(valores)) if valores else None,
+    }
+
+
+def _round(valor):
+    return round(valor, 1) if valor is not None else None
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIRECTORIO_APP,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Panel:
+    """Cliente Socket.IO que anota cuándo recibe cada contenido."""
+
+    def __init__(self, base, eventos):
+        import socketio
+
+        self.recibidos = {}
+        self._lock = threading.Lock()
+        self.cliente = socketio.Client(reconnection=True)
+        for evento in eventos:
+            self.cliente.on(evento, self._al_recibir)
+        self.cliente.connect(base, wait_timeout=10)
+
+    def _al_recibir(self, lectura):
+        ahora = time.time()
+        datos = lectura.get('nfc_data') if isinstance(lectura, dict) else None
+        contenido = datos.get('content') if isinstance(datos, dict) else None
+        if contenido:
+            with self._lock:
+                self.recibidos.setdefault(contenido, ahora)
+
+    def cerrar(self):
+        self.cliente.disconnect()
+
+
+def medir(base, args):
+    endpoints = [ENDPOINTS[e] for e in args.endpoints]
+    paneles = [Panel(base, {e[2] for e in endpoints}) for _ in range(args.paneles)]
+    detener = threading.Event()
+    lock = threading.Lock()
+    enviados = {}      # contenido -> instante de envío (time.time) de los aceptados
+    latencias = {e: [] for e in args.endpoints}
+    estados = {}
+
+    def dispositivo(n):
+        intervalo = 1 / args.tasa if args.tasa > 0 else 0
+        proximo = time.monotonic()
+        i = 0
+        while not detener.is_set():
+            nombre = args.endpoints[i % len(args.endpoints)]
+            ruta, cuerpo, _ = ENDPOINTS[nombre]
+            contenido = f'BENCH-{n}-{i}'
+            instante = time.time()
+            estado, ms = _enviar(base + ruta, cuerpo(f'bench-{n}', contenido))
+            with lock:
+                latencias[nombre].append(ms)
+                estados[str(estado)] = estados.get(str(estado), 0) + 1
+                if estado is not None and estado < 300:
+                    enviados[contenido] = instante
+            i += 1
+            if intervalo:
+                proximo += intervalo
+                detener.wait(max(0, proximo - time.monotonic()))
+
+    hilos = [threading.Thread(target=dispositivo, args=(n,), daemon=True) for n in range(args.dispositivos)]
+    inicio = time.monotonic()
+    for h in hilos:
+        h.start()
+    time.sleep(args.duracion)
+    detener.set()
+    for h in hilos:
+        h.join(timeout=40)
+    transcurrido = time.monotonic() - inicio
+
+    time.sleep(args.gracia)
+    punta_a_punta, perdidos = [], 0
+    for panel in paneles:
+        with panel._lock:
+            recibidos = dict(panel.recibidos)
+        for contenido, instante in enviados.items():
+            if contenido in recibidos:
+                punta_a_punta.append((recibidos[contenido] - instante) * 1000)
+            else:
+                perdidos += 1
+        panel.cerrar()
+
+    total = sum(len(v) for v in latencias.values())
+    esperados = len(enviados) * len(paneles)
+    return {
+        'escaneos_enviados': total,
+        'escaneos_aceptados': len(enviados),
+        'escaneos_por_segundo': round(len(enviados) / transcurrido, 1),
+        'estados_http': estados,
+        'ingesta': {nombre: _resumen(v) for nombre, v in latencias.items()},
+        'ingesta_total': _resumen([ms for v in latencias.values() for ms in v]),
+        'punta_a_punta': _resumen(punta_a_punta),
+        'eventos_esperados': esperados,
+        'eventos_perdidos': perdidos,
+        'tasa_perdida': round(perdidos / esperados, 4) if esperados else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Carga de ingesta de escaneos y difusión a paneles Socket.IO.')
+    parser.add_argument('--dispositivos', type=int, default=20)
+    parser.add_argument('--tasa', type=float, default=5, help='Escaneos por segundo por dispositivo (0 = sin pausa).')
+    parser.add_argument('--paneles', type=int, default=3)
+    parser.add_argument('--endpoints', nargs='+', choices=sorted(ENDPOINTS), default=sorted(ENDPOINTS))
+    parser.add_argument('--duracion', type=float, default=20)
+    parser.add_argument('--gracia', type=float, default=3, help='Segundos de espera de los eventos al terminar.')
+    parser.add_argument('--modo', choices=['eventlet', 'gevent'], default='eventlet')
+    parser.add_argument('--bd-en-hilos', choices=['0', '1'], default='1')
+    parser.add_argument('--puerto', type=int, default=5098)
+    parser.add_argument('--salida', help='Archivo JSON con el resultado.')
+    args = parser.parse_args()
+
+    directorio = tempfile.mkdtemp(prefix='itec_bench_ingesta_')
+    # Sin límite por equipo ni por IP: se mide la capacidad del servidor, no la política de ingesta.
+    env = dict(os.environ, SOCKETIO_ASYNC_MODE=args.modo, ITEC_BD_EN_HILOS=args.bd_en_hilos,
+               ITEC_LIMITE_ESCANEOS_SEG='0', ITEC_LIMITE_ESCANEOS_IP_SEG='0')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    servidor = subprocess.Popen(
+        [sys.executable, os.path.join(DIRECTORIO_APP, 'servidor_produccion.py'),
+         '--procesos', '1', '--host', '127.0.0.1', '--puerto', str(args.puerto)],
+        cwd=directorio, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = f'http://127.0.0.1:{args.puerto}'
+    try:
+        _esperar_servidor(base)
+        print(f'Midiendo: {args.dispositivos} dispositivos a {args.tasa or "máx."} esc/s, '
+              f'{args.paneles} paneles, {args.duracion:.0f} s...')
+        metricas = medir(base, args)
+    finally:
+        servidor.terminate()
+        servidor.wait(timeout=15)
+        shutil.rmtree(directorio, ignore_errors=True)
+
+    resultado = {
+        'fecha': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': vars(args),
+        'resultado': metricas,
+    }
+    print(f"{metricas['escaneos_por_segundo']} escaneos/s aceptados; ingesta p95 {metricas['ingesta_total']['p95_ms']} ms; "
+          f"punta a punta p95 {metricas['punta_a_punta']['p95_ms']} ms; {metricas['eventos_perdidos']} eventos perdidos")
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultado, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark de las páginas y APIs pesadas contra datos generados, con presupuestos.
+
+Para cada escala de --escalas genera las bases con generar_datos.py en un
+directorio temporal (o usa las de --datos) y, en un proceso aparte que importa
+la app dentro de ese directorio, pide cada página con el cliente de pruebas de
+Flask y una sesión de administrador:
+
+    lista_productos, stock_tiendas, inventario_ubicacion, historico_asignaciones,
+    lista_mantenimientos, /api/readings (get_readings) y /api/stats (get_stats)
+
+Por página se anota la latencia (p50/p95/p99/máx.), el estado HTTP, cuántas
+sentencias SQL ejecutó cada petición y cuánto tardaron (leído de los contadores
+de metricas.py, así que cuenta inventario y telemetría por igual) y cuántas
+veces corrió la sentencia más repetida (cabecera de consultas_repetidas.py).
+
+Los presupuestos (--presupuestos, por defecto presupuestos_paginas.json junto a
+este archivo) fijan por página un máximo de sentencias por petición, que no
+debería depender de la escala, y un p95 en milisegundos por escala:
+
+    {"stock_tiendas": {"consultas": 2, "p95_ms": {"0.01": 300, "0.1": 1500}}, ...}
+
+Una consulta dentro de un bucle (N+1) hace crecer las sentencias con los datos y
+se nota en la escala más chica. Si alguna página excede su presupuesto o no
+responde 200, el proceso termina con código 1.
+
+Uso:
+    python benchmarks/bench_paginas.py --escalas 0.01 0.1 --repeticiones 10 --salida paginas.json
+    python benchmarks/bench_paginas.py --datos /tmp/itec_grande --paginas stock_tiendas
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from bench_concurrencia import DIRECTORIO_APP
+from bench_ingesta import _commit, _resumen
+
+# (endpoint, parámetros de la URL)
+PAGINAS = [
+    ('lista_productos', {}),
+    ('stock_tiendas', {}),
+    ('inventario_ubicacion', {}),
+    ('historico_asignaciones', {}),
+    ('lista_mantenimientos', {}),
+    ('get_readings', {}),
+    ('get_stats', {}),
+]
+PRESUPUESTOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'presupuestos_paginas.json')
+SESION_ADMIN = {'usuario': 'bench_admin', 'nombre': 'Benchmark', 'permiso': 'admin'}
+
+
+# ----------------------------------------------------------------- proceso hijo
+def _sql_totales(metricas):
+    n, segundos = 0, 0.0
+    for cuenta, suma in metricas.sql_duracion.totales().values():
+        n += cuenta
+        segundos += suma
+    return n, segundos
+
+
+def medir(directorio, paginas, repeticiones, calentamiento):
+    """Corre dentro de 'directorio' (con las bases de la app); devuelve el resultado por página."""
+    os.chdir(directorio)
+    sys.path.insert(0, DIRECTORIO_APP)
+    import app as aplicacion
+    import consultas_repetidas
+    import metricas
+    from flask import url_for
+
+    aplicacion.init_inventory_db()
+    cliente = aplicacion.app.test_client()
+    with cliente.session_transaction() as sesion:
+        sesion.update(SESION_ADMIN)
+
+    resultado = {}
+    for endpoint, parametros in PAGINAS:
+        if endpoint not in paginas:
+            continue
+        with aplicacion.app.test_request_context():
+            url = url_for(endpoint, **parametros)
+        for _ in range(calentamiento):
+            cliente.get(url)
+        latencias, sql_ms, consultas, repeticion, estados, bytes_respuesta = [], [], [], [], {}, 0
+        for _ in range(repeticiones):
+            n0, s0 = _sql_totales(metricas)
+            inicio = time.perf_counter()
+            respuesta = cliente.get(url)
+            latencias.append((time.perf_counter() - inicio) * 1000)
+            n1, s1 = _sql_totales(metricas)
+            consultas.append(n1 - n0)
+            sql_ms.append((s1 - s0) * 1000)
+            repeticion.append(int(respuesta.headers.get(consultas_repetidas.CABECERA_REPETICION, 0)))
+            estados[str(respuesta.status_code)] = estados.get(str(respuesta.status_code), 0) + 1
+            bytes_respuesta = len(respuesta.get_data())
+        resultado[endpoint] = {
+            'url': url,
+            'estados_http': estados,
+            'consultas': max(consultas),
+            'repeticion_max': max(repeticion),
+            'sql_ms': round(sum(sql_ms) / len(sql_ms), 1),
+            'bytes': bytes_respuesta,
+            **_resumen(latencias),
+        }
+    return resultado
+
+
+# ---------------------------------------------------------------- proceso padre
+def _medir_en_proceso(directorio, args):
+    descriptor, archivo = tempfile.mkstemp(prefix='itec_bench_paginas_', suffix='.json')
+    os.close(descriptor)
+    # Modo threading: ejecutor_bd llama directo y todo se mide en el mismo hilo.
+    env = dict(os.environ, SOCKETIO_ASYNC_MODE='threading', ITEC_CONSULTA_LENTA_MS='0',
+               ITEC_CONSULTAS_REPETIDAS='avisar')
+    env.pop('SOCKETIO_MESSAGE_QUEUE', None)
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--medir', directorio, '--resultado', archivo,
+                        '--repeticiones', str(args.repeticiones), '--calentamiento', str(args.calentamiento),
+                        '--paginas', *args.paginas],
+                       cwd=directorio, env=env, stdout=subprocess.DEVNULL, check=True)
+        with open(archivo, encoding='utf-8') as f:
+            return json.load(f)
+    finally:
+        os.remove(archivo)
+
+
+def _generar(directorio, escala, semilla):
+    subprocess.run([sys.executable, os.path.join(DIRECTORIO_APP, 'benchmarks', 'generar_datos.py'),
+                    '--destino', directorio, '--escala', str(escala), '--semilla', str(semilla)],
+                   stdout=subprocess.DEVNULL, check=True)
+
+
+def excedidos(escala, paginas, presupuestos):
+    """Lista de mensajes con cada presupuesto excedido."""
+    mensajes = []
+    for endpoint, medicion in paginas.items():
+        if set(medicion['estados_http']) != {'200'}:
+            mensajes.append(f'{escala} {endpoint}: respuestas {medicion["estados_http"]}')
+        presupuesto = presupuestos.get(endpoint, {})
+        if 'consultas' in presupuesto and medicion['consultas'] > presupuesto['consultas']:
+            mensajes.append(f'{escala} {endpoint}: {medicion["consultas"]} sentencias SQL por petición '
+                            f'(presupuesto {presupuesto["consultas"]})')
+        limite = presupuesto.get('p95_ms', {}).get(escala)
+        if limite is not None and medicion['p95_ms'] > limite:
+            mensajes.append(f'{escala} {endpoint}: p95 {medicion["p95_ms"]} ms (presupuesto {limite} ms)')
+    return mensajes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Tiempos y sentencias SQL de las páginas pesadas, con presupuestos.')
+    parser.add_argument('--escalas', nargs='+', default=['0.01', '0.1'], help='Escalas de generar_datos.py.')
+    parser.add_argument('--datos', help='Directorio con bases ya generadas (no se generan ni se borran).')
+    parser.add_argument('--paginas', nargs='+', choices=[p for p, _ in PAGINAS], default=[p for p, _ in PAGINAS])
+    parser.add_argument('--repeticiones', type=int, default=10)
+    parser.add_argument('--calentamiento', type=int, default=1, help='Peticiones por página que no se miden.')
+    parser.add_argument('--presupuestos', default=PRESUPUESTOS)
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--conservar', action='store_true', help='No borra las bases generadas.')
+    parser.add_argument('--salida', help='Archivo JSON con el resultado.')
+    parser.add_argument('--medir', help=argparse.SUPPRESS)
+    parser.add_argument('--resultado', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.medir:
+        paginas = medir(args.medir, args.paginas, args.repeticiones, args.calentamiento)
+        with open(args.resultado, 'w', encoding='utf-8') as f:
+            json.dump(paginas, f)
+        return
+
+    with open(args.presupuestos, encoding='utf-8') as f:
+        presupuestos = json.load(f)
+
+    escalas = {}
+    if args.datos:
+        print(f'Midiendo con las bases de {args.datos}...')
+        escalas['datos'] = _medir_en_proceso(os.path.abspath(args.datos), args)
+    for escala in [] if args.datos else args.escalas:
+        directorio = tempfile.mkdtemp(prefix=f'itec_bench_paginas_{escala}_')
+        try:
+            print(f'Escala {escala}: generando datos en {directorio}...')
+            _generar(directorio, escala, args.semilla)
+            print(f'Escala {escala}: midiendo...')
+            escalas[escala] = _medir_en_proceso(directorio, args)
+        finally:
+            if not args.conservar:
+                shutil.rmtree(directorio, ignore_errors=True)
+
+    mensajes = []
+    for escala, paginas in escalas.items():
+        print(f'\n{"escala " + escala:<24} {"p50 ms":>9} {"p95 ms":>9} {"SQL":>5} {"rep.":>5} {"SQL ms":>9}')
+        for endpoint, m in paginas.items():
+            print(f'{endpoint:<24} {m["p50_ms"]:>9} {m["p95_ms"]:>9} {m["consultas"]:>5} {m["repeticion_max"]:>5} {m["sql_ms"]:>9}')
+        mensajes += excedidos(escala, paginas, presupuestos)
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump({
+                'fecha': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'commit': _commit(),
+                'python': platform.python_version(),
+                'plataforma': platform.platform(),
+                'parametros': vars(args),
+                'presupuestos': presupuestos,
+                'resultado': escalas,
+                'excedidos': mensajes,
+            }, f, indent=2, ensure_ascii=False)
+
+    if mensajes:
+        print('\nPresupuestos excedidos:')
+        for mensaje in mensajes:
+            print(f'  - {mensaje}')
+        sys.exit(1)
+    print('\nTodas las páginas dentro del presupuesto.')
+
+
+if __name__ == '__main__':
+    main()
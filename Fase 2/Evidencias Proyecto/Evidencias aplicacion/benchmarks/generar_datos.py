@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Generador de datos sintéticos a escala de producción para el esquema i-tec.
+
+Crea una base de inventario a partir del volcado 'Base de datos i-tec' (más las
+tablas de tiendas de migraciones/m002_tablas_base.py) y una base de telemetría,
+y las llena con datos referencialmente válidos:
+
+    personas, usuarios (admin / tecnico / usuario, algunos con tienda),
+    productos, tiendas, envios_tienda, retiros_tienda, historico_asignaciones,
+    mantenimientos y nfc_readings (en la base de telemetría, como la app).
+
+La popularidad de productos y tiendas sigue una ley de Zipf (--sesgo; 0 =
+uniforme), así unas pocas tiendas y productos concentran la mayoría de los
+movimientos y escaneos, como en producción.
+
+Para que sea rápido se carga sin índices, sin diario y en una transacción por
+tabla con executemany por lotes; al final se aplican las migraciones (índices y
+tablas restantes), se instalan los triggers del registro de cambios como al
+arrancar la app (sembrando el catálogo para /api/sync), se crean los índices de
+telemetría y se recalculan los rollups.
+
+Uso:
+    python benchmarks/generar_datos.py --destino /tmp/itec_grande --productos 100000 --tiendas 500 --escaneos 20000000
+    python benchmarks/generar_datos.py --destino /tmp/itec_chico --escala 0.01
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+DIRECTORIO_APP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORIO_APP)
+
+import migraciones  # noqa: E402
+import registro_cambios  # noqa: E402
+import telemetria  # noqa: E402
+from migraciones import m002_tablas_base  # noqa: E402
+
+VOLCADO = os.path.join(os.path.dirname(DIRECTORIO_APP), 'Base de datos i-tec')
+LOTE = 50000
+
+ROLES = [(1, 'admin'), (2, 'tecnico'), (3, 'usuario')]
+ESTADOS_EQUIPO = [(1, 'Operativo'), (2, 'En mantenimiento'), (3, 'De baja')]
+TIPOS_PRODUCTO = ['Notebook', 'Desktop', 'Monitor', 'Impresora', 'Teléfono', 'Tablet', 'Router', 'Lector NFC', 'Accesorio']
+CATEGORIAS_PRODUCTO = ['Computación', 'Computación', 'Periféricos', 'Periféricos', 'Móviles', 'Móviles', 'Redes', 'Periféricos', 'Periféricos']
+AREAS = ['Informática', 'Finanzas', 'Ventas', 'Bodega', 'Recursos Humanos', 'Gerencia', 'Logística']
+NOMBRES = ['Ana', 'Juan', 'María', 'Pedro', 'Camila', 'Diego', 'Valentina', 'Matías', 'Fernanda', 'José', 'Javiera', 'Felipe']
+APELLIDOS = ['González', 'Muñoz', 'Rojas', 'Díaz', 'Pérez', 'Soto', 'Contreras', 'Silva', 'Martínez', 'Sepúlveda', 'Morales']
+COMUNAS = ['Santiago', 'Providencia', 'Maipú', 'Puente Alto', 'Viña del Mar', 'Concepción', 'Temuco', 'Antofagasta']
+TIPOS_ESCANEO = [('NFC', 6), ('QR', 3), ('BARCODE', 1)]
+
+# (nombre, valor por defecto a escala 1) de cada volumen
+VOLUMENES = [
+    ('personas', 5000), ('productos', 100000), ('tiendas', 500), ('envios', 1000000), ('retiros', 200000),
+    ('asignaciones', 300000), ('mantenimientos', 50000), ('escaneos', 20000000),
+]
+
+
+def _sentencias_volcado(ruta):
+    """(tablas, indices): sentencias CREATE TABLE y CREATE INDEX del volcado de HeidiSQL."""
+    with open(ruta, encoding='utf-8') as f:
+        texto = f.read()
+    texto = re.sub(r'/\*!.*?\*/;?', '', texto)
+    texto = re.sub(r'--[^\n]*', '', texto)
+    tablas, indices, actual = [], [], ''
+    for linea in texto.splitlines(keepends=True):
+        actual += linea
+        if sqlite3.complete_statement(actual):
+            sentencia = actual.strip().rstrip(';').strip()
+            actual = ''
+            palabras = sentencia.upper().split()
+            if palabras[:2] == ['CREATE', 'TABLE']:
+                tablas.append(sentencia)
+            elif palabras[:2] == ['CREATE', 'INDEX'] or palabras[:3] == ['CREATE', 'UNIQUE', 'INDEX']:
+                indices.append(sentencia)
+    return tablas, indices
+
+
+def _zipf(n, sesgo):
+    """Pesos acumulados de popularidad para n elementos (el primero es el más popular)."""
+    return list(itertools.accumulate(1 / (i ** sesgo) for i in range(1, n + 1)))
+
+
+class Generador:
+    def __init__(self, args):
+        self.args = args
+        self.rnd = random.Random(args.semilla)
+        self.ahora = datetime.now().replace(microsecond=0)
+        self.inicio = self.ahora - timedelta(days=args.dias)
+
+    def _fecha(self):
+        return (self.inicio + timedelta(seconds=self.rnd.randrange(self.args.dias * 86400))).strftime('%Y-%m-%d %H:%M:%S')
+
+    def _cargar(self, conn, sql, filas, nombre):
+        inicio = time.perf_counter()
+        total = 0
+        conn.execute('BEGIN')
+        while True:
+            lote = list(itertools.islice(filas, LOTE))
+            if not lote:
+                break
+            conn.executemany(sql, lote)
+            total += len(lote)
+        conn.commit()
+        print(f'  {nombre:<24} {total:>11,} filas en {time.perf_counter() - inicio:6.1f} s')
+        return total
+
+    # ------------------------------------------------------------------ inventario
+    def inventario(self, ruta):
+        a, rnd = self.args, self.rnd
+        tablas, indices = _sentencias_volcado(a.volcado)
+        conn = sqlite3.connect(ruta, isolation_level=None)
+        for pragma in ('journal_mode = OFF', 'synchronous = OFF', 'locking_mode = EXCLUSIVE',
+                       'temp_store = MEMORY', 'cache_size = -262144'):
+            conn.execute(f'PRAGMA {pragma}')
+        for sentencia in tablas:
+            conn.execute(sentencia)
+        # La app guarda el nombre del tipo en nombre_producto y la categoría en
+        # tipo_producto; el volcado es anterior a esa columna.
+        if 'nombre_producto' not in [c[1] for c in conn.execute('PRAGMA table_info(tipos_producto)')]:
+            conn.execute('ALTER TABLE tipos_producto ADD COLUMN nombre_producto TEXT')
+        m002_tablas_base.crear_tablas_tiendas(conn.cursor())
+
+        self._cargar(conn, 'INSERT INTO roles (id_rol, nombre_rol) VALUES (?, ?)', iter(ROLES), 'roles')
+        self._cargar(conn, 'INSERT INTO estados_equipo (estado_equipo_id, nombre) VALUES (?, ?)', iter(ESTADOS_EQUIPO), 'estados_equipo')
+        self._cargar(conn, 'INSERT INTO tipos_movimiento (tipo_movimiento_id, nombre) VALUES (?, ?)',
+                     iter(m002_tablas_base.TIPOS_MOVIMIENTO), 'tipos_movimiento')
+        self._cargar(conn, 'INSERT INTO tipos_producto (tipo_producto_id, nombre_producto, tipo_producto) VALUES (?, ?, ?)',
+                     ((i, n, c) for i, (n, c) in enumerate(zip(TIPOS_PRODUCTO, CATEGORIAS_PRODUCTO), 1)), 'tipos_producto')
+        self._cargar(conn, 'INSERT INTO areas (area_id, nombre_area) VALUES (?, ?)', enumerate(AREAS, 1), 'areas')
+        self._cargar(conn, 'INSERT INTO proveedores (proveedor_id, nombre, contacto, email) VALUES (?, ?, ?, ?)',
+                     ((i, f'Proveedor {i}', f'Contacto {i}', f'ventas{i}@proveedor.cl') for i in range(1, 51)), 'proveedores')
+        self._cargar(conn, 'INSERT INTO tiendas (tienda_id, nombre_tienda, direccion) VALUES (?, ?, ?)',
+                     ((i, f'Tienda {i:04d}', f'Av. Principal {rnd.randint(1, 9999)}, {rnd.choice(COMUNAS)}')
+                      for i in range(1, a.tiendas + 1)), 'tiendas')
+
+        ruts = [str(10000000 + i) for i in range(a.personas)]
+        self._cargar(conn, '''INSERT INTO personas (rut, dv, primer_nombre, apellido_pat, apellido_mat, telefono, correo)
+                              VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                     ((rut, rnd.randint(0, 9), rnd.choice(NOMBRES), rnd.choice(APELLIDOS), rnd.choice(APELLIDOS),
+                       f'+569{rnd.randint(10000000, 99999999)}', f'persona{rut}@itec.cl') for rut in ruts), 'personas')
+
+        # 2 % técnicos, 1 % administradores (al menos uno de cada uno); un tercio de los usuarios con tienda.
+        n_admin = max(1, a.personas // 100)
+        n_tecnicos = max(1, a.personas // 50)
+
+        def usuarios():
+            for i, rut in enumerate(ruts, 1):
+                rol = 1 if i <= n_admin else 2 if i <= n_admin + n_tecnicos else 3
+                tienda = rnd.randint(1, a.tiendas) if rol == 3 and rnd.random() < 0.33 else None
+                yield (i, f'usuario{i}', 'pbkdf2:sha256:sintetico', 'Activo', rut, rnd.randint(1, len(AREAS)),
+                       self._fecha(), rol, tienda)
+        self._cargar(conn, '''INSERT INTO usuarios (usuario_id, nombre_usuario, password, activo, persona_rut, area_id,
+                                                    fecha_creacion, id_rol, tienda_id)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''', usuarios(), 'usuarios')
+        tecnicos = list(range(n_admin + 1, n_admin + n_tecnicos + 1))
+
+        self._cargar(conn, '''INSERT INTO productos (producto_id, nombre, tipo_producto_id, numero_serie, numero_factura,
+                                                     fecha_compra, valor_unitario, proveedor_id, estado_equipo_id,
+                                                     ubicacion_fisica, stock_actual)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     ((i, f'{rnd.choice(TIPOS_PRODUCTO)} modelo {rnd.randint(1, 400)}', rnd.randint(1, len(TIPOS_PRODUCTO)),
+                       f'SN-{i:08d}', f'F-{rnd.randint(1, a.productos // 10 + 1):07d}', self._fecha()[:10],
+                       round(rnd.uniform(5000, 1500000), 0), rnd.randint(1, 50),
+                       rnd.choices((1, 2, 3), (90, 5, 5))[0], f'Bodega {rnd.choice("ABCD")}-{rnd.randint(1, 40)}',
+                       rnd.randint(0, 50)) for i in range(1, a.productos + 1)), 'productos')
+
+        pesos_productos = _zipf(a.productos, a.sesgo)
+        pesos_tiendas = _zipf(a.tiendas, a.sesgo)
+        productos = range(1, a.productos + 1)
+        tiendas = range(1, a.tiendas + 1)
+
+        def pares(n):
+            """(producto, tienda) según la popularidad, generados por lotes."""
+            while n > 0:
+                k = min(n, LOTE)
+                yield from zip(rnd.choices(productos, cum_weights=pesos_productos, k=k),
+                               rnd.choices(tiendas, cum_weights=pesos_tiendas, k=k))
+                n -= k
+
+        self._cargar(conn, '''INSERT INTO envios_tienda (producto_id, tienda_id, cantidad_enviada, usuario_id, fecha_envio)
+                              VALUES (?, ?, ?, ?, ?)''',
+                     ((p, t, rnd.randint(1, 20), rnd.randint(1, n_admin), self._fecha()) for p, t in pares(a.envios)),
+                     'envios_tienda')
+
+        def retiros():
+            for p, t in pares(a.retiros):
+                pendiente = rnd.random() < a.pendientes
+                fecha = self._fecha()
+                yield (p, t, rnd.randint(1, 5), 'Pendiente' if pendiente else 'Completado', rnd.randint(1, a.personas),
+                       None if pendiente else rnd.randint(1, n_admin), fecha, None if pendiente else fecha)
+        self._cargar(conn, '''INSERT INTO retiros_tienda (producto_id, tienda_id, cantidad_retirada, estado,
+                                                          usuario_solicitante_id, usuario_receptor_id, fecha_solicitud,
+                                                          fecha_recepcion)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', retiros(), 'retiros_tienda')
+
+        def asignaciones():
+            for _ in range(a.asignaciones):
+                abierta = rnd.random() < a.abiertas
+                fecha = self._fecha()
+                yield (rnd.randint(1, a.personas), rnd.choices(productos, cum_weights=pesos_productos)[0], fecha,
+                       None if abierta else fecha, rnd.choice((1, 4)), rnd.randint(1, n_admin))
+        self._cargar(conn, '''INSERT INTO historico_asignaciones (usuario_id, producto_id, fecha_asignacion, fecha_devolucion,
+                                                                  tipo_movimiento_id, responsable_id)
+                              VALUES (?, ?, ?, ?, ?, ?)''', asignaciones(), 'historico_asignaciones')
+
+        def mantenimientos():
+            for _ in range(a.mantenimientos):
+                fecha = self._fecha()
+                yield (rnd.randint(1, a.productos), fecha, None if rnd.random() < a.abiertas else fecha,
+                       'Mantenimiento preventivo', rnd.choice(tecnicos))
+        self._cargar(conn, '''INSERT INTO mantenimientos (producto_id, fecha_inicio, fecha_fin, descripcion, tecnico_id)
+                              VALUES (?, ?, ?, ?, ?)''', mantenimientos(), 'mantenimientos')
+
+        inicio = time.perf_counter()
+        for sentencia in indices:
+            conn.execute(sentencia)
+        conn.execute('PRAGMA locking_mode = NORMAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+        migraciones.aplicar(conn)
+        registro_cambios.actualizar_triggers(conn)
+        print(f'  {"índices y migraciones":<24} {"":>11}       en {time.perf_counter() - inicio:6.1f} s')
+        conn.close()
+
+    # ------------------------------------------------------------------ telemetría
+    def telemetria(self, ruta):
+        a, rnd = self.args, self.rnd
+        conn = sqlite3.connect(ruta, isolation_level=None)
+        # auto_vacuum antes de crear tablas: así crear_tablas no necesita un VACUUM sobre millones de filas.
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        for pragma in ('journal_mode = OFF', 'synchronous = OFF', 'locking_mode = EXCLUSIVE', 'cache_size = -262144'):
+            conn.execute(f'PRAGMA {pragma}')
+        conn.execute('''
+            CREATE TABLE nfc_readings (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, device_info TEXT, nfc_data TEXT,
+                timestamp TEXT, formatted_time TEXT, ip_address TEXT, user_agent TEXT, client_scan_id TEXT
+            )''')
+
+        # Un lector por tienda (los de tiendas populares escanean más) y los escaneos ordenados en el tiempo.
+        pesos_productos = _zipf(a.productos, a.sesgo)
+        pesos_tiendas = _zipf(a.tiendas, a.sesgo)
+        tipos, pesos_tipos = zip(*TIPOS_ESCANEO)
+        paso = a.dias * 86400 / max(1, a.escaneos)
+        agentes = ['I-Tec NFC Reader/1.4 (Android 13)', 'I-Tec NFC Reader/1.4 (Android 14)', 'I-Tec NFC Reader/1.3 (Android 12)']
+
+        # Los textos JSON se arman una vez por tienda y tipo: json.dumps por fila es lo más lento de la carga.
+        dispositivos = [None] + [json.dumps({'deviceId': f'lector-{t:04d}', 'platform': 'android', 'tienda_id': t})
+                                 for t in range(1, a.tiendas + 1)]
+        ips = [None] + [f'10.{t // 250}.{t % 250}.{10 + t % 7}' for t in range(1, a.tiendas + 1)]
+        plantillas = {t: json.dumps({'type': t, 'content': '@@', 'scan_type': t.lower()}).replace('@@', 'SN-%08d')
+                      for t in tipos}
+
+        def escaneos():
+            emitidos = 0
+            while emitidos < a.escaneos:
+                k = min(LOTE, a.escaneos - emitidos)
+                productos = rnd.choices(range(1, a.productos + 1), cum_weights=pesos_productos, k=k)
+                tiendas = rnd.choices(range(1, a.tiendas + 1), cum_weights=pesos_tiendas, k=k)
+                escaneo_tipos = rnd.choices(tipos, pesos_tipos, k=k)
+                for j in range(k):
+                    momento = self.inicio + timedelta(seconds=(emitidos + j) * paso)
+                    tienda = tiendas[j]
+                    iso = momento.isoformat()
+                    yield (dispositivos[tienda], plantillas[escaneo_tipos[j]] % productos[j], iso,
+                           iso[:19].replace('T', ' '), ips[tienda], agentes[tienda % len(agentes)])
+                emitidos += k
+
+        self._cargar(conn, '''INSERT INTO nfc_readings (device_info, nfc_data, timestamp, formatted_time, ip_address, user_agent)
+                              VALUES (?, ?, ?, ?, ?, ?)''', escaneos(), 'nfc_readings')
+        inicio = time.perf_counter()
+        conn.execute('PRAGMA locking_mode = NORMAL')
+        conn.execute('PRAGMA journal_mode = DELETE')
+        telemetria.crear_tablas(conn)
+        conn.close()
+        print(f'  {"índices de telemetría":<24} {"":>11}       en {time.perf_counter() - inicio:6.1f} s')
+        inicio = time.perf_counter()
+        telemetria.reconstruir_rollups(ruta, os.path.join(os.path.dirname(ruta), telemetria.TELEMETRIA_DIR_ARCHIVO))
+        print(f'  {"rollups":<24} {"":>11}       en {time.perf_counter() - inicio:6.1f} s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Genera bases de inventario y telemetría con datos sintéticos.')
+    parser.add_argument('--destino', required=True, help='Directorio donde se crean las bases.')
+    parser.add_argument('--inventario', default='nfc_readings.db', help='Nombre de la base de inventario.')
+    parser.add_argument('--telemetria', default=telemetria.TELEMETRIA_DATABASE_FILE, help='Nombre de la base de telemetría.')
+    parser.add_argument('--volcado', default=VOLCADO, help='Volcado del esquema (HeidiSQL).')
+    parser.add_argument('--escala', type=float, default=1.0, help='Multiplica todos los volúmenes por defecto.')
+    for nombre, valor in VOLUMENES:
+        parser.add_argument(f'--{nombre}', type=int, help=f'Cantidad de {nombre} (por defecto {valor:,} x escala).')
+    parser.add_argument('--dias', type=int, default=365, help='Días de historia hacia atrás desde hoy.')
+    parser.add_argument('--sesgo', type=float, default=1.0, help='Exponente de Zipf de productos y tiendas (0 = uniforme).')
+    parser.add_argument('--pendientes', type=float, default=0.05, help='Fracción de retiros pendientes.')
+    parser.add_argument('--abiertas', type=float, default=0.3, help='Fracción de asignaciones y mantenimientos sin cerrar.')
+    parser.add_argument('--semilla', type=int, default=42)
+    parser.add_argument('--sobrescribir', action='store_true', help='Borra las bases si ya existen.')
+    args = parser.parse_args()
+    for nombre, valor in VOLUMENES:
+        if getattr(args, nombre) is None:
+            setattr(args, nombre, max(1, int(valor * args.escala)))
+
+    os.makedirs(args.destino, exist_ok=True)
+    rutas = [os.path.join(args.destino, args.inventario), os.path.join(args.destino, args.telemetria)]
+    for ruta in rutas:
+        for sufijo in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(ruta + sufijo):
+                if not args.sobrescribir:
+                    parser.error(f'{ruta + sufijo} ya existe (use --sobrescribir).')
+                os.remove(ruta + sufijo)
+
+    generador = Generador(args)
+    inicio = time.perf_counter()
+    print(f'Inventario -> {rutas[0]}')
+    generador.inventario(rutas[0])
+    print(f'Telemetría -> {rutas[1]}')
+    generador.telemetria(rutas[1])
+    print(f'Listo en {time.perf_counter() - inicio:.1f} s.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""
+Broker local de mensajes para Socket.IO con varios procesos.
+
+Sustituto liviano de Redis para una sola máquina: cada proceso del servidor
+publica sus eventos en el puerto de entrada y el broker los reenvía a todos por
+el puerto de salida, así un escaneo recibido por un proceso llega a los paneles
+conectados a cualquier otro. Requiere pyzmq y, en los servidores, eventlet.
+
+Uso:
+    python broker_socketio.py --entrada 5555 --salida 5556
+    SOCKETIO_MESSAGE_QUEUE=zmq+tcp://127.0.0.1:5555+5556 python servidor_produccion.py
+"""
+import argparse
+
+
+def ejecutar_broker(puerto_entrada=5555, puerto_salida=5556, host='127.0.0.1'):
+    import zmq
+
+    contexto = zmq.Context()
+    receptor = contexto.socket(zmq.PULL)
+    receptor.bind(f'tcp://{host}:{puerto_entrada}')
+    publicador = contexto.socket(zmq.PUB)
+    publicador.bind(f'tcp://{host}:{puerto_salida}')
+    print(f'Broker Socket.IO: entrada tcp://{host}:{puerto_entrada}, salida tcp://{host}:{puerto_salida}')
+    try:
+        zmq.proxy(receptor, publicador)
+    finally:
+        receptor.close()
+        publicador.close()
+        contexto.term()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Broker local para la cola de mensajes de Socket.IO.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--entrada', type=int, default=5555)
+    parser.add_argument('--salida', type=int, default=5556)
+    args = parser.parse_args()
+    ejecutar_broker(args.entrada, args.salida, args.host)
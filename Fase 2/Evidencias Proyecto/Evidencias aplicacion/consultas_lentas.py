@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de consultas lentas con su plan de ejecución.
+
+Toda sentencia que pase por las conexiones instrumentadas (ver metricas.py) y
+tarde al menos ITEC_CONSULTA_LENTA_MS se escribe como una línea JSON en un
+archivo rotativo con el SQL, los parámetros normalizados, la duración, la ruta
+que la ejecutó y la salida de EXPLAIN QUERY PLAN. Además se acumula por SQL
+normalizado para la página de administración (/admin/consultas-lentas).
+
+El acumulado es por proceso; el archivo conserva la evidencia entre reinicios.
+"""
+import json
+import logging
+import os
+import re
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+import metricas
+
+UMBRAL_MS = float(os.environ.get('ITEC_CONSULTA_LENTA_MS', 200))
+ARCHIVO_LOG = os.environ.get('ITEC_LOG_CONSULTAS_LENTAS', os.path.join('logs', 'consultas_lentas.log'))
+MAX_BYTES_LOG = 5 * 1024 * 1024
+RESPALDOS_LOG = 5
+MAX_PARAMETROS = 20
+# Sólo estas sentencias tienen un plan que explicar.
+OPERACIONES_CON_PLAN = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH', 'REPLACE')
+# Control de transacciones: no se registran. Un BEGIN lento es espera de bloqueo y ya
+# se mide en itec_sql_espera_bloqueo_*; un COMMIT lento es el fsync, no una consulta.
+OPERACIONES_TRANSACCION = ('BEGIN', 'COMMIT', 'END', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+_lock = metricas.lock_nativo()
+_acumulado = {}
+_logger = logging.getLogger('itec.consultas_lentas')
+
+
+def normalizar_sql(sql):
+    """SQL en una línea, con literales y listas IN (?, ?, ...) colapsadas, para agrupar."""
+    sql = re.sub(r'\s+', ' ', sql).strip()
+    sql = re.sub(r"'(?:[^']|'')*'", "'?'", sql)
+    sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+    return re.sub(r'\(\s*\?(?:\s*,\s*\?)+\s*\)', '(?, ...)', sql)
+
+
+def _normalizar_parametros(parametros):
+    if parametros is None:
+        return None
+    if isinstance(parametros, dict):
+        parametros = list(parametros.values())
+    if not isinstance(parametros, (list, tuple)):
+        return '<iterador>'
+    if parametros and isinstance(parametros[0], (list, tuple)):
+        return {'filas': len(parametros), 'primera': _normalizar_parametros(parametros[0])}
+
+    def valor(v):
+        if isinstance(v, str) and len(v) > 60:
+            return v[:60] + '...'
+        if isinstance(v, (bytes, bytearray)):
+            return f'<{len(v)} bytes>'
+        return v
+    normalizados = [valor(v) for v in parametros[:MAX_PARAMETROS]]
+    if len(parametros) > MAX_PARAMETROS:
+        normalizados.append(f'... ({len(parametros)} en total)')
+    return normalizados
+
+
+def _primera_palabra(sql):
+    return sql.lstrip().split(None, 1)[0].upper() if sql.strip() else ''
+
+
+def _plan(conexion, sql, parametros):
+    """Salida de EXPLAIN QUERY PLAN como líneas con sangría; None si no se puede obtener."""
+    if _primera_palabra(sql) not in OPERACIONES_CON_PLAN or conexion is None:
+        return None
+    if parametros and isinstance(parametros, (list, tuple)) and isinstance(parametros[0], (list, tuple)):
+        parametros = parametros[0]
+    elif parametros is not None and not isinstance(parametros, (list, tuple, dict)):
+        return None
+    try:
+        filas = conexion.execute('EXPLAIN QUERY PLAN ' + sql, parametros or ()).fetchall()
+    except Exception as e:
+        return [f'(sin plan: {e})']
+    # Columnas: id, padre, (no usada), detalle; la sangría refleja el árbol.
+    profundidad = {0: -1}
+    lineas = []
+    for fila in filas:
+        nivel = profundidad.get(fila[1], -1) + 1
+        profundidad[fila[0]] = nivel
+        lineas.append('  ' * nivel + str(fila[3]))
+    return lineas
+
+
+def registrar(bd, sql, parametros, segundos, conexion, ruta=None):
+    plan = _plan(conexion, sql, parametros)
+    entrada = {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'pid': os.getpid(),
+        'bd': bd,
+        'ruta': ruta,
+        'duracion_ms': round(segundos * 1000, 1),
+        'sql': re.sub(r'\s+', ' ', sql).strip(),
+        'parametros': _normalizar_parametros(parametros),
+        'plan': plan,
+    }
+    _logger.warning(json.dumps(entrada, ensure_ascii=False, default=str))
+
+    clave = (bd, normalizar_sql(sql))
+    with _lock:
+        a = _acumulado.get(clave)
+        if a is None:
+            a = _acumulado[clave] = {'bd': bd, 'sql': clave[1], 'veces': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rutas': {}}
+        a['veces'] += 1
+        a['total_ms'] += entrada['duracion_ms']
+        if entrada['duracion_ms'] >= a['max_ms']:
+            a['max_ms'] = entrada['duracion_ms']
+            a['peor'] = {'fecha': entrada['fecha'], 'parametros': entrada['parametros'], 'plan': plan, 'ruta': ruta}
+        a['rutas'][ruta] = a['rutas'].get(ruta, 0) + 1
+
+
+def peores(limite=50):
+    """Consultas agrupadas por SQL normalizado, de mayor a menor tiempo total."""
+    with _lock:
+        filas = [dict(a, rutas=dict(a['rutas'])) for a in _acumulado.values()]
+    for f in filas:
+        f['promedio_ms'] = round(f['total_ms'] / f['veces'], 1)
+        f['total_ms'] = round(f['total_ms'], 1)
+    return sorted(filas, key=lambda f: f['total_ms'], reverse=True)[:limite]
+
+
+def reiniciar():
+    with _lock:
+        _acumulado.clear()
+
+
+def instalar(obtener_ruta=None, umbral_ms=UMBRAL_MS, archivo=ARCHIVO_LOG):
+    """
+    Activa el registro. 'obtener_ruta' devuelve la ruta en curso (o None fuera
+    de una petición, p. ej. en los hilos de ejecutor_bd o en tareas de fondo).
+    """
+    if umbral_ms <= 0:
+        return
+    if not _logger.handlers:
+        if os.path.dirname(archivo):
+            os.makedirs(os.path.dirname(archivo), exist_ok=True)
+        manejador = RotatingFileHandler(archivo, maxBytes=MAX_BYTES_LOG, backupCount=RESPALDOS_LOG, encoding='utf-8')
+        manejador.setFormatter(logging.Formatter('%(message)s'))
+        # Se escribe desde los hilos de ejecutor_bd: con el RLock parcheado por eventlet/gevent
+        # un hilo que espera a un greenlet dueño del lock rompe el hub (ver metricas.lock_nativo).
+        manejador.lock = metricas.lock_nativo(reentrante=True)
+        _logger.addHandler(manejador)
+        _logger.propagate = False
+        _logger.setLevel(logging.WARNING)
+
+    def observador(bd, sql, parametros, segundos, conexion):
+        if _primera_palabra(sql) in OPERACIONES_TRANSACCION:
+            return
+        try:
+            registrar(bd, sql, parametros, segundos, conexion, obtener_ruta() if obtener_ruta else None)
+        except Exception as e:
+            print(f"ERROR: No se pudo registrar la consulta lenta: {e}")
+
+    metricas.umbral_lento = umbral_ms / 1000
+    metricas.observador_lento = observador
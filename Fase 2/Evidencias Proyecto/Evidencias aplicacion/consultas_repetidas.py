@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Conteo de sentencias SQL por petición y detector de consultas en bucle (N+1).
+
+Modo de desarrollo y pruebas, activado con ITEC_CONSULTAS_REPETIDAS:
+
+    no       (por defecto) no se cuenta nada.
+    avisar   cada petición cuenta sus sentencias, agrupadas por SQL normalizado
+             (literales colapsados, ver consultas_lentas.normalizar_sql); si una
+             misma sentencia corre más de ITEC_CONSULTAS_REPETIDAS_MAX veces se
+             escribe un aviso en el log 'itec.consultas_repetidas'.
+    fallar   igual, pero la petición termina con ConsultasRepetidas (un 500, o
+             la excepción misma en el cliente de pruebas de Flask).
+
+Con el modo activo cada respuesta lleva X-Consultas-SQL (sentencias de la
+petición) y X-Consultas-SQL-Repeticion (veces que corrió la sentencia más
+repetida), y /metrics publica el histograma de sentencias por ruta y las
+peticiones que superaron el máximo.
+
+El conteo viaja en una variable de contexto, así que incluye lo que la petición
+ejecuta en los hilos de ejecutor_bd (que corren en una copia del contexto).
+"""
+import contextvars
+import functools
+import logging
+import os
+
+from flask import g, request
+
+import metricas
+from consultas_lentas import normalizar_sql
+
+MODO = os.environ.get('ITEC_CONSULTAS_REPETIDAS', 'no')
+MAX_REPETICIONES = int(os.environ.get('ITEC_CONSULTAS_REPETIDAS_MAX', 5))
+CABECERA = 'X-Consultas-SQL'
+CABECERA_REPETICION = 'X-Consultas-SQL-Repeticion'
+LIMITES_SENTENCIAS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_actual = contextvars.ContextVar('itec_consultas_peticion', default=None)
+_logger = logging.getLogger('itec.consultas_repetidas')
+_normalizar = functools.lru_cache(maxsize=2048)(normalizar_sql)
+
+sentencias_por_peticion = metricas.Histograma(
+    'itec_http_sentencias_sql', 'Sentencias SQL por petición HTTP (con ITEC_CONSULTAS_REPETIDAS activo).',
+    ('ruta',), limites=LIMITES_SENTENCIAS)
+peticiones_repetidas = metricas.Contador(
+    'itec_http_consultas_repetidas_total', 'Peticiones con una misma sentencia SQL más de ITEC_CONSULTAS_REPETIDAS_MAX veces.',
+    ('ruta',))
+
+
+class ConsultasRepetidas(Exception):
+    """Una petición ejecutó la misma sentencia más veces que lo permitido (modo 'fallar')."""
+
+
+def contar(bd, sql):
+    conteo = _actual.get()
+    if conteo is not None:
+        clave = (bd, _normalizar(sql))
+        conteo[clave] = conteo.get(clave, 0) + 1
+
+
+def repetidas(conteo, maximo=MAX_REPETICIONES):
+    """[(bd, sql normalizado, veces)] de las sentencias que corrieron más de 'maximo' veces, de más a menos."""
+    return sorted(((bd, sql, n) for (bd, sql), n in conteo.items() if n > maximo), key=lambda r: r[2], reverse=True)
+
+
+def instalar(app, modo=MODO, maximo=MAX_REPETICIONES):
+    """Registra los hooks de Flask que cuentan las sentencias de cada petición."""
+    if modo not in ('avisar', 'fallar'):
+        return
+    metricas.observador_sentencia = contar
+
+    @app.before_request
+    def _iniciar_conteo():
+        g.conteo_sql = {}
+        g.token_conteo_sql = _actual.set(g.conteo_sql)
+
+    @app.after_request
+    def _revisar_conteo(response):
+        conteo = g.pop('conteo_sql', None)
+        if conteo is None:
+            return response
+        _actual.reset(g.pop('token_conteo_sql'))
+        ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        total = sum(conteo.values())
+        sentencias_por_peticion.observar(total, ruta)
+        response.headers[CABECERA] = str(total)
+        response.headers[CABECERA_REPETICION] = str(max(conteo.values(), default=0))
+
+        excedidas = repetidas(conteo, maximo)
+        if excedidas:
+            peticiones_repetidas.inc(ruta)
+            detalle = '; '.join(f'{n}x [{bd}] {sql[:200]}' for bd, sql, n in excedidas[:5])
+            mensaje = f'{request.method} {ruta}: sentencias repetidas más de {maximo} veces: {detalle}'
+            if modo == 'fallar':
+                raise ConsultasRepetidas(mensaje)
+            _logger.warning(mensaje)
+        return response
+
+    @app.teardown_request
+    def _descartar_conteo(error=None):
+        # Si la vista lanzó una excepción after_request no corre.
+        g.pop('conteo_sql', None)
+        token = g.pop('token_conteo_sql', None)
+        if token is not None:
+            _actual.reset(token)
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Ventana en memoria de escaneos recientes para descartar duplicados.
+
+La app móvil reintenta ante un timeout y los lectores NFC generan ráfagas de
+lecturas idénticas con un doble toque. Cada proceso recuerda los últimos
+escaneos (LRU acotado) y, si llega otro igual dentro de la ventana, responde
+con la lectura original sin volver a escribir ni emitir.
+
+El estado es por proceso: con varios procesos, el índice único de
+client_scan_id en la base sigue garantizando la idempotencia de los reintentos.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+DEDUP_SEGUNDOS = float(os.environ.get('ITEC_DEDUP_SEGUNDOS', 2))
+DEDUP_CAPACIDAD = int(os.environ.get('ITEC_DEDUP_CAPACIDAD', 10000))
+
+
+class VentanaDuplicados:
+    """LRU de clave -> lectura; con 'segundos' las entradas caducan (None = sólo por capacidad)."""
+
+    def __init__(self, segundos=DEDUP_SEGUNDOS, capacidad=DEDUP_CAPACIDAD):
+        self.segundos = segundos
+        self.capacidad = capacidad
+        self._entradas = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def activa(self):
+        return self.capacidad > 0 and (self.segundos is None or self.segundos > 0)
+
+    def buscar(self, clave):
+        """Lectura registrada para 'clave' si sigue vigente; si no, None."""
+        if not self.activa:
+            return None
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            instante, lectura = entrada
+            if self.segundos is not None and time.monotonic() - instante > self.segundos:
+                del self._entradas[clave]
+                return None
+            self._entradas.move_to_end(clave)
+            return lectura
+
+    def registrar(self, clave, lectura):
+        if not self.activa:
+            return
+        with self._lock:
+            self._entradas[clave] = (time.monotonic(), lectura)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.capacidad:
+                self._entradas.popitem(last=False)
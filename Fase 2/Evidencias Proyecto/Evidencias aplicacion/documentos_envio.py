@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Documentos de envío a tienda con múltiples líneas.
+
+Un documento se arma en estado 'Borrador' (a mano o escaneando productos) y al
+confirmarlo se valida todo el stock con una sola consulta, se descuenta y se
+registra en 'envios_tienda' dentro de una única transacción.
+"""
+
+
+def crear_documento(conn, tienda_id, usuario_id):
+    """Crea un documento en borrador para una tienda y devuelve su ID."""
+    if not conn.execute("SELECT 1 FROM tiendas WHERE tienda_id = ?", (tienda_id,)).fetchone():
+        raise ValueError('La tienda indicada no existe.')
+    cur = conn.execute("INSERT INTO documentos_envio (tienda_id, usuario_id) VALUES (?, ?)", (tienda_id, usuario_id))
+    conn.commit()
+    return cur.lastrowid
+
+
+def agregar_lineas(conn, documento_id, lineas):
+    """
+    Suma cantidades (producto_id, cantidad) al documento. Si el producto ya
+    tiene línea se acumula, de modo que escanear dos veces equivale a cantidad 2.
+    """
+    lineas = [(documento_id, producto_id, int(cantidad)) for producto_id, cantidad in lineas]
+    if any(l[2] <= 0 for l in lineas):
+        raise ValueError('Las cantidades deben ser mayores que cero.')
+
+    fila = conn.execute("SELECT estado FROM documentos_envio WHERE documento_id = ?", (documento_id,)).fetchone()
+    if not fila:
+        raise ValueError('El documento de envío no existe.')
+    if fila[0] != 'Borrador':
+        raise ValueError(f'El documento de envío ya está {fila[0].lower()}.')
+
+    conn.executemany("""
+        INSERT INTO documentos_envio_lineas (documento_id, producto_id, cantidad) VALUES (?, ?, ?)
+        ON CONFLICT (documento_id, producto_id) DO UPDATE SET cantidad = cantidad + excluded.cantidad
+    """, lineas)
+    conn.commit()
+
+
+def eliminar_borrador(conn, documento_id):
+    """Borra un documento que sigue en borrador junto con sus líneas (los enviados no se tocan)."""
+    if conn.in_transaction:
+        conn.rollback()
+    conn.execute("""
+        DELETE FROM documentos_envio_lineas
+        WHERE documento_id = ? AND documento_id IN (SELECT documento_id FROM documentos_envio WHERE estado = 'Borrador')
+    """, (documento_id,))
+    conn.execute("DELETE FROM documentos_envio WHERE documento_id = ? AND estado = 'Borrador'", (documento_id,))
+    conn.commit()
+
+
+def obtener_lineas(conn, documento_id):
+    return conn.execute("""
+        SELECT l.producto_id, p.nombre, p.numero_serie, l.cantidad, p.stock_actual
+        FROM documentos_envio_lineas l
+        JOIN productos p ON l.producto_id = p.producto_id
+        WHERE l.documento_id = ?
+        ORDER BY p.nombre
+    """, (documento_id,)).fetchall()
+
+
+def confirmar(conn, documento_id, usuario_id):
+    """
+    Valida, descuenta stock y registra todas las líneas en 'envios_tienda'.
+
+    Se abre la transacción con BEGIN IMMEDIATE para tomar el bloqueo de
+    escritura antes de validar: ningún otro proceso puede descontar stock entre
+    la validación y el descuento. Devuelve (exito, mensaje, faltantes).
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        doc = conn.execute("SELECT tienda_id, estado FROM documentos_envio WHERE documento_id = ?", (documento_id,)).fetchone()
+        if not doc:
+            conn.rollback()
+            return False, 'El documento de envío no existe.', []
+        tienda_id, estado = doc[0], doc[1]
+        if estado != 'Borrador':
+            conn.rollback()
+            return False, f'El documento de envío ya está {estado.lower()}.', []
+
+        # Validación de todo el documento en una sola consulta.
+        faltantes = [
+            {'producto_id': f[0], 'nombre': f[1], 'solicitado': f[2], 'disponible': f[3]}
+            for f in conn.execute("""
+                SELECT l.producto_id, p.nombre, l.cantidad, COALESCE(p.stock_actual, 0)
+                FROM documentos_envio_lineas l
+                LEFT JOIN productos p ON l.producto_id = p.producto_id
+                WHERE l.documento_id = ? AND (p.producto_id IS NULL OR l.cantidad > p.stock_actual)
+            """, (documento_id,)).fetchall()
+        ]
+        if faltantes:
+            conn.rollback()
+            return False, f'Stock insuficiente para {len(faltantes)} producto(s).', faltantes
+
+        totales = conn.execute("SELECT COUNT(*), COALESCE(SUM(cantidad), 0) FROM documentos_envio_lineas WHERE documento_id = ?",
+                               (documento_id,)).fetchone()
+        if not totales[0]:
+            conn.rollback()
+            return False, 'El documento de envío no tiene líneas.', []
+
+        conn.execute("""
+            UPDATE productos
+            SET stock_actual = stock_actual - (
+                SELECT l.cantidad FROM documentos_envio_lineas l
+                WHERE l.documento_id = ? AND l.producto_id = productos.producto_id
+            )
+            WHERE producto_id IN (SELECT producto_id FROM documentos_envio_lineas WHERE documento_id = ?)
+        """, (documento_id, documento_id))
+        conn.execute("""
+            INSERT INTO envios_tienda (producto_id, tienda_id, cantidad_enviada, usuario_id)
+            SELECT producto_id, ?, cantidad, ? FROM documentos_envio_lineas WHERE documento_id = ?
+        """, (tienda_id, usuario_id, documento_id))
+        conn.execute("UPDATE documentos_envio SET estado = 'Enviado', fecha_envio = datetime('now') WHERE documento_id = ?",
+                     (documento_id,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return True, f'Se enviaron {totales[1]} unidades de {totales[0]} producto(s) a la tienda.', []
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Ejecución de trabajo SQLite fuera del bucle de eventos.
+
+El módulo sqlite3 es código C que bloquea: bajo eventlet o gevent una escritura
+que espera el bloqueo de la base detiene a todos los clientes del proceso. Aquí
+ese trabajo se envía a un grupo acotado de hilos del sistema operativo y la
+petición (greenlet) cede el control mientras espera el resultado.
+
+La función ejecutada debe abrir y cerrar su propia conexión: las conexiones de
+sqlite3 no se comparten entre hilos.
+"""
+import contextvars
+import os
+import threading
+
+MAX_HILOS_BD = int(os.environ.get('ITEC_HILOS_BD', 8))
+
+
+class EjecutorBD:
+    """Despacha funciones de base de datos según el modo asíncrono de Socket.IO."""
+
+    def __init__(self, modo, max_hilos=MAX_HILOS_BD, activo=True):
+        self.modo = modo
+        self.max_hilos = max_hilos
+        self.activo = activo
+        self._preparado = False
+        self._lock = threading.Lock()
+
+    def _preparar(self):
+        with self._lock:
+            if self._preparado:
+                return
+            if self.modo == 'eventlet':
+                from eventlet import tpool
+                tpool.set_num_threads(self.max_hilos)
+            elif self.modo == 'gevent':
+                import gevent
+                gevent.get_hub().threadpool.maxsize = self.max_hilos
+            self._preparado = True
+
+    def ejecutar(self, funcion, *args, **kwargs):
+        """
+        Ejecuta funcion(*args, **kwargs) y devuelve su resultado. En modo
+        threading cada petición ya tiene su propio hilo, por lo que se llama
+        directamente; en eventlet/gevent se usa el grupo de hilos nativo, en una
+        copia del contexto (contextvars) de quien llama.
+        """
+        if not self.activo or self.modo not in ('eventlet', 'gevent'):
+            return funcion(*args, **kwargs)
+        if not self._preparado:
+            self._preparar()
+        contexto = contextvars.copy_context()
+        if self.modo == 'eventlet':
+            from eventlet import tpool
+            return tpool.execute(contexto.run, funcion, *args, **kwargs)
+        import gevent
+        return gevent.get_hub().threadpool.apply(contexto.run, (funcion,) + args, kwargs)
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Configuración de gunicorn para el servidor I-Tec.
+
+El balanceador de gunicorn no mantiene sesiones persistentes, requisito de
+Socket.IO con long-polling, por eso cada instancia usa un único worker
+asíncrono. Para usar más núcleos se levantan varias instancias en puertos
+distintos (servidor_produccion.py) que comparten la cola SOCKETIO_MESSAGE_QUEUE.
+"""
+import os
+
+bind = os.environ.get('ITEC_BIND', '0.0.0.0:5001')
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'eventlet')
+workers = 1
+worker_connections = int(os.environ.get('GUNICORN_WORKER_CONNECTIONS', 1000))
+timeout = 60
+graceful_timeout = 30
+accesslog = '-'
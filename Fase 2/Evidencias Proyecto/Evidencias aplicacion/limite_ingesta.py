@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Limitación de tasa por dispositivo en los endpoints de ingesta de escaneos.
+
+Cada equipo (deviceId o, si no lo envía, su IP) tiene un balde de fichas que se
+recarga a ITEC_LIMITE_ESCANEOS_SEG fichas por segundo hasta ITEC_LIMITE_RAFAGA.
+Un lector trabado o una tormenta de reintentos agota su propio balde y recibe
+429 con Retry-After, sin quitarle el bloqueo de escritura al resto de tiendas.
+
+El deviceId lo envía el cliente, así que además cada IP de origen tiene un balde
+más holgado (ITEC_LIMITE_ESCANEOS_IP_SEG / ITEC_LIMITE_RAFAGA_IP, pensado para
+varios lectores de una tienda detrás de la misma NAT): quien invente un deviceId
+distinto en cada petición sigue limitado por su IP.
+
+Los baldes y contadores son por proceso; con N procesos detrás de un balanceador
+con sesiones persistentes cada equipo cae siempre en el mismo.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+LIMITE_ESCANEOS_SEG = float(os.environ.get('ITEC_LIMITE_ESCANEOS_SEG', 10))
+LIMITE_RAFAGA = float(os.environ.get('ITEC_LIMITE_RAFAGA', 30))
+LIMITE_ESCANEOS_IP_SEG = float(os.environ.get('ITEC_LIMITE_ESCANEOS_IP_SEG', 50))
+LIMITE_RAFAGA_IP = float(os.environ.get('ITEC_LIMITE_RAFAGA_IP', 150))
+MAX_BYTES_ESCANEO = int(os.environ.get('ITEC_MAX_BYTES_ESCANEO', 16 * 1024))
+# Tope de cualquier cuerpo (MAX_CONTENT_LENGTH de Flask): también acota lo que se
+# lee de una subida sin Content-Length antes de poder medirla.
+MAX_BYTES_PETICION = int(os.environ.get('ITEC_MAX_BYTES_PETICION', 1024 * 1024))
+MAX_DISPOSITIVOS = 10000
+
+
+class LimitadorIngesta:
+    def __init__(self, tasa=LIMITE_ESCANEOS_SEG, rafaga=LIMITE_RAFAGA, max_dispositivos=MAX_DISPOSITIVOS,
+                 tasa_ip=LIMITE_ESCANEOS_IP_SEG, rafaga_ip=LIMITE_RAFAGA_IP):
+        self.tasa = tasa
+        self.rafaga = rafaga
+        self.tasa_ip = tasa_ip
+        self.rafaga_ip = rafaga_ip
+        self.max_dispositivos = max_dispositivos
+        self._baldes = OrderedDict()
+        self._baldes_ip = OrderedDict()
+        self._limitados = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_aceptados = 0
+        self.total_limitados = 0
+        self.total_demasiado_grandes = 0
+
+    @property
+    def activo(self):
+        return self.tasa > 0 or self.tasa_ip > 0
+
+    def consumir(self, clave, ip=None):
+        """
+        Descuenta una ficha del balde de la IP (si se indica) y del de 'clave'.
+        Devuelve 0 si se acepta o los segundos a esperar.
+        """
+        if not self.activo:
+            return 0
+        ahora = time.monotonic()
+        with self._lock:
+            espera = 0
+            if ip is not None and self.tasa_ip > 0:
+                espera = self._tomar(self._baldes_ip, ip, self.tasa_ip, self.rafaga_ip, ahora)
+                limitado = f'ip:{ip}'
+            if not espera and self.tasa > 0:
+                espera = self._tomar(self._baldes, clave, self.tasa, self.rafaga, ahora)
+                limitado = clave
+            if not espera:
+                self.total_aceptados += 1
+                return 0
+            self.total_limitados += 1
+            self._limitados[limitado] = self._limitados.pop(limitado, 0) + 1
+            while len(self._limitados) > self.max_dispositivos:
+                self._limitados.popitem(last=False)
+            return espera
+
+    def _tomar(self, baldes, clave, tasa, rafaga, ahora):
+        fichas, ultimo = baldes.pop(clave, (rafaga, ahora))
+        fichas = min(rafaga, fichas + (ahora - ultimo) * tasa)
+        if fichas >= 1:
+            fichas -= 1
+            espera = 0
+        else:
+            espera = max(1, math.ceil((1 - fichas) / tasa))
+        baldes[clave] = (fichas, ahora)
+        while len(baldes) > self.max_dispositivos:
+            baldes.popitem(last=False)
+        return espera
+
+    def registrar_demasiado_grande(self):
+        with self._lock:
+            self.total_demasiado_grandes += 1
+
+    def contadores(self, top=20):
+        with self._lock:
+            mas_limitados = sorted(self._limitados.items(), key=lambda x: x[1], reverse=True)[:top]
+            return {
+                'tasa_por_segundo': self.tasa,
+                'rafaga': self.rafaga,
+                'tasa_ip_por_segundo': self.tasa_ip,
+                'rafaga_ip': self.rafaga_ip,
+                'aceptados': self.total_aceptados,
+                'limitados': self.total_limitados,
+                'demasiado_grandes': self.total_demasiado_grandes,
+                'dispositivos_limitados': [{'dispositivo': d, 'limitados': n} for d, n in mas_limitados],
+            }
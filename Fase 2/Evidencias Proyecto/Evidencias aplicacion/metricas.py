@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+Métricas del servidor en formato de texto de Prometheus (/metrics).
+
+Incluye latencia por ruta HTTP, tiempo de cada sentencia SQL (por base y tipo
+de operación), esperas por el bloqueo de escritura y errores de base ocupada,
+clientes de Socket.IO conectados y eventos emitidos. Las métricas son por
+proceso: con varios procesos, Prometheus consulta cada puerto por separado.
+
+Las actualizaciones cuestan un perf_counter y un par de operaciones sobre un
+diccionario bajo un lock; no se hace nada en disco ni en red hasta que se
+consulta /metrics.
+"""
+import sqlite3
+import threading
+import time
+
+# Límites (segundos) de los histogramas de latencia.
+LIMITES_LATENCIA = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Un BEGIN IMMEDIATE/EXCLUSIVE más lento que esto esperó a otro escritor.
+UMBRAL_ESPERA_BLOQUEO = 0.005
+OPERACIONES_SQL = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'BEGIN', 'COMMIT', 'ROLLBACK', 'CREATE', 'PRAGMA')
+
+
+def lock_nativo(reentrante=False):
+    """
+    Lock del sistema operativo aunque eventlet/gevent hayan parcheado threading:
+    las métricas SQL también se actualizan desde los hilos de ejecutor_bd.
+    Con reentrante=True devuelve un RLock (p. ej. para un logging.Handler).
+    """
+    nombre = 'RLock' if reentrante else 'allocate_lock'
+    try:
+        from eventlet.patcher import original
+        return getattr(original('_thread'), nombre)()
+    except ImportError:
+        pass
+    try:
+        from gevent.monkey import get_original
+        return get_original('_thread', nombre)()
+    except ImportError:
+        return threading.RLock() if reentrante else threading.Lock()
+
+
+_lock = lock_nativo()
+_registro = []
+
+
+def _etiquetas(nombres, valores):
+    if not nombres:
+        return ''
+    pares = ','.join(f'{n}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                     for n, v in zip(nombres, valores))
+    return '{' + pares + '}'
+
+
+class Contador:
+    """Valor acumulado; con 'funcion' (sin etiquetas) se lee de otro objeto al consultar /metrics."""
+    tipo = 'counter'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), funcion=None):
+        self.nombre, self.ayuda, self.etiquetas = nombre, ayuda, tuple(etiquetas)
+        self.funcion = funcion
+        self._valores = {}
+        _registro.append(self)
+
+    def inc(self, *valores, cantidad=1):
+        with _lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def lineas(self):
+        if self.funcion is not None:
+            try:
+                return [f'{self.nombre} {self.funcion()}']
+            except Exception:
+                return []
+        with _lock:
+            valores = sorted(self._valores.items())
+        return [f'{self.nombre}{_etiquetas(self.etiquetas, v)} {n}' for v, n in valores]
+
+
+class Medidor(Contador):
+    """Valor que sube y baja."""
+    tipo = 'gauge'
+
+    def dec(self, *valores):
+        self.inc(*valores, cantidad=-1)
+
+
+class Histograma:
+    tipo = 'histogram'
+
+    def __init__(self, nombre, ayuda, etiquetas=(), limites=LIMITES_LATENCIA):
+        self.nombre, self.ayuda, self.etiquetas, self.limites = nombre, ayuda, tuple(etiquetas), limites
+        self._series = {}
+        _registro.append(self)
+
+    def observar(self, segundos, *valores):
+        with _lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [[0] * len(self.limites), 0, 0.0]
+            for i, limite in enumerate(self.limites):
+                if segundos <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += 1
+            serie[2] += segundos
+
+    def totales(self):
+        """{valores de etiquetas: (observaciones, segundos)} acumulados hasta ahora."""
+        with _lock:
+            return {v: (t, s) for v, (_, t, s) in self._series.items()}
+
+    def lineas(self):
+        with _lock:
+            series = sorted((v, (list(c), t, s)) for v, (c, t, s) in self._series.items())
+        salida = []
+        nombres = self.etiquetas + ('le',)
+        for valores, (cubetas, total, suma) in series:
+            acumulado = 0
+            for limite, n in zip(self.limites, cubetas):
+                acumulado += n
+                salida.append(f'{self.nombre}_bucket{_etiquetas(nombres, valores + (limite,))} {acumulado}')
+            salida.append(f'{self.nombre}_bucket{_etiquetas(nombres, valores + ("+Inf",))} {total}')
+            salida.append(f'{self.nombre}_count{_etiquetas(self.etiquetas, valores)} {total}')
+            salida.append(f'{self.nombre}_sum{_etiquetas(self.etiquetas, valores)} {suma:.6f}')
+        return salida
+
+
+def exportar():
+    """Texto para /metrics (formato de exposición 0.0.4 de Prometheus)."""
+    bloques = []
+    for m in list(_registro):
+        bloques.append(f'# HELP {m.nombre} {m.ayuda}')
+        bloques.append(f'# TYPE {m.nombre} {m.tipo}')
+        bloques.extend(m.lineas())
+    return '\n'.join(bloques) + '\n'
+
+
+# ============================================================================
+# MÉTRICAS DEL SERVIDOR
+# ============================================================================
+http_peticiones = Contador('itec_http_peticiones_total', 'Peticiones HTTP atendidas.', ('ruta', 'metodo', 'estado'))
+http_duracion = Histograma('itec_http_duracion_segundos', 'Duración de las peticiones HTTP por ruta.', ('ruta', 'metodo'))
+sql_duracion = Histograma('itec_sql_duracion_segundos', 'Duración de las sentencias SQL.', ('bd', 'operacion'))
+sql_bd_ocupada = Contador('itec_sql_bd_ocupada_total', 'Sentencias que fallaron con "database is locked/busy".', ('bd',))
+sql_esperas_bloqueo = Contador('itec_sql_esperas_bloqueo_total', 'Transacciones de escritura que esperaron el bloqueo.', ('bd',))
+sql_espera_bloqueo_segundos = Contador('itec_sql_espera_bloqueo_segundos_total', 'Tiempo total esperando el bloqueo de escritura.', ('bd',))
+socketio_clientes = Medidor('itec_socketio_clientes_conectados', 'Clientes de Socket.IO conectados a este proceso.')
+socketio_emisiones = Contador('itec_socketio_emisiones_total', 'Eventos emitidos por Socket.IO.', ('evento',))
+
+
+def _operacion(sql):
+    palabra = sql.lstrip().split(None, 1)[0].upper() if sql and sql.strip() else ''
+    return palabra if palabra in OPERACIONES_SQL else 'OTRA'
+
+
+# Función (bd, sql, parametros, segundos, conexion) llamada para sentencias que
+# tardan al menos 'umbral_lento' segundos; la instala consultas_lentas.instalar().
+observador_lento = None
+umbral_lento = None
+# Función (segundos) llamada con cada sentencia mientras hay un perfil en curso (ver perfilado.py).
+observador_perfil = None
+# Función (bd, sql) llamada con cada sentencia; la instala consultas_repetidas.instalar().
+observador_sentencia = None
+
+
+def _medir(bd, cursor, funcion, sql, parametros=None):
+    inicio = time.perf_counter()
+    try:
+        return funcion(sql) if parametros is None else funcion(sql, parametros)
+    except sqlite3.OperationalError as e:
+        mensaje = str(e).lower()
+        if 'locked' in mensaje or 'busy' in mensaje:
+            sql_bd_ocupada.inc(bd)
+        raise
+    finally:
+        duracion = time.perf_counter() - inicio
+        operacion = _operacion(sql)
+        sql_duracion.observar(duracion, bd, operacion)
+        if operacion == 'BEGIN' and duracion > UMBRAL_ESPERA_BLOQUEO:
+            sql_esperas_bloqueo.inc(bd)
+            sql_espera_bloqueo_segundos.inc(bd, cantidad=duracion)
+        if observador_lento is not None and duracion >= umbral_lento:
+            observador_lento(bd, sql, parametros, duracion, cursor.connection)
+        if observador_perfil is not None:
+            observador_perfil(duracion)
+        if observador_sentencia is not None:
+            observador_sentencia(bd, sql)
+
+
+class CursorInstrumentado:
+    """Cursor de sqlite3 que mide cada sentencia; el resto se delega al cursor real."""
+
+    def __init__(self, cursor, bd):
+        object.__setattr__(self, '_cursor', cursor)
+        object.__setattr__(self, '_bd', bd)
+
+    def execute(self, sql, parametros=()):
+        _medir(self._bd, self._cursor, self._cursor.execute, sql, parametros)
+        return self
+
+    def executemany(self, sql, parametros):
+        _medir(self._bd, self._cursor, self._cursor.executemany, sql, parametros)
+        return self
+
+    def executescript(self, script):
+        _medir(self._bd, self._cursor, self._cursor.executescript, script)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._cursor, nombre, valor)
+
+
+class ConexionInstrumentada:
+    """Conexión de sqlite3 cuyas sentencias pasan por CursorInstrumentado."""
+
+    def __init__(self, conn, bd):
+        object.__setattr__(self, '_conn', conn)
+        object.__setattr__(self, '_bd', bd)
+
+    def cursor(self, *args):
+        return CursorInstrumentado(self._conn.cursor(*args), self._bd)
+
+    def execute(self, sql, parametros=()):
+        return self.cursor().execute(sql, parametros)
+
+    def executemany(self, sql, parametros):
+        return self.cursor().executemany(sql, parametros)
+
+    def executescript(self, script):
+        return self.cursor().executescript(script)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def __getattr__(self, nombre):
+        return getattr(self._conn, nombre)
+
+    def __setattr__(self, nombre, valor):
+        setattr(self._conn, nombre, valor)
+
+
+def instrumentar(obtener_conexion, bd):
+    """Envuelve una función que abre conexiones para que devuelva conexiones instrumentadas."""
+    def obtener_conexion_instrumentada(*args, **kwargs):
+        return ConexionInstrumentada(obtener_conexion(*args, **kwargs), bd)
+    obtener_conexion_instrumentada.__doc__ = obtener_conexion.__doc__
+    return obtener_conexion_instrumentada
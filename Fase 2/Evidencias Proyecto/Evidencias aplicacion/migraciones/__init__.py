@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Migraciones versionadas de la base de inventario.
+
+Las versiones aplicadas se registran en la tabla schema_version. Cada migración
+es un módulo mNNN_<descripcion>.py con una función aplicar(cur): cambios de
+esquema y datos pequeños. Corre en una sola transacción (BEGIN IMMEDIATE) junto
+con el registro de la versión: si falla, la base queda como estaba.
+
+Si se aplicó alguna, al final se recalculan las estadísticas del planificador
+(ANALYZE), ya fuera de esas transacciones.
+
+Con varios procesos arrancando a la vez, el primero que toma el bloqueo aplica
+la migración y los demás la encuentran registrada al volver a mirar.
+"""
+import time
+from datetime import datetime
+
+from migraciones import (m001_indices_consultas, m002_tablas_base, m003_reportes, m004_reportes_latido,
+                         m005_registro_cambios_compactado)
+
+MIGRACIONES = [
+    (1, m001_indices_consultas),
+    (2, m002_tablas_base),
+    (3, m003_reportes),
+    (4, m004_reportes_latido),
+    (5, m005_registro_cambios_compactado),
+]
+
+
+def _crear_tabla_versiones(conn):
+    # 'rellenando' ya no se usa; se conserva en el CHECK para no divergir de las bases existentes.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version     INTEGER PRIMARY KEY,
+            nombre      TEXT NOT NULL,
+            estado      TEXT NOT NULL CHECK(estado IN ('rellenando', 'aplicada')),
+            fecha       TEXT NOT NULL,
+            duracion_ms INTEGER
+        )""")
+    # Bases migradas antes de existir schema_version sólo tienen PRAGMA user_version.
+    if conn.execute("SELECT COUNT(*) FROM schema_version").fetchone()[0] == 0:
+        anterior = conn.execute('PRAGMA user_version').fetchone()[0]
+        conn.executemany("INSERT INTO schema_version (version, nombre, estado, fecha) VALUES (?, ?, 'aplicada', ?)",
+                         [(v, _nombre(m), datetime.now().isoformat(timespec='seconds'))
+                          for v, m in MIGRACIONES if v <= anterior])
+    conn.commit()
+
+
+def _nombre(modulo):
+    return modulo.__name__.rsplit('.', 1)[-1]
+
+
+def _estado(conn, version):
+    fila = conn.execute("SELECT estado FROM schema_version WHERE version = ?", (version,)).fetchone()
+    return fila[0] if fila else None
+
+
+def versiones(conn):
+    """[(version, nombre, estado, fecha, duracion_ms)] registradas, en orden."""
+    return [tuple(f) for f in conn.execute(
+        "SELECT version, nombre, estado, fecha, duracion_ms FROM schema_version ORDER BY version").fetchall()]
+
+
+def aplicar(conn, migraciones=None):
+    """Aplica las migraciones pendientes. Devuelve la lista de versiones aplicadas."""
+    migraciones = MIGRACIONES if migraciones is None else migraciones
+    if conn.in_transaction:
+        conn.commit()
+    _crear_tabla_versiones(conn)
+    aplicadas = []
+    for version, modulo in migraciones:
+        if _estado(conn, version) is not None:
+            continue
+        inicio = time.perf_counter()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Otro proceso pudo aplicarla mientras esperábamos el bloqueo.
+            if _estado(conn, version) is not None:
+                conn.rollback()
+                continue
+            modulo.aplicar(conn.cursor())
+            conn.execute("INSERT INTO schema_version (version, nombre, estado, fecha, duracion_ms) VALUES (?, ?, 'aplicada', ?, ?)",
+                         (version, _nombre(modulo), datetime.now().isoformat(timespec='seconds'),
+                          int((time.perf_counter() - inicio) * 1000)))
+            conn.execute(f'PRAGMA user_version = {int(version)}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        aplicadas.append(version)
+        print(f"INFO: Migración {version} aplicada ({_nombre(modulo)}).")
+    if aplicadas:
+        # Estadísticas para que el planificador vea los índices nuevos. Fuera de la
+        # transacción de cada migración: ANALYZE recorre todos los índices y no debe
+        # alargar el bloqueo de escritura.
+        conn.execute('ANALYZE')
+        conn.commit()
+    return aplicadas
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Índices para los predicados más usados por las rutas de inventario.
+
+    historico_asignaciones (producto_id, fecha_devolucion)
+        asignaciones abiertas de un producto (eliminar producto, inventario por ubicación)
+    mantenimientos (fecha_fin), (tecnico_id)
+        mantenimientos en curso y la lista de cada técnico
+    envios_tienda (tienda_id, producto_id), retiros_tienda (tienda_id, producto_id)
+        stock por tienda y saldo de un producto en una tienda
+    retiros_tienda (estado, tienda_id)
+        retiros pendientes y su confirmación en lote
+
+nfc_readings (timestamp) ya lo crea telemetria.crear_tablas en la base de telemetría.
+Las tablas de tiendas no están en todas las bases; sus índices se omiten si faltan.
+Las estadísticas (ANALYZE) las recalcula el runner después de confirmar la migración.
+"""
+INDICES = [
+    ('idx_historico_producto_devolucion', 'historico_asignaciones', '(producto_id, fecha_devolucion)'),
+    ('idx_mantenimientos_fecha_fin', 'mantenimientos', '(fecha_fin)'),
+    ('idx_mantenimientos_tecnico', 'mantenimientos', '(tecnico_id)'),
+    ('idx_envios_tienda_tienda_producto', 'envios_tienda', '(tienda_id, producto_id)'),
+    ('idx_retiros_tienda_tienda_producto', 'retiros_tienda', '(tienda_id, producto_id)'),
+    ('idx_retiros_tienda_estado_tienda', 'retiros_tienda', '(estado, tienda_id)'),
+]
+
+
+def aplicar(cur):
+    tablas = {r[0] for r in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+    for nombre, tabla, columnas in INDICES:
+        if tabla in tablas:
+            cur.execute(f'CREATE INDEX IF NOT EXISTS {nombre} ON {tabla} {columnas}')
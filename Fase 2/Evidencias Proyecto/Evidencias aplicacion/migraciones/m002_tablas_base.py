@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Tablas que la aplicación crea o da por existentes y que no están en el volcado
+'Base de datos i-tec': tiendas, envíos y retiros de tienda, tienda_id de
+usuarios, tipos de movimiento, tomas de inventario, documentos de envío y el
+registro de cambios. Todo con IF NOT EXISTS, porque las bases en producción ya
+tienen la mayoría de estas tablas.
+
+El DDL está copiado aquí y no se llama a los módulos de la aplicación: lo que
+crea esta versión no debe cambiar cuando esos módulos cambian. Los cambios de
+esquema posteriores van en una migración nueva. Los triggers del registro de
+cambios los reinstala init_inventory_db (siguen las columnas de cada tabla).
+
+Los índices de la migración 1 sobre tablas de tiendas se omitieron en las bases
+que aún no las tenían; se crean aquí.
+"""
+from migraciones import m001_indices_consultas
+
+TIPOS_MOVIMIENTO = [(1, 'Asignación'), (2, 'Devolución'), (3, 'Baja'), (4, 'Préstamo')]
+
+
+def aplicar(cur):
+    cur.execute("CREATE TABLE IF NOT EXISTS tipos_movimiento (tipo_movimiento_id INTEGER PRIMARY KEY, nombre TEXT NOT NULL UNIQUE)")
+    if cur.execute("SELECT COUNT(*) FROM tipos_movimiento").fetchone()[0] == 0:
+        cur.executemany("INSERT INTO tipos_movimiento (tipo_movimiento_id, nombre) VALUES (?, ?)", TIPOS_MOVIMIENTO)
+    crear_tablas_tiendas(cur)
+    _crear_tablas_tomas(cur)
+    _crear_tablas_documentos_envio(cur)
+    _crear_tabla_registro_cambios(cur)
+
+    m001_indices_consultas.aplicar(cur)
+
+
+def crear_tablas_tiendas(cur):
+    """Tiendas, envíos, retiros y la tienda de cada usuario, sin índices (los crea aplicar())."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tiendas (
+            tienda_id     INTEGER PRIMARY KEY AUTOINCREMENT,
+            nombre_tienda TEXT NOT NULL,
+            direccion     TEXT
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS envios_tienda (
+            envio_id         INTEGER PRIMARY KEY AUTOINCREMENT,
+            producto_id      INTEGER NOT NULL,
+            tienda_id        INTEGER NOT NULL,
+            cantidad_enviada INTEGER NOT NULL,
+            usuario_id       INTEGER,
+            fecha_envio      TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (producto_id) REFERENCES productos (producto_id),
+            FOREIGN KEY (tienda_id) REFERENCES tiendas (tienda_id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (usuario_id)
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS retiros_tienda (
+            retiro_id              INTEGER PRIMARY KEY AUTOINCREMENT,
+            producto_id            INTEGER NOT NULL,
+            tienda_id              INTEGER NOT NULL,
+            cantidad_retirada      INTEGER NOT NULL,
+            estado                 TEXT NOT NULL DEFAULT 'Pendiente',
+            usuario_solicitante_id INTEGER,
+            usuario_receptor_id    INTEGER,
+            fecha_solicitud        TEXT DEFAULT CURRENT_TIMESTAMP,
+            fecha_recepcion        TEXT,
+            FOREIGN KEY (producto_id) REFERENCES productos (producto_id),
+            FOREIGN KEY (tienda_id) REFERENCES tiendas (tienda_id),
+            FOREIGN KEY (usuario_solicitante_id) REFERENCES usuarios (usuario_id),
+            FOREIGN KEY (usuario_receptor_id) REFERENCES usuarios (usuario_id)
+        )""")
+
+    # crear_usuario y editar_usuario guardan la tienda del usuario.
+    if cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'usuarios'").fetchone():
+        columnas = [c[1] for c in cur.execute("PRAGMA table_info(usuarios)").fetchall()]
+        if 'tienda_id' not in columnas:
+            cur.execute("ALTER TABLE usuarios ADD COLUMN tienda_id INTEGER REFERENCES tiendas (tienda_id)")
+
+
+def _crear_tablas_tomas(cur):
+    """Sesiones de toma de inventario (ver toma_inventario.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tomas_inventario (
+            toma_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo_ubicacion TEXT NOT NULL CHECK(tipo_ubicacion IN ('Bodega', 'Tienda')),
+            ubicacion      TEXT NOT NULL,
+            estado         TEXT NOT NULL DEFAULT 'Abierta',
+            usuario_id     INTEGER,
+            fecha_inicio   TEXT DEFAULT CURRENT_TIMESTAMP,
+            fecha_cierre   TEXT,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (usuario_id)
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tomas_inventario_esperado (
+            toma_id     INTEGER NOT NULL,
+            producto_id INTEGER NOT NULL,
+            cantidad    INTEGER NOT NULL,
+            PRIMARY KEY (toma_id, producto_id),
+            FOREIGN KEY (toma_id) REFERENCES tomas_inventario (toma_id) ON DELETE CASCADE
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tomas_inventario_escaneos (
+            escaneo_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+            toma_id     INTEGER NOT NULL,
+            reading_id  INTEGER,
+            codigo      TEXT NOT NULL,
+            producto_id INTEGER,
+            fecha       TEXT DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (toma_id) REFERENCES tomas_inventario (toma_id) ON DELETE CASCADE
+        )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_tomas_escaneos_toma ON tomas_inventario_escaneos (toma_id, escaneo_id)")
+
+
+def _crear_tablas_documentos_envio(cur):
+    """Documentos de envío a tienda y sus líneas (ver documentos_envio.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS documentos_envio (
+            documento_id  INTEGER PRIMARY KEY AUTOINCREMENT,
+            tienda_id     INTEGER NOT NULL,
+            estado        TEXT NOT NULL DEFAULT 'Borrador' CHECK(estado IN ('Borrador', 'Enviado', 'Anulado')),
+            usuario_id    INTEGER,
+            fecha_creacion TEXT DEFAULT CURRENT_TIMESTAMP,
+            fecha_envio   TEXT,
+            FOREIGN KEY (tienda_id) REFERENCES tiendas (tienda_id),
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (usuario_id)
+        )""")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS documentos_envio_lineas (
+            documento_id INTEGER NOT NULL,
+            producto_id  INTEGER NOT NULL,
+            cantidad     INTEGER NOT NULL CHECK(cantidad > 0),
+            PRIMARY KEY (documento_id, producto_id),
+            FOREIGN KEY (documento_id) REFERENCES documentos_envio (documento_id) ON DELETE CASCADE,
+            FOREIGN KEY (producto_id) REFERENCES productos (producto_id)
+        )""")
+
+
+def _crear_tabla_registro_cambios(cur):
+    """Registro de cambios para /api/sync y /api/cdc (ver registro_cambios.py)."""
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS registro_cambios (
+            seq       INTEGER PRIMARY KEY AUTOINCREMENT,
+            tabla     TEXT NOT NULL,
+            pk        INTEGER NOT NULL,
+            operacion TEXT NOT NULL CHECK(operacion IN ('I', 'U', 'D')),
+            fecha     TEXT DEFAULT CURRENT_TIMESTAMP,
+            datos     TEXT
+        )""")
+    # Bases con el registro anterior a la imagen JSON de cada fila.
+    columnas = [c[1] for c in cur.execute("PRAGMA table_info(registro_cambios)").fetchall()]
+    if 'datos' not in columnas:
+        cur.execute("ALTER TABLE registro_cambios ADD COLUMN datos TEXT")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_registro_cambios_tabla_pk ON registro_cambios (tabla, pk, seq)")
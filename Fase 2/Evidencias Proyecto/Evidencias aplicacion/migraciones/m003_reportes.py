@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+Tabla 'reportes': cola, estado y caché de los reportes en segundo plano (ver reportes.py).
+"""
+
+
+def aplicar(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS reportes (
+            reporte_id      INTEGER PRIMARY KEY AUTOINCREMENT,
+            tipo            TEXT NOT NULL,
+            parametros      TEXT NOT NULL DEFAULT '{}',
+            clave           TEXT NOT NULL,
+            estado          TEXT NOT NULL DEFAULT 'Pendiente' CHECK(estado IN ('Pendiente', 'En proceso', 'Listo', 'Error')),
+            progreso        INTEGER NOT NULL DEFAULT 0,
+            etapa           TEXT,
+            filas           INTEGER,
+            error           TEXT,
+            usuario_id      INTEGER,
+            fecha_solicitud TEXT NOT NULL,
+            fecha_inicio    TEXT,
+            fecha_fin       TEXT,
+            FOREIGN KEY (usuario_id) REFERENCES usuarios (usuario_id)
+        )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reportes_clave_estado ON reportes (clave, estado)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_reportes_estado ON reportes (estado)")
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Dueño y latido de los reportes en curso (ver reportes.tomar_siguiente).
+
+    proceso  host:pid del proceso que lo está calculando
+    intento  sube cada vez que un trabajador lo toma; sólo el intento vigente
+             puede avanzar, terminar o marcar error el reporte
+    latido   última vez que ese proceso confirmó que sigue vivo
+
+Los reportes que quedaron 'En proceso' antes de esta versión no tienen latido
+y se consideran abandonados.
+"""
+
+
+def aplicar(cur):
+    columnas = [c[1] for c in cur.execute("PRAGMA table_info(reportes)").fetchall()]
+    if 'proceso' not in columnas:
+        cur.execute("ALTER TABLE reportes ADD COLUMN proceso TEXT")
+    if 'intento' not in columnas:
+        cur.execute("ALTER TABLE reportes ADD COLUMN intento INTEGER NOT NULL DEFAULT 0")
+    if 'latido' not in columnas:
+        cur.execute("ALTER TABLE reportes ADD COLUMN latido TEXT")
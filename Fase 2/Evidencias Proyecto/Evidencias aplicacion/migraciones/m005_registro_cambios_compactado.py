@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+"""
+Marca de compactación del registro de cambios (ver registro_cambios.compactar).
+
+    hasta  mayor secuencia eliminada por la compactación. Un consumidor CDC que
+           pida cambios posteriores a una secuencia menor pudo perder eventos
+           intermedios y debe reconstruir su estado.
+"""
+
+
+def aplicar(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS registro_cambios_compactado (
+            id    INTEGER PRIMARY KEY CHECK(id = 1),
+            hasta INTEGER NOT NULL
+        )""")
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Perfilado a pedido de peticiones HTTP y eventos de Socket.IO.
+
+Un administrador agrega '?_perfilar=1' a la URL o la cabecera 'X-Perfilar: 1'
+(en Socket.IO, en la conexión: io(url, {query: {_perfilar: 1}}) perfila todos
+los eventos de esa conexión). La petición corre bajo cProfile y se guarda en
+ITEC_PERFILES_DIR un .prof (para pstats/snakeviz) y un .json con el tiempo
+total, el tiempo en SQL, el tiempo renderizando plantillas y las funciones más
+costosas; /admin/perfiles los lista para descargar.
+
+Sin la marca no se hace nada más que mirar la cabecera y la query string: el
+perfilador, el contador de SQL y las señales de plantillas sólo se conectan
+mientras hay un perfil en curso. Se perfila una petición a la vez por proceso.
+Con eventlet/gevent todos los greenlets comparten el hilo, así que el perfil
+incluye lo que otras peticiones del proceso ejecuten en ese lapso: conviene
+usarlo en un momento tranquilo o contra un proceso sin tráfico.
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import time
+import uuid
+from datetime import datetime
+
+from flask import g, request, template_rendered, before_render_template
+
+import metricas
+
+PERFILES_DIR = os.environ.get('ITEC_PERFILES_DIR', 'perfiles')
+MAX_PERFILES = int(os.environ.get('ITEC_PERFILES_MAX', 50))
+FUNCIONES_RESUMEN = 40
+PARAMETRO = '_perfilar'
+CABECERA = 'X-Perfilar'
+
+_lock = metricas.lock_nativo()
+_en_curso = None
+
+
+class _Perfil:
+    def __init__(self, tipo, nombre):
+        self.tipo = tipo
+        self.nombre = nombre
+        self.perfilador = cProfile.Profile()
+        self.sql_segundos = 0.0
+        self.sql_sentencias = 0
+        self.plantillas_segundos = 0.0
+        self.plantillas = []
+        self._inicio_plantilla = None
+        self.inicio = time.perf_counter()
+
+    def sumar_sql(self, segundos):
+        # Puede llegar desde los hilos de ejecutor_bd.
+        with _lock:
+            self.sql_segundos += segundos
+            self.sql_sentencias += 1
+
+    def antes_de_plantilla(self, app, template, context, **extra):
+        self._inicio_plantilla = time.perf_counter()
+
+    def plantilla_renderizada(self, app, template, context, **extra):
+        if self._inicio_plantilla is not None:
+            self.plantillas_segundos += time.perf_counter() - self._inicio_plantilla
+            self._inicio_plantilla = None
+        self.plantillas.append(template.name)
+
+
+def solicitado():
+    """True si la petición (o el handshake de Socket.IO) pide perfilado."""
+    return request.args.get(PARAMETRO) == '1' or request.headers.get(CABECERA) == '1'
+
+
+def iniciar(tipo, nombre):
+    """Empieza un perfil; None si ya hay otro en curso en este proceso."""
+    global _en_curso
+    with _lock:
+        if _en_curso is not None:
+            return None
+        perfil = _en_curso = _Perfil(tipo, nombre)
+    try:
+        perfil.perfilador.enable()
+    except ValueError:  # Otro perfilador activo (p. ej. un depurador).
+        with _lock:
+            _en_curso = None
+        return None
+    metricas.observador_perfil = perfil.sumar_sql
+    before_render_template.connect(perfil.antes_de_plantilla)
+    template_rendered.connect(perfil.plantilla_renderizada)
+    return perfil
+
+
+def terminar(perfil, usuario=None, estado=None):
+    """Detiene el perfil y lo guarda. Devuelve el identificador del perfil guardado."""
+    global _en_curso
+    perfil.perfilador.disable()
+    duracion = time.perf_counter() - perfil.inicio
+    metricas.observador_perfil = None
+    before_render_template.disconnect(perfil.antes_de_plantilla)
+    template_rendered.disconnect(perfil.plantilla_renderizada)
+    with _lock:
+        _en_curso = None
+
+    os.makedirs(PERFILES_DIR, exist_ok=True)
+    identificador = f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+    perfil.perfilador.dump_stats(os.path.join(PERFILES_DIR, identificador + '.prof'))
+    salida = io.StringIO()
+    pstats.Stats(perfil.perfilador, stream=salida).sort_stats('cumulative').print_stats(FUNCIONES_RESUMEN)
+    datos = {
+        'id': identificador,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'pid': os.getpid(),
+        'tipo': perfil.tipo,
+        'nombre': perfil.nombre,
+        'usuario': usuario,
+        'estado': estado,
+        'duracion_ms': round(duracion * 1000, 1),
+        'sql_ms': round(perfil.sql_segundos * 1000, 1),
+        'sql_sentencias': perfil.sql_sentencias,
+        'plantillas_ms': round(perfil.plantillas_segundos * 1000, 1),
+        'plantillas': perfil.plantillas,
+        'resumen': salida.getvalue(),
+    }
+    with open(os.path.join(PERFILES_DIR, identificador + '.json'), 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, indent=2)
+    _podar()
+    return identificador
+
+
+def _podar():
+    guardados = sorted(n[:-5] for n in os.listdir(PERFILES_DIR) if n.endswith('.json'))
+    for identificador in guardados[:-MAX_PERFILES] if MAX_PERFILES > 0 else []:
+        for extension in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(PERFILES_DIR, identificador + extension))
+            except FileNotFoundError:
+                pass
+
+
+def listar():
+    """Perfiles guardados, del más reciente al más antiguo (sin el resumen de funciones)."""
+    if not os.path.isdir(PERFILES_DIR):
+        return []
+    perfiles = []
+    for nombre in sorted(os.listdir(PERFILES_DIR), reverse=True):
+        if not nombre.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PERFILES_DIR, nombre), encoding='utf-8') as f:
+                datos = json.load(f)
+        except (OSError, ValueError):
+            continue
+        datos.pop('resumen', None)
+        perfiles.append(datos)
+    return perfiles
+
+
+def obtener(identificador):
+    """Datos completos de un perfil; None si no existe o el identificador no es válido."""
+    if not identificador or os.path.basename(identificador) != identificador or identificador.startswith('.'):
+        return None
+    try:
+        with open(os.path.join(PERFILES_DIR, identificador + '.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def ruta_prof(identificador):
+    return os.path.join(PERFILES_DIR, identificador + '.prof')
+
+
+def instalar(app, es_admin, obtener_usuario):
+    """Registra los hooks de Flask que perfilan las peticiones marcadas."""
+
+    @app.before_request
+    def _iniciar_perfil():
+        if solicitado() and es_admin():
+            perfil = iniciar('http', f'{request.method} {request.path}')
+            if perfil is not None:
+                g.perfil = perfil
+
+    @app.after_request
+    def _guardar_perfil(response):
+        perfil = g.pop('perfil', None)
+        if perfil is not None:
+            response.headers['X-Perfil'] = terminar(perfil, obtener_usuario(), response.status_code)
+        return response
+
+    @app.teardown_request
+    def _cerrar_perfil(error=None):
+        # Si la vista lanzó una excepción after_request no corre.
+        perfil = g.pop('perfil', None)
+        if perfil is not None:
+            terminar(perfil, obtener_usuario(), 500)
+
+
+def evento_socketio(es_admin, obtener_usuario):
+    """
+    Decorador para manejadores de Socket.IO: perfila el evento si la conexión se
+    abrió con la marca de perfilado y el usuario es administrador.
+    """
+    def decorador(funcion):
+        @functools.wraps(funcion)
+        def envoltura(*args, **kwargs):
+            if not (solicitado() and es_admin()):
+                return funcion(*args, **kwargs)
+            perfil = iniciar('socketio', funcion.__name__)
+            if perfil is None:
+                return funcion(*args, **kwargs)
+            estado = 'ok'
+            try:
+                return funcion(*args, **kwargs)
+            except Exception:
+                estado = 'error'
+                raise
+            finally:
+                terminar(perfil, obtener_usuario(), estado)
+        return envoltura
+    return decorador
@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Registro de cambios (change tracking) para sincronización incremental y CDC.
+
+Triggers AFTER INSERT/UPDATE/DELETE escriben en 'registro_cambios' una fila por
+modificación con un número de secuencia monótono (AUTOINCREMENT nunca reutiliza
+valores) y la imagen de la fila en JSON. Un cliente guarda la última secuencia
+recibida y pide sólo lo posterior: la app móvil lo usa para sincronizar el
+catálogo y los consumidores externos como flujo ordenado de cambios (CDC).
+"""
+import json
+
+# Tabla -> (clave primaria, columnas que se envían a los dispositivos)
+TABLAS_SYNC = {
+    'productos': ('producto_id', ['producto_id', 'nombre', 'numero_serie', 'tipo_producto_id',
+                                  'estado_equipo_id', 'ubicacion_fisica', 'stock_actual', 'activo']),
+    'tiendas': ('tienda_id', ['tienda_id', 'nombre_tienda', 'direccion']),
+    'estados_equipo': ('estado_equipo_id', ['estado_equipo_id', 'nombre']),
+}
+
+# Tabla -> clave primaria de las tablas publicadas en el flujo de cambios (CDC)
+TABLAS_CDC = {
+    'productos': 'producto_id',
+    'historico_asignaciones': 'historico_id',
+    'envios_tienda': 'envio_id',
+    'retiros_tienda': 'retiro_id',
+    'mantenimientos': 'mantenimiento_id',
+}
+
+LIMITE_PAGINA_SYNC = 1000
+LIMITE_PAGINA_CDC = 500
+
+
+def actualizar_triggers(conn):
+    """
+    Pone al día los triggers de las tablas sincronizadas y del flujo de cambios.
+
+    Todo corre en una transacción BEGIN IMMEDIATE: otra instancia que esté
+    escribiendo no cae entre el DROP y el CREATE de un trigger (y su cambio no
+    se pierde del registro), y dos instancias que arrancan a la vez no chocan
+    creando el mismo trigger.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        cur = conn.cursor()
+        instalar_triggers(cur, {tabla: pk for tabla, (pk, _) in TABLAS_SYNC.items()}, sembrar=True)
+        instalar_triggers(cur, {t: pk for t, pk in TABLAS_CDC.items() if t not in TABLAS_SYNC}, sembrar=False)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def instalar_triggers(cur, tablas, sembrar=False):
+    """
+    Instala los triggers de registro para {tabla: columna_pk}. Se revisan en cada
+    arranque y sólo se recrean los que cambiaron, para que la imagen JSON siga
+    las columnas actuales de la tabla.
+
+    Con sembrar=True, la primera vez que se instalan en una tabla se registran
+    sus filas existentes como inserciones, para que una sincronización desde cero
+    reciba el catálogo completo.
+    """
+    for tabla, pk in tablas.items():
+        columnas = [c[1] for c in cur.execute(f"PRAGMA table_info({tabla})").fetchall()]
+        if not columnas:
+            continue
+        ya_instalado = cur.execute("SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+                                   (f'trg_cambios_{tabla}_i',)).fetchone()
+        for operacion, evento, fila in (('I', 'INSERT', 'NEW'), ('U', 'UPDATE', 'NEW'), ('D', 'DELETE', 'OLD')):
+            nombre = f'trg_cambios_{tabla}_{operacion.lower()}'
+            imagen = ', '.join(f"'{c}', {fila}.\"{c}\"" for c in columnas)
+            sql = f"""CREATE TRIGGER {nombre}
+                AFTER {evento} ON {tabla}
+                BEGIN
+                    INSERT INTO registro_cambios (tabla, pk, operacion, datos)
+                    VALUES ('{tabla}', {fila}.{pk}, '{operacion}', json_object({imagen}));
+                END"""
+            # sqlite_master guarda el texto tal como se creó: si coincide, el trigger está al día.
+            actual = cur.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name = ?", (nombre,)).fetchone()
+            if actual and actual[0] == sql:
+                continue
+            cur.execute(f"DROP TRIGGER IF EXISTS {nombre}")
+            cur.execute(sql)
+        if sembrar and not ya_instalado:
+            cur.execute(f"INSERT INTO registro_cambios (tabla, pk, operacion) SELECT '{tabla}', {pk}, 'I' FROM {tabla} ORDER BY {pk}")
+
+
+def ultima_secuencia(conn):
+    return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM registro_cambios").fetchone()[0]
+
+
+def leer_cambios(conn, desde, limite=LIMITE_PAGINA_SYNC, tablas=TABLAS_SYNC):
+    """
+    Devuelve una página de cambios posteriores a 'desde', con una sola entrada
+    por fila (su último cambio) y el estado actual de la fila.
+
+    Formato compacto por tabla: {'columnas': [...], 'filas': [[...], ...], 'eliminados': [pk, ...]}.
+    'hasta' es la secuencia que el cliente debe enviar en la próxima petición.
+    """
+    # Se fija el tope antes de leer: lo escrito después llega en la próxima petición.
+    tope = ultima_secuencia(conn)
+    nombres = list(tablas)
+    marcadores = ','.join('?' * len(nombres))
+    ultimos = conn.execute(f"""
+        SELECT tabla, pk, MAX(seq) AS seq
+        FROM registro_cambios
+        WHERE seq > ? AND seq <= ? AND tabla IN ({marcadores})
+        GROUP BY tabla, pk
+        ORDER BY seq
+        LIMIT ?
+    """, (desde, tope, *nombres, limite + 1)).fetchall()
+
+    hay_mas = len(ultimos) > limite
+    ultimos = ultimos[:limite]
+    hasta = ultimos[-1][2] if hay_mas else max(desde, tope)
+
+    pks_por_tabla = {}
+    for tabla, pk, _ in ultimos:
+        pks_por_tabla.setdefault(tabla, []).append(pk)
+
+    cambios = {}
+    for tabla, pks in pks_por_tabla.items():
+        columna_pk, columnas = tablas[tabla]
+        filas = []
+        for i in range(0, len(pks), 500):
+            bloque = pks[i:i + 500]
+            filas.extend(conn.execute(
+                f"SELECT {', '.join(columnas)} FROM {tabla} WHERE {columna_pk} IN ({','.join('?' * len(bloque))})",
+                bloque).fetchall())
+        presentes = {f[columnas.index(columna_pk)] for f in filas}
+        cambios[tabla] = {
+            'columnas': columnas,
+            'filas': [list(f) for f in filas],
+            'eliminados': [pk for pk in pks if pk not in presentes],
+        }
+
+    return {'desde': desde, 'hasta': hasta, 'mas': hay_mas, 'cambios': cambios}
+
+
+def leer_eventos(conn, desde, limite=LIMITE_PAGINA_CDC, tablas=None):
+    """Eventos del flujo CDC posteriores a 'desde', en orden de secuencia."""
+    tablas = [t for t in (tablas or TABLAS_CDC) if t in TABLAS_CDC]
+    if not tablas:
+        return []
+    filas = conn.execute(f"""
+        SELECT seq, tabla, pk, operacion, fecha, datos
+        FROM registro_cambios
+        WHERE seq > ? AND tabla IN ({','.join('?' * len(tablas))})
+        ORDER BY seq
+        LIMIT ?
+    """, (desde, *tablas, limite)).fetchall()
+    return [
+        {'seq': f[0], 'tabla': f[1], 'pk': f[2], 'operacion': f[3], 'fecha': f[4],
+         'datos': json.loads(f[5]) if f[5] else None}
+        for f in filas
+    ]
+
+
+def compactado_hasta(conn):
+    """
+    Mayor secuencia eliminada por compactar(). Quien lea el flujo CDC desde una
+    secuencia menor pudo perder cambios intermedios. /api/sync no se ve afectado:
+    la compactación conserva siempre el último cambio de cada fila.
+    """
+    fila = conn.execute("SELECT hasta FROM registro_cambios_compactado WHERE id = 1").fetchone()
+    return fila[0] if fila else 0
+
+
+SQL_SUPERADAS = """
+    FROM registro_cambios
+    WHERE fecha < datetime('now', ?)
+      AND seq < (SELECT MAX(r.seq) FROM registro_cambios r
+                 WHERE r.tabla = registro_cambios.tabla AND r.pk = registro_cambios.pk)
+"""
+
+
+def compactar(conn, dias_retencion=7):
+    """
+    Elimina entradas superadas por un cambio posterior de la misma fila que
+    tengan más de 'dias_retencion' días. Dentro de esa ventana el flujo CDC
+    conserva todos los cambios intermedios y un consumidor puede reanudar;
+    la mayor secuencia eliminada queda en registro_cambios_compactado.
+    """
+    ventana = (f'-{int(dias_retencion)} days',)
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        hasta = conn.execute(f"SELECT MAX(seq) {SQL_SUPERADAS}", ventana).fetchone()[0]
+        eliminadas = 0
+        if hasta is not None:
+            eliminadas = conn.execute(f"DELETE {SQL_SUPERADAS} AND seq <= ?", ventana + (hasta,)).rowcount
+            conn.execute("""
+                INSERT INTO registro_cambios_compactado (id, hasta) VALUES (1, ?)
+                ON CONFLICT(id) DO UPDATE SET hasta = MAX(hasta, excluded.hasta)
+            """, (hasta,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return eliminadas
@@ -0,0 +1,405 @@
+# -*- coding: utf-8 -*-
+"""
+Reportes como trabajos en segundo plano.
+
+El usuario pide un reporte (tipo + parámetros) y se registra en la tabla
+'reportes' como 'Pendiente'; la petición responde de inmediato. Los trabajadores
+(tareas de fondo de app.py) toman los pendientes, ejecutan cada etapa del
+reporte en el grupo de hilos de ejecutor_bd y escriben el resultado en
+ITEC_REPORTES_DIR/<reporte_id>.csv, que queda para descargarlo y volver a verlo.
+El avance se publica por Socket.IO en la sala 'reporte:<reporte_id>'.
+
+La tabla es la cola: con varios procesos cualquiera puede pedir reportes y los
+que corren las tareas de fondo los calculan. Un pedido igual a otro pendiente, en
+curso o terminado hace menos de ITEC_REPORTES_CACHE_MIN minutos devuelve ese
+mismo reporte en vez de calcularlo otra vez.
+
+Cada reporte en curso tiene dueño (proceso e intento) y un latido que ese
+proceso renueva cada INTERVALO_LATIDO segundos. Si el latido tiene más de
+ITEC_REPORTES_VENCIMIENTO segundos, el proceso se da por caído y cualquier
+trabajador vuelve a tomar el reporte; el intento anterior ya no puede escribirlo.
+"""
+import csv
+import glob
+import json
+import os
+import socket
+from datetime import datetime, timedelta
+
+REPORTES_DIR = os.environ.get('ITEC_REPORTES_DIR', 'reportes')
+TRABAJADORES = int(os.environ.get('ITEC_REPORTES_TRABAJADORES', 2))
+VIGENCIA_CACHE_MIN = int(os.environ.get('ITEC_REPORTES_CACHE_MIN', 15))
+RETENCION_DIAS = int(os.environ.get('ITEC_REPORTES_RETENCION_DIAS', 30))
+INTERVALO = float(os.environ.get('ITEC_REPORTES_INTERVALO', 1))
+VENCIMIENTO_LATIDO = int(os.environ.get('ITEC_REPORTES_VENCIMIENTO', 120))
+INTERVALO_LATIDO = max(1, VENCIMIENTO_LATIDO // 4)
+LOTE_FILAS = 1000
+FILAS_POR_PAGINA = 200
+ESTADOS = ('Pendiente', 'En proceso', 'Listo', 'Error')
+
+
+class ReporteReasignado(Exception):
+    """El reporte pasó a otro intento (este proceso se dio por caído) o ya no está en curso."""
+
+
+def _proceso():
+    # Se calcula en cada llamada: con fork el pid del hijo no es el del padre.
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def _ahora():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+# ----------------------------------------------------------------------------
+# Tipos de reporte: cada uno es una lista de etapas (descripción, SQL, parámetros)
+# cuyos resultados, con las mismas columnas, se escriben uno tras otro.
+# ----------------------------------------------------------------------------
+def _etapas_inventario_ubicacion(parametros):
+    return [
+        ('Productos asignados', """
+            SELECT p.nombre AS nombre_producto, p.numero_serie, 'Asignado' AS ubicacion,
+                   per.primer_nombre || ' ' || per.apellido_pat AS detalle
+            FROM productos p
+            JOIN historico_asignaciones ha ON p.producto_id = ha.producto_id
+            JOIN usuarios u ON ha.usuario_id = u.usuario_id
+            JOIN personas per ON u.persona_rut = per.rut
+            WHERE ha.fecha_devolucion IS NULL""", ()),
+        ('Productos en mantenimiento', """
+            SELECT p.nombre AS nombre_producto, p.numero_serie, 'En Mantenimiento' AS ubicacion,
+                   'Asignado a técnico ID ' || m.tecnico_id AS detalle
+            FROM productos p
+            JOIN mantenimientos m ON p.producto_id = m.producto_id
+            WHERE m.fecha_fin IS NULL""", ()),
+        ('Productos en bodega', """
+            SELECT p.nombre AS nombre_producto, p.numero_serie, 'Bodega' AS ubicacion, p.ubicacion_fisica AS detalle
+            FROM productos p
+            WHERE p.producto_id NOT IN (SELECT producto_id FROM historico_asignaciones WHERE fecha_devolucion IS NULL)
+              AND p.producto_id NOT IN (SELECT producto_id FROM mantenimientos WHERE fecha_fin IS NULL)
+              AND p.stock_actual > 0""", ()),
+        ('Stock en tiendas', """
+            SELECT p.nombre AS nombre_producto, 'N/A (Stock por cantidad)' AS numero_serie, 'En Tienda' AS ubicacion,
+                   t.nombre_tienda || ' (Cantidad: ' || SUM(et.cantidad_enviada) || ')' AS detalle
+            FROM envios_tienda et
+            JOIN productos p ON et.producto_id = p.producto_id
+            JOIN tiendas t ON et.tienda_id = t.tienda_id
+            GROUP BY p.producto_id, t.tienda_id""", ()),
+    ]
+
+
+def consulta_stock_tiendas(tienda_id=None):
+    """
+    (sql, parámetros) del stock por tienda y producto: envíos menos retiros
+    completados, en una sola consulta para todas las tiendas (o sólo 'tienda_id').
+    La usan este reporte y la página /stock_tiendas.
+    """
+    filtro, valores = ('AND tienda_id = ?', (tienda_id,) * 2) if tienda_id else ('', ())
+    return f"""
+        WITH movimientos AS (
+            SELECT tienda_id, producto_id, cantidad_enviada AS cantidad FROM envios_tienda WHERE 1 = 1 {filtro}
+            UNION ALL
+            SELECT tienda_id, producto_id, -cantidad_retirada FROM retiros_tienda WHERE estado = 'Completado' {filtro}
+        )
+        SELECT t.tienda_id, t.nombre_tienda, p.producto_id, p.nombre AS nombre_producto, SUM(m.cantidad) AS stock_en_tienda
+        FROM movimientos m
+        JOIN tiendas t ON m.tienda_id = t.tienda_id
+        JOIN productos p ON m.producto_id = p.producto_id
+        GROUP BY m.tienda_id, m.producto_id
+        HAVING stock_en_tienda > 0
+        ORDER BY t.nombre_tienda, t.tienda_id, p.nombre""", valores
+
+
+def _etapas_stock_tiendas(parametros):
+    sql, valores = consulta_stock_tiendas(parametros.get('tienda_id'))
+    return [('Stock por tienda', sql, valores)]
+
+
+def _etapas_asignaciones_area(parametros):
+    condiciones, valores = [], []
+    if parametros.get('desde'):
+        condiciones.append('h.fecha_asignacion >= ?')
+        valores.append(parametros['desde'])
+    if parametros.get('hasta'):
+        # 'hasta' es inclusivo: todo el día indicado.
+        condiciones.append("h.fecha_asignacion < date(?, '+1 day')")
+        valores.append(parametros['hasta'])
+    filtro = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    return [('Asignaciones por área', f"""
+        SELECT COALESCE(a.nombre_area, 'Sin área') AS area,
+               COUNT(*) AS asignaciones,
+               SUM(CASE WHEN h.fecha_devolucion IS NULL THEN 1 ELSE 0 END) AS vigentes,
+               COUNT(DISTINCT h.producto_id) AS equipos,
+               COUNT(DISTINCT h.usuario_id) AS usuarios,
+               ROUND(SUM(CASE WHEN h.fecha_devolucion IS NULL THEN p.valor_unitario ELSE 0 END)) AS valor_vigente
+        FROM historico_asignaciones h
+        JOIN usuarios u ON h.usuario_id = u.usuario_id
+        LEFT JOIN areas a ON u.area_id = a.area_id
+        JOIN productos p ON h.producto_id = p.producto_id
+        {filtro}
+        GROUP BY a.area_id
+        ORDER BY asignaciones DESC""", tuple(valores))]
+
+
+def _etapas_mantenimientos_pendientes(parametros):
+    return [('Mantenimientos abiertos', """
+        SELECT m.mantenimiento_id, p.nombre AS nombre_producto, p.numero_serie,
+               COALESCE(pe.primer_nombre || ' ' || pe.apellido_pat, 'Sin asignar') AS tecnico,
+               m.fecha_inicio,
+               CAST(julianday('now', 'localtime') - julianday(m.fecha_inicio) AS INTEGER) AS dias_abierto,
+               m.descripcion
+        FROM mantenimientos m
+        JOIN productos p ON m.producto_id = p.producto_id
+        LEFT JOIN usuarios u ON m.tecnico_id = u.usuario_id
+        LEFT JOIN personas pe ON u.persona_rut = pe.rut
+        WHERE m.fecha_fin IS NULL
+        ORDER BY m.fecha_inicio""", ())]
+
+
+# tipo -> (título, parámetros que acepta, función que arma las etapas)
+TIPOS = {
+    'inventario_ubicacion': ('Inventario por ubicación', (), _etapas_inventario_ubicacion),
+    'stock_tiendas': ('Stock por tienda', ('tienda_id',), _etapas_stock_tiendas),
+    'asignaciones_area': ('Asignaciones por área', ('desde', 'hasta'), _etapas_asignaciones_area),
+    'mantenimientos_pendientes': ('Mantenimientos pendientes', (), _etapas_mantenimientos_pendientes),
+}
+
+
+def normalizar_parametros(tipo, datos):
+    """Parámetros válidos del tipo, sin vacíos. ValueError si el tipo o algún valor no es válido."""
+    if tipo not in TIPOS:
+        raise ValueError('Tipo de reporte desconocido.')
+    parametros = {}
+    for nombre in TIPOS[tipo][1]:
+        valor = (datos or {}).get(nombre)
+        if valor in (None, ''):
+            continue
+        if nombre == 'tienda_id':
+            try:
+                parametros[nombre] = int(valor)
+            except (TypeError, ValueError):
+                raise ValueError('La tienda debe ser un número.')
+        else:
+            try:
+                parametros[nombre] = datetime.strptime(str(valor), '%Y-%m-%d').strftime('%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'La fecha "{nombre}" debe tener el formato AAAA-MM-DD.')
+    if parametros.get('desde') and parametros.get('hasta') and parametros['desde'] > parametros['hasta']:
+        raise ValueError('La fecha "desde" no puede ser posterior a "hasta".')
+    return parametros
+
+
+def etapas(reporte):
+    """Etapas (descripción, SQL, parámetros) de un reporte registrado."""
+    return TIPOS[reporte['tipo']][2](json.loads(reporte['parametros']))
+
+
+# ----------------------------------------------------------------------------
+# Cola y caché (las conexiones deben tener row_factory = sqlite3.Row)
+# ----------------------------------------------------------------------------
+def solicitar(conn, tipo, datos, usuario_id):
+    """
+    Registra un pedido de reporte y devuelve (reporte_id, reutilizado). Si hay
+    uno igual pendiente, en curso o listo dentro de la vigencia del caché se
+    devuelve ese.
+    """
+    parametros = normalizar_parametros(tipo, datos)
+    clave = tipo + json.dumps(parametros, sort_keys=True)
+    vigente_desde = (datetime.now() - timedelta(minutes=VIGENCIA_CACHE_MIN)).strftime('%Y-%m-%d %H:%M:%S')
+    fila = conn.execute("""
+        SELECT reporte_id, estado FROM reportes
+        WHERE clave = ? AND (estado IN ('Pendiente', 'En proceso') OR (estado = 'Listo' AND fecha_fin >= ?))
+        ORDER BY reporte_id DESC LIMIT 1
+    """, (clave, vigente_desde)).fetchone()
+    if fila and (fila[1] != 'Listo' or os.path.exists(ruta_resultado(fila[0]))):
+        return fila[0], True
+    cur = conn.execute("""
+        INSERT INTO reportes (tipo, parametros, clave, usuario_id, fecha_solicitud) VALUES (?, ?, ?, ?, ?)
+    """, (tipo, json.dumps(parametros, sort_keys=True), clave, usuario_id, _ahora()))
+    conn.commit()
+    return cur.lastrowid, False
+
+
+SQL_DISPONIBLE = """
+    estado = 'Pendiente' OR (estado = 'En proceso' AND (latido IS NULL OR latido < ?))
+"""
+
+
+def tomar_siguiente(conn):
+    """
+    Toma el reporte disponible más antiguo (pendiente, o en curso con el latido
+    vencido), lo marca 'En proceso' a nombre de este proceso con un intento nuevo
+    y lo devuelve como dict; None si no hay.
+    """
+    vencido = (datetime.now() - timedelta(seconds=VENCIMIENTO_LATIDO)).strftime('%Y-%m-%d %H:%M:%S')
+    if not conn.execute(f"SELECT 1 FROM reportes WHERE {SQL_DISPONIBLE} LIMIT 1", (vencido,)).fetchone():
+        return None
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        fila = conn.execute(f"SELECT reporte_id, estado FROM reportes WHERE {SQL_DISPONIBLE} ORDER BY reporte_id LIMIT 1",
+                            (vencido,)).fetchone()
+        if fila:
+            if fila['estado'] == 'En proceso':
+                print(f"INFO: El reporte #{fila['reporte_id']} quedó sin latido; se vuelve a calcular.")
+            ahora = _ahora()
+            conn.execute("""
+                UPDATE reportes SET estado = 'En proceso', progreso = 0, etapa = NULL, fecha_inicio = ?,
+                                    proceso = ?, intento = intento + 1, latido = ?
+                WHERE reporte_id = ?
+            """, (ahora, _proceso(), ahora, fila['reporte_id']))
+            fila = conn.execute("SELECT * FROM reportes WHERE reporte_id = ?", (fila['reporte_id'],)).fetchone()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return dict(fila) if fila else None
+
+
+def renovar_latidos(conn):
+    """Renueva el latido de los reportes que este proceso está calculando. Devuelve cuántos."""
+    n = conn.execute("UPDATE reportes SET latido = ? WHERE estado = 'En proceso' AND proceso = ?",
+                     (_ahora(), _proceso())).rowcount
+    conn.commit()
+    return n
+
+
+def podar(conn):
+    """Borra los reportes (y sus archivos) solicitados hace más de RETENCION_DIAS días."""
+    if RETENCION_DIAS <= 0:
+        return 0
+    limite = (datetime.now() - timedelta(days=RETENCION_DIAS)).strftime('%Y-%m-%d %H:%M:%S')
+    viejos = [f[0] for f in conn.execute(
+        "SELECT reporte_id FROM reportes WHERE fecha_solicitud < ? AND estado IN ('Listo', 'Error')", (limite,)).fetchall()]
+    for reporte_id in viejos:
+        for ruta in [ruta_resultado(reporte_id)] + _parciales(reporte_id):
+            _borrar(ruta)
+    conn.executemany("DELETE FROM reportes WHERE reporte_id = ?", [(r,) for r in viejos])
+    conn.commit()
+    return len(viejos)
+
+
+# ----------------------------------------------------------------------------
+# Cálculo (cada función corre en un hilo de ejecutor_bd con su propia conexión)
+# ----------------------------------------------------------------------------
+def ruta_resultado(reporte_id):
+    return os.path.join(REPORTES_DIR, f'{int(reporte_id)}.csv')
+
+
+def ruta_parcial(reporte_id, intento):
+    """Archivo en construcción: uno por intento, así dos trabajadores nunca escriben el mismo."""
+    return os.path.join(REPORTES_DIR, f'{int(reporte_id)}.{int(intento)}.parcial')
+
+
+def _parciales(reporte_id):
+    return glob.glob(os.path.join(REPORTES_DIR, f'{int(reporte_id)}.*.parcial'))
+
+
+SQL_ES_DUENO = "reporte_id = ? AND intento = ? AND estado = 'En proceso'"
+
+
+def avanzar(conn, reporte_id, intento, progreso, etapa):
+    """Anota la etapa en curso y renueva el latido. ReporteReasignado si el intento ya no es el vigente."""
+    if not conn.execute(f"UPDATE reportes SET progreso = ?, etapa = ?, latido = ? WHERE {SQL_ES_DUENO}",
+                        (progreso, etapa, _ahora(), reporte_id, intento)).rowcount:
+        conn.rollback()
+        raise ReporteReasignado(f'El reporte #{reporte_id} ya no corresponde al intento {intento}.')
+    conn.commit()
+
+
+def calcular_etapa(conn, reporte_id, intento, sql, parametros, primera):
+    """
+    Ejecuta una etapa y agrega sus filas al archivo parcial del intento, de a
+    LOTE_FILAS para no cargar todo en memoria. Devuelve las filas escritas.
+    """
+    os.makedirs(REPORTES_DIR, exist_ok=True)
+    cursor = conn.execute(sql, parametros)
+    filas = 0
+    # utf-8-sig para que Excel reconozca los acentos.
+    with open(ruta_parcial(reporte_id, intento), 'w' if primera else 'a', newline='',
+              encoding='utf-8-sig' if primera else 'utf-8') as f:
+        escritor = csv.writer(f)
+        if primera:
+            escritor.writerow([d[0] for d in cursor.description])
+        while True:
+            lote = cursor.fetchmany(LOTE_FILAS)
+            if not lote:
+                break
+            escritor.writerows(tuple(fila) for fila in lote)
+            filas += len(lote)
+    return filas
+
+
+def terminar(conn, reporte_id, intento, filas):
+    """
+    Publica el archivo del intento como resultado y marca el reporte 'Listo'.
+    El bloqueo de escritura se toma antes de verificar el dueño, de modo que
+    ningún otro trabajador puede tomar el reporte entre la verificación y el cambio.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not conn.execute(f"""
+            UPDATE reportes SET estado = 'Listo', progreso = 100, etapa = NULL, filas = ?, fecha_fin = ? WHERE {SQL_ES_DUENO}
+        """, (filas, _ahora(), reporte_id, intento)).rowcount:
+            raise ReporteReasignado(f'El reporte #{reporte_id} ya no corresponde al intento {intento}.')
+        os.replace(ruta_parcial(reporte_id, intento), ruta_resultado(reporte_id))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _borrar(ruta_parcial(reporte_id, intento))
+        raise
+    # Restos de intentos anteriores cuyo proceso cayó.
+    for ruta in _parciales(reporte_id):
+        _borrar(ruta)
+
+
+def fallar(conn, reporte_id, intento, mensaje):
+    """Marca el reporte 'Error' si el intento sigue vigente; si no, sólo borra su archivo parcial."""
+    _borrar(ruta_parcial(reporte_id, intento))
+    conn.execute(f"UPDATE reportes SET estado = 'Error', error = ?, fecha_fin = ? WHERE {SQL_ES_DUENO}",
+                 (mensaje, _ahora(), reporte_id, intento))
+    conn.commit()
+
+
+def _borrar(ruta):
+    try:
+        os.remove(ruta)
+    except FileNotFoundError:
+        pass
+
+
+# ----------------------------------------------------------------------------
+# Consulta de resultados
+# ----------------------------------------------------------------------------
+def obtener(conn, reporte_id):
+    fila = conn.execute("SELECT * FROM reportes WHERE reporte_id = ?", (reporte_id,)).fetchone()
+    return _con_titulo(dict(fila)) if fila else None
+
+
+def listar(conn, limite=100):
+    filas = conn.execute("SELECT * FROM reportes ORDER BY reporte_id DESC LIMIT ?", (limite,)).fetchall()
+    return [_con_titulo(dict(f)) for f in filas]
+
+
+def _con_titulo(reporte):
+    reporte['titulo'] = TIPOS[reporte['tipo']][0] if reporte['tipo'] in TIPOS else reporte['tipo']
+    reporte['parametros'] = json.loads(reporte['parametros'] or '{}')
+    return reporte
+
+
+def leer_pagina(reporte_id, pagina=1, por_pagina=FILAS_POR_PAGINA):
+    """(columnas, filas) de una página del resultado; ([], []) si el archivo ya no existe."""
+    try:
+        with open(ruta_resultado(reporte_id), newline='', encoding='utf-8-sig') as f:
+            lector = csv.reader(f)
+            columnas = next(lector, [])
+            inicio = (max(pagina, 1) - 1) * por_pagina
+            filas = []
+            for i, fila in enumerate(lector):
+                if i >= inicio + por_pagina:
+                    break
+                if i >= inicio:
+                    filas.append(fila)
+            return columnas, filas
+    except FileNotFoundError:
+        return [], []
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+Retiros de tienda: productos que vuelven de una tienda a la bodega principal.
+
+Un retiro queda 'Pendiente' hasta que la bodega confirma su recepción; entonces
+la cantidad vuelve al stock de la bodega y el retiro pasa a 'Completado'.
+"""
+
+
+def confirmar_lote(conn, retiro_ids, usuario_id):
+    """
+    Confirma en una sola transacción los retiros pendientes indicados (o todos si
+    retiro_ids es None): un UPDATE de stock por producto y un UPDATE para marcar
+    los retiros como completados.
+
+    BEGIN IMMEDIATE toma el bloqueo de escritura antes de leer los pendientes, así
+    dos confirmaciones simultáneas no pueden sumar dos veces el mismo retiro.
+    """
+    if conn.in_transaction:
+        conn.commit()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS retiros_a_confirmar (retiro_id INTEGER PRIMARY KEY)")
+        conn.execute("DELETE FROM retiros_a_confirmar")
+        if retiro_ids is None:
+            conn.execute("INSERT INTO retiros_a_confirmar SELECT retiro_id FROM retiros_tienda WHERE estado = 'Pendiente'")
+        else:
+            conn.executemany("INSERT OR IGNORE INTO retiros_a_confirmar (retiro_id) VALUES (?)", [(int(r),) for r in retiro_ids])
+
+        por_producto = conn.execute("""
+            SELECT rt.producto_id, SUM(rt.cantidad_retirada), COUNT(*)
+            FROM retiros_tienda rt
+            JOIN retiros_a_confirmar c ON rt.retiro_id = c.retiro_id
+            WHERE rt.estado = 'Pendiente'
+            GROUP BY rt.producto_id
+        """).fetchall()
+
+        conn.executemany("UPDATE productos SET stock_actual = stock_actual + ? WHERE producto_id = ?",
+                         [(cantidad, producto_id) for producto_id, cantidad, _ in por_producto])
+        confirmados = conn.execute("""
+            UPDATE retiros_tienda
+            SET estado = 'Completado', fecha_recepcion = datetime('now'), usuario_receptor_id = ?
+            WHERE estado = 'Pendiente' AND retiro_id IN (SELECT retiro_id FROM retiros_a_confirmar)
+        """, (usuario_id,)).rowcount
+        solicitados = conn.execute("SELECT COUNT(*) FROM retiros_a_confirmar").fetchone()[0]
+        conn.execute("DELETE FROM retiros_a_confirmar")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {
+        'solicitados': solicitados,
+        'confirmados': confirmados,
+        'omitidos': solicitados - confirmados,
+        'productos_actualizados': len(por_producto),
+        'unidades_recibidas': sum(cantidad for _, cantidad, _ in por_producto),
+    }
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Lanzador de producción del servidor I-Tec (sin el servidor de desarrollo de Werkzeug).
+
+Levanta N procesos, cada uno con el servidor asíncrono de eventlet o gevent en
+su propio puerto (5001, 5002, ...). Los procesos comparten la base de datos y
+reparten los eventos de Socket.IO por la cola SOCKETIO_MESSAGE_QUEUE; si no se
+indica una y hay más de un proceso, se inicia el broker local (broker_socketio.py).
+
+Delante se coloca un balanceador con sesiones persistentes, por ejemplo nginx:
+
+    upstream itec { ip_hash; server 127.0.0.1:5001; server 127.0.0.1:5002; }
+    location / {
+        proxy_pass http://itec;
+        proxy_http_version 1.1;
+        proxy_set_header Upgrade $http_upgrade;
+        proxy_set_header Connection "upgrade";
+    }
+
+Uso:
+    python servidor_produccion.py --procesos 4 --puerto 5001
+"""
+import argparse
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+
+
+def _modo_asincrono():
+    """Elige eventlet o gevent según lo instalado; el modo threading no sirve en producción."""
+    preferido = os.environ.get('SOCKETIO_ASYNC_MODE')
+    for modo in ([preferido] if preferido else ['eventlet', 'gevent']):
+        try:
+            __import__(modo)
+            return modo
+        except ImportError:
+            continue
+    sys.exit('ERROR: instala eventlet o gevent para el servidor de producción.')
+
+
+def ejecutar_worker(host, puerto, modo, tareas_fondo):
+    """Proceso hijo: servidor asíncrono de eventlet/gevent sobre la aplicación."""
+    if modo == 'eventlet':
+        import eventlet
+        eventlet.monkey_patch()
+    else:
+        from gevent import monkey
+        monkey.patch_all()
+
+    os.environ['SOCKETIO_ASYNC_MODE'] = modo
+    sys.path.insert(0, DIRECTORIO)
+    from app import crear_app, socketio
+
+    app = crear_app(inicializar_bd=False, tareas_fondo=tareas_fondo)
+    if socketio.async_mode not in ('eventlet', 'gevent'):
+        sys.exit(f'ERROR: Socket.IO quedó en modo {socketio.async_mode}; se esperaba {modo}.')
+    print(f'[{os.getpid()}] Worker {modo} escuchando en http://{host}:{puerto}')
+    socketio.run(app, host=host, port=puerto, debug=False, use_reloader=False, log_output=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor de producción I-Tec con varios procesos.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--puerto', type=int, default=5001, help='Puerto del primer proceso; los siguientes usan puertos consecutivos.')
+    parser.add_argument('--procesos', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--tareas-fondo', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    modo = _modo_asincrono()
+    if args.worker:
+        ejecutar_worker(args.host, args.puerto, modo, args.tareas_fondo)
+        return
+
+    # Esquema y datos base una sola vez, antes de que los procesos compitan por la BD.
+    sys.path.insert(0, DIRECTORIO)
+    from app import init_inventory_db
+    init_inventory_db()
+
+    env = dict(os.environ, SOCKETIO_ASYNC_MODE=modo)
+    hijos = []
+    if args.procesos > 1 and not env.get('SOCKETIO_MESSAGE_QUEUE'):
+        if modo != 'eventlet':
+            sys.exit('ERROR: el broker local (ZeroMQ) requiere eventlet; con gevent define SOCKETIO_MESSAGE_QUEUE=redis://...')
+        hijos.append(subprocess.Popen([sys.executable, os.path.join(DIRECTORIO, 'broker_socketio.py')], cwd=os.getcwd()))
+        env['SOCKETIO_MESSAGE_QUEUE'] = 'zmq+tcp://127.0.0.1:5555+5556'
+        time.sleep(0.5)
+
+    for i in range(args.procesos):
+        # Sólo el primer proceso ejecuta las tareas periódicas (archivo de telemetría).
+        hijos.append(subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), '--worker', '--host', args.host, '--puerto', str(args.puerto + i)]
+            + (['--tareas-fondo'] if i == 0 else []),
+            env=env, cwd=os.getcwd()))
+
+    def detener(*_):
+        for hijo in hijos:
+            hijo.terminate()
+    signal.signal(signal.SIGTERM, detener)
+    signal.signal(signal.SIGINT, detener)
+
+    print(f'I-Tec: {args.procesos} procesos ({modo}) en puertos {args.puerto}-{args.puerto + args.procesos - 1}')
+    try:
+        while all(h.poll() is None for h in hijos):
+            time.sleep(1)
+    finally:
+        detener()
+        for hijo in hijos:
+            hijo.wait()
+
+
+if __name__ == '__main__':
+    main()
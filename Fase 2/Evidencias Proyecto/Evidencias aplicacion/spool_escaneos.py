@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Spool en disco para escaneos que no se pueden guardar de inmediato.
+
+Cuando la base de telemetría está ocupada (un reporte largo, un checkpoint),
+el escaneo se agrega a un archivo JSONL con write + fsync y se responde 202; un
+drenador en segundo plano lo carga después en nfc_readings por lotes.
+
+Cada proceso escribe en su propio segmento, bloqueado con flock mientras está
+abierto. El drenador cierra el segmento actual (rotar) y carga todos los
+segmentos que nadie tiene bloqueados, incluidos los que dejó un proceso caído:
+así un corte no pierde escaneos ya confirmados al dispositivo. Cada entrada
+lleva un client_scan_id (el del dispositivo o 'spool:<id>'), de modo que cargar
+dos veces el mismo segmento no duplica lecturas.
+"""
+import json
+import os
+import time
+import uuid
+
+import metricas
+
+try:
+    import fcntl
+except ImportError:  # Windows: se asume un único proceso (servidor de desarrollo).
+    fcntl = None
+
+SPOOL_DIR = os.environ.get('ITEC_SPOOL_DIR', 'spool_escaneos')
+LOTE_DRENAJE = 500
+
+
+def _bloquear(fd):
+    """Bloqueo exclusivo sin espera; False si otro proceso tiene el archivo."""
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class SpoolEscaneos:
+    def __init__(self, directorio=SPOOL_DIR):
+        self.directorio = directorio
+        self._fd = None
+        # agregar() y rotar() corren en los hilos de ejecutor_bd: el write + fsync no debe bloquear el hub.
+        self._lock = metricas.lock_nativo()
+
+    def _abrir_segmento(self):
+        os.makedirs(self.directorio, exist_ok=True)
+        nombre = f'{int(time.time() * 1000)}-{os.getpid()}-{uuid.uuid4().hex[:8]}'
+        temporal = os.path.join(self.directorio, nombre + '.tmp')
+        fd = os.open(temporal, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        # Se bloquea antes de darle el nombre visible, para que ningún drenador lo tome a medio escribir.
+        _bloquear(fd)
+        os.rename(temporal, os.path.join(self.directorio, nombre + '.jsonl'))
+        self._fd = fd
+
+    def agregar(self, entrada):
+        """
+        Escribe la entrada y espera a que esté en disco. Completa 'spool_id' y,
+        si falta, 'client_scan_id'. Devuelve la entrada tal como se guardó.
+        """
+        entrada = dict(entrada)
+        entrada.setdefault('spool_id', uuid.uuid4().hex)
+        if not entrada.get('client_scan_id'):
+            entrada['client_scan_id'] = f"spool:{entrada['spool_id']}"
+        linea = (json.dumps(entrada, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            if self._fd is None:
+                self._abrir_segmento()
+            os.write(self._fd, linea)
+            os.fsync(self._fd)
+        return entrada
+
+    def rotar(self):
+        """Cierra el segmento actual (liberando su bloqueo) para que se pueda drenar."""
+        with self._lock:
+            if self._fd is not None:
+                os.close(self._fd)
+                self._fd = None
+
+    def drenar(self, cargar, lote=LOTE_DRENAJE):
+        """
+        Carga los segmentos libres con cargar(entradas) -> resultados y los borra.
+        Si cargar falla (base aún ocupada) el segmento queda para el próximo intento.
+        No toma el lock interno, así que puede ejecutarse en un hilo del grupo de BD;
+        llamar antes a rotar() en el proceso que escribe.
+        """
+        if not os.path.isdir(self.directorio):
+            return []
+        resultados = []
+        for nombre in sorted(os.listdir(self.directorio)):
+            if not nombre.endswith('.jsonl'):
+                continue
+            ruta = os.path.join(self.directorio, nombre)
+            try:
+                fd = os.open(ruta, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            try:
+                # Bloqueado: lo está escribiendo su proceso o drenando otro.
+                if not _bloquear(fd) or not os.path.exists(ruta):
+                    continue
+                with os.fdopen(os.dup(fd), 'rb') as f:
+                    contenido = f.read()
+                entradas = []
+                for linea in contenido.splitlines():
+                    try:
+                        entradas.append(json.loads(linea))
+                    except ValueError:
+                        pass  # Línea incompleta: el proceso cayó a mitad de la escritura y no la confirmó.
+                for i in range(0, len(entradas), lote):
+                    resultados.extend(cargar(entradas[i:i + lote]))
+                os.remove(ruta)
+            finally:
+                os.close(fd)
+        return resultados
+
+    def pendientes(self):
+        """Cantidad de segmentos por drenar (incluido el que se está escribiendo)."""
+        if not os.path.isdir(self.directorio):
+            return 0
+        return sum(1 for n in os.listdir(self.directorio) if n.endswith('.jsonl'))
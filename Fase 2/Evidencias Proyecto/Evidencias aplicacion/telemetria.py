@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""
+Base de datos de telemetría de escaneos (nfc_readings).
+
+Las lecturas se escriben en ráfagas y no necesitan la durabilidad de las
+transacciones de inventario, así que viven en su propio archivo SQLite con su
+propio bloqueo de escritura, sus pragmas y su política de checkpoint. Las
+consultas de inventario que necesiten cruzar con las lecturas las adjuntan en
+sólo lectura con adjuntar().
+
+El archivo "caliente" sólo guarda los últimos TELEMETRIA_DIAS_CALIENTES días;
+archivar() mueve lo anterior a un archivo por mes en TELEMETRIA_DIR_ARCHIVO y
+las lecturas históricas adjuntan esos archivos sólo cuando el rango lo pide.
+
+Los paneles y gráficos de tendencia leen los agregados por minuto, hora y día
+(rollups) que se actualizan en cada escaneo, no las lecturas crudas.
+"""
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import metricas
+
+TELEMETRIA_DATABASE_FILE = os.environ.get('TELEMETRIA_DATABASE_FILE', 'nfc_telemetria.db')
+# Páginas de WAL antes del checkpoint automático: más alto que el valor por
+# defecto (1000) para que una ráfaga de escaneos no pague checkpoints seguidos.
+TELEMETRIA_WAL_AUTOCHECKPOINT = int(os.environ.get('TELEMETRIA_WAL_AUTOCHECKPOINT', 10000))
+TELEMETRIA_BUSY_TIMEOUT = float(os.environ.get('TELEMETRIA_BUSY_TIMEOUT', 5))
+LOTE_MIGRACION = 5000
+
+TELEMETRIA_DIR_ARCHIVO = os.environ.get('TELEMETRIA_DIR_ARCHIVO', 'archivo_telemetria')
+TELEMETRIA_DIAS_CALIENTES = int(os.environ.get('TELEMETRIA_DIAS_CALIENTES', 90))
+# Meses de archivo que se conservan; 0 los conserva para siempre.
+TELEMETRIA_MESES_RETENCION = int(os.environ.get('TELEMETRIA_MESES_RETENCION', 0))
+TELEMETRIA_INTERVALO_ARCHIVO = int(os.environ.get('TELEMETRIA_INTERVALO_ARCHIVO', 3600))
+LOTE_ARCHIVO = 2000
+
+# Granularidad -> largo del prefijo ISO 8601 del timestamp que identifica el período.
+GRANULARIDADES = {'minuto': 16, 'hora': 13, 'dia': 10}
+# Días que se conservan los agregados finos; los diarios se conservan siempre.
+TELEMETRIA_ROLLUP_DIAS = {
+    'minuto': int(os.environ.get('TELEMETRIA_ROLLUP_DIAS_MINUTO', 7)),
+    'hora': int(os.environ.get('TELEMETRIA_ROLLUP_DIAS_HORA', 180)),
+}
+AGRUPACIONES_ROLLUP = ('tipo', 'dispositivo', 'ip_address')
+
+COLUMNAS_LECTURAS = ('id', 'device_info', 'nfc_data', 'timestamp', 'formatted_time', 'ip_address', 'user_agent')
+
+
+@contextmanager
+def conexion(ruta=TELEMETRIA_DATABASE_FILE, timeout=None):
+    """
+    Conexión a la telemetría con sus pragmas; confirma al salir y siempre se cierra.
+    'timeout' es la espera máxima (segundos) si la base está bloqueada.
+    """
+    conn = sqlite3.connect(ruta, timeout=TELEMETRIA_BUSY_TIMEOUT if timeout is None else timeout)
+    try:
+        # Una lectura perdida ante un corte de energía es aceptable; esperar un fsync por escaneo no.
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute(f'PRAGMA wal_autocheckpoint = {TELEMETRIA_WAL_AUTOCHECKPOINT}')
+        with conn:
+            yield metricas.ConexionInstrumentada(conn, 'telemetria')
+    finally:
+        conn.close()
+
+
+def crear_tablas(conn):
+    """
+    Crea la tabla de lecturas y el índice de archivos mensuales, y deja el
+    archivo en modo WAL (persiste en el archivo). Un archivo nuevo se crea con
+    auto_vacuum incremental; uno existente se convierte con activar_auto_vacuum().
+    """
+    if not conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+        # En un archivo vacío basta el pragma; en uno con datos haría falta un VACUUM.
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS nfc_readings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, device_info TEXT, nfc_data TEXT,
+            timestamp TEXT, formatted_time TEXT, ip_address TEXT, user_agent TEXT
+        )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_nfc_readings_timestamp ON nfc_readings (timestamp)')
+    # ID generado por la app móvil: un reintento con el mismo ID no crea otra lectura.
+    if 'client_scan_id' not in [c[1] for c in conn.execute('PRAGMA table_info(nfc_readings)')]:
+        conn.execute('ALTER TABLE nfc_readings ADD COLUMN client_scan_id TEXT')
+    conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_nfc_readings_client_scan_id '
+                 'ON nfc_readings (client_scan_id) WHERE client_scan_id IS NOT NULL')
+    # Resumen de cada archivo mensual, para las estadísticas sin abrirlos.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archivos_telemetria (
+            mes      TEXT PRIMARY KEY,
+            archivo  TEXT NOT NULL,
+            lecturas INTEGER NOT NULL DEFAULT 0
+        )''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS archivos_telemetria_ips (
+            mes        TEXT NOT NULL,
+            ip_address TEXT NOT NULL,
+            PRIMARY KEY (mes, ip_address)
+        )''')
+    for granularidad in GRANULARIDADES:
+        conn.execute(f'''
+            CREATE TABLE IF NOT EXISTS rollup_escaneos_{granularidad} (
+                periodo     TEXT NOT NULL,
+                tipo        TEXT NOT NULL,
+                dispositivo TEXT NOT NULL,
+                ip_address  TEXT NOT NULL,
+                lecturas    INTEGER NOT NULL,
+                PRIMARY KEY (periodo, tipo, dispositivo, ip_address)
+            ) WITHOUT ROWID''')
+
+
+def activar_auto_vacuum(ruta=TELEMETRIA_DATABASE_FILE, timeout=60):
+    """
+    Convierte un archivo existente a auto_vacuum incremental. Requiere un VACUUM,
+    que reescribe el archivo completo con el bloqueo tomado: es una tarea de
+    mantenimiento (python telemetria.py auto_vacuum), no algo que haga cada proceso
+    al arrancar. Devuelve True si hubo que convertirlo.
+    """
+    with conexion(ruta, timeout) as conn:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+            return False
+        conn.commit()
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    return True
+
+
+def migrar_lecturas(origen, destino=TELEMETRIA_DATABASE_FILE, lote=LOTE_MIGRACION):
+    """
+    Mueve las lecturas de 'origen' (la base de inventario, donde vivían antes) a la
+    telemetría, por lotes: cada lote se copia y se borra del origen en una misma
+    transacción. Se conservan los IDs, de modo que reading_id en otras tablas sigue
+    siendo válido, y la copia usa INSERT OR IGNORE, así que repetir la migración
+    tras una interrupción es seguro. Devuelve el número de lecturas movidas.
+    """
+    if not os.path.exists(origen) or Path(origen).resolve() == Path(destino).resolve():
+        return 0
+
+    columnas = ', '.join(COLUMNAS_LECTURAS)
+    movidas = 0
+    with conexion(destino) as conn:
+        crear_tablas(conn)
+        conn.execute("ATTACH DATABASE ? AS origen", (origen,))
+        try:
+            if not conn.execute("SELECT 1 FROM origen.sqlite_master WHERE type = 'table' AND name = 'nfc_readings'").fetchone():
+                return 0
+            while True:
+                conn.commit()
+                conn.execute("BEGIN IMMEDIATE")
+                tope = conn.execute("SELECT MAX(id) FROM (SELECT id FROM origen.nfc_readings ORDER BY id LIMIT ?)",
+                                    (lote,)).fetchone()[0]
+                if tope is None:
+                    conn.commit()
+                    break
+                conn.execute(f"INSERT OR IGNORE INTO main.nfc_readings ({columnas}) "
+                             f"SELECT {columnas} FROM origen.nfc_readings WHERE id <= ?", (tope,))
+                movidas += conn.execute("DELETE FROM origen.nfc_readings WHERE id <= ?", (tope,)).rowcount
+                conn.commit()
+            conn.execute("DROP TABLE IF EXISTS origen.nfc_readings")
+            conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute("DETACH DATABASE origen")
+    return movidas
+
+
+def adjuntar(conn, alias='telemetria', ruta=TELEMETRIA_DATABASE_FILE):
+    """
+    Adjunta la telemetría en sólo lectura a una conexión de inventario, para
+    consultas como: SELECT ... FROM tomas_inventario_escaneos e
+                    JOIN telemetria.nfc_readings r ON r.id = e.reading_id
+    """
+    conn.execute(f"ATTACH DATABASE ? AS {alias}", (Path(ruta).resolve().as_uri() + '?mode=ro',))
+
+
+# ============================================================================
+# ARCHIVO MENSUAL Y RETENCIÓN
+# ============================================================================
+def _ruta_archivo(mes, directorio=TELEMETRIA_DIR_ARCHIVO):
+    return os.path.join(directorio, f"nfc_readings_{mes.replace('-', '_')}.db")
+
+
+def _mes_siguiente(mes):
+    anio, m = int(mes[:4]), int(mes[5:7])
+    return f'{anio + m // 12:04d}-{m % 12 + 1:02d}'
+
+
+def archivar(ruta=TELEMETRIA_DATABASE_FILE, dias_calientes=TELEMETRIA_DIAS_CALIENTES,
+             directorio=TELEMETRIA_DIR_ARCHIVO, meses_retencion=TELEMETRIA_MESES_RETENCION, lote=LOTE_ARCHIVO):
+    """
+    Mueve las lecturas con más de 'dias_calientes' días a su archivo mensual y
+    aplica la retención. Cada lote se copia, se borra del archivo caliente y se
+    suma al resumen en una transacción corta, así los escaneos siguen entrando
+    entre lotes. La copia usa INSERT OR IGNORE y el resumen se actualiza con lo
+    borrado: repetir tras un corte, o con dos procesos a la vez, es seguro.
+    Devuelve {mes: lecturas movidas}.
+    """
+    corte = (datetime.now() - timedelta(days=dias_calientes)).isoformat()
+    columnas = ', '.join(COLUMNAS_LECTURAS)
+    movidas = {}
+    os.makedirs(directorio, exist_ok=True)
+
+    with conexion(ruta) as conn:
+        crear_tablas(conn)
+        conn.commit()
+        meses = [f[0] for f in conn.execute(
+            "SELECT DISTINCT substr(timestamp, 1, 7) FROM nfc_readings WHERE timestamp < ? ORDER BY 1", (corte,))]
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS lote_archivo (id INTEGER PRIMARY KEY)")
+
+        for mes in meses:
+            if not re.fullmatch(r'\d{4}-\d{2}', mes or ''):
+                continue
+            archivo = _ruta_archivo(mes, directorio)
+            conn.execute("ATTACH DATABASE ? AS archivo", (archivo,))
+            try:
+                conn.execute('''
+                    CREATE TABLE IF NOT EXISTS archivo.nfc_readings (
+                        id INTEGER PRIMARY KEY, device_info TEXT, nfc_data TEXT,
+                        timestamp TEXT, formatted_time TEXT, ip_address TEXT, user_agent TEXT
+                    )''')
+                conn.execute("CREATE INDEX IF NOT EXISTS archivo.idx_nfc_readings_timestamp ON nfc_readings (timestamp)")
+                conn.commit()
+                hasta = min(_mes_siguiente(mes), corte)
+                while True:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("DELETE FROM temp.lote_archivo")
+                    conn.execute("INSERT INTO temp.lote_archivo SELECT id FROM main.nfc_readings "
+                                 "WHERE timestamp >= ? AND timestamp < ? ORDER BY timestamp LIMIT ?", (mes, hasta, lote))
+                    conn.execute(f"INSERT OR IGNORE INTO archivo.nfc_readings ({columnas}) "
+                                 f"SELECT {columnas} FROM main.nfc_readings WHERE id IN (SELECT id FROM temp.lote_archivo)")
+                    conn.execute("INSERT OR IGNORE INTO main.archivos_telemetria_ips (mes, ip_address) "
+                                 "SELECT DISTINCT ?, ip_address FROM main.nfc_readings "
+                                 "WHERE id IN (SELECT id FROM temp.lote_archivo) AND ip_address IS NOT NULL", (mes,))
+                    n = conn.execute("DELETE FROM main.nfc_readings WHERE id IN (SELECT id FROM temp.lote_archivo)").rowcount
+                    if n:
+                        conn.execute("INSERT INTO main.archivos_telemetria (mes, archivo, lecturas) VALUES (?, ?, ?) "
+                                     "ON CONFLICT (mes) DO UPDATE SET lecturas = lecturas + excluded.lecturas",
+                                     (mes, os.path.basename(archivo), n))
+                    conn.commit()
+                    movidas[mes] = movidas.get(mes, 0) + n
+                    if n < lote:
+                        break
+            finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                conn.execute("DETACH DATABASE archivo")
+            # Devuelve al sistema las páginas liberadas sin reescribir todo el archivo.
+            conn.execute("PRAGMA incremental_vacuum")
+
+        if meses_retencion:
+            hoy = datetime.now()
+            meses_totales = hoy.year * 12 + hoy.month - 1 - meses_retencion
+            limite = f'{meses_totales // 12:04d}-{meses_totales % 12 + 1:02d}'
+            for mes, archivo in conn.execute("SELECT mes, archivo FROM archivos_telemetria WHERE mes < ?", (limite,)).fetchall():
+                ruta_archivo = os.path.join(directorio, archivo)
+                if os.path.exists(ruta_archivo):
+                    os.remove(ruta_archivo)
+                conn.execute("DELETE FROM archivos_telemetria_ips WHERE mes = ?", (mes,))
+                conn.execute("DELETE FROM archivos_telemetria WHERE mes = ?", (mes,))
+            conn.commit()
+    return movidas
+
+
+def meses_archivados(conn, desde=None, hasta=None):
+    """Meses archivados (del más reciente al más antiguo) que se cruzan con [desde, hasta)."""
+    filas = conn.execute("SELECT mes, archivo FROM archivos_telemetria ORDER BY mes DESC").fetchall()
+    return [(mes, archivo) for mes, archivo in filas
+            if (desde is None or _mes_siguiente(mes) > desde[:7]) and (hasta is None or mes < hasta)]
+
+
+@contextmanager
+def archivo_adjunto(conn, archivo, directorio=TELEMETRIA_DIR_ARCHIVO, alias='archivo'):
+    """Adjunta un archivo mensual en sólo lectura mientras dura el bloque."""
+    conn.execute(f"ATTACH DATABASE ? AS {alias}",
+                 (Path(directorio, archivo).resolve().as_uri() + '?mode=ro',))
+    try:
+        yield alias
+    finally:
+        conn.execute(f"DETACH DATABASE {alias}")
+
+
+# ============================================================================
+# AGREGADOS (ROLLUPS) POR MINUTO, HORA Y DÍA
+# ============================================================================
+# Mismo criterio que _id_dispositivo() en app.py, para reconstruir desde el JSON guardado.
+SQL_DISPOSITIVO = """
+    COALESCE(
+        CASE WHEN json_valid(device_info) AND json_type(device_info) = 'object' THEN
+            COALESCE(NULLIF(json_extract(device_info, '$.deviceId'), ''), NULLIF(json_extract(device_info, '$.device_id'), ''),
+                     NULLIF(json_extract(device_info, '$.uuid'), ''), NULLIF(json_extract(device_info, '$.id'), ''))
+        END,
+        ip_address, 'desconocido')"""
+# Tipos con los que se agrupan los escaneos (los mismos de las salas de Socket.IO);
+# cualquier otro 'type' que mande el cliente en /api/submit-nfc cuenta como 'NFC'.
+TIPOS_ESCANEO = ('NFC', 'QR', 'BARCODE', 'UNKNOWN')
+SQL_TIPO = f"""
+    (SELECT CASE WHEN t IN ({', '.join(f"'{t}'" for t in TIPOS_ESCANEO)}) THEN t ELSE 'NFC' END FROM (
+        SELECT UPPER(CASE WHEN json_valid(nfc_data) AND json_type(nfc_data) = 'object'
+                          THEN json_extract(nfc_data, '$.type') END) AS t))"""
+
+
+def tipo_escaneo(nfc_data):
+    """Tipo de la lectura para los agregados: uno de TIPOS_ESCANEO (ver SQL_TIPO)."""
+    tipo = str(nfc_data.get('type') or '').upper() if isinstance(nfc_data, dict) else ''
+    return tipo if tipo in TIPOS_ESCANEO else 'NFC'
+
+
+def registrar_rollup(conn, timestamp, tipo, dispositivo, ip_address):
+    """Suma una lectura a los agregados de su minuto, hora y día (misma transacción que el INSERT)."""
+    for granularidad, largo in GRANULARIDADES.items():
+        conn.execute(f'''
+            INSERT INTO rollup_escaneos_{granularidad} (periodo, tipo, dispositivo, ip_address, lecturas) VALUES (?, ?, ?, ?, 1)
+            ON CONFLICT (periodo, tipo, dispositivo, ip_address) DO UPDATE SET lecturas = lecturas + 1
+        ''', (timestamp[:largo], tipo, dispositivo, ip_address or ''))
+
+
+def insertar_lectura(conn, device_info, nfc_data, ip_address, user_agent, dispositivo, client_scan_id=None, timestamp=None):
+    """
+    Inserta una lectura y la suma a los agregados, sin confirmar. Si ya existe una
+    con el mismo client_scan_id no escribe nada y devuelve la original con
+    'duplicado': True, así repetir la carga de un lote (spool) no duplica lecturas.
+    """
+    momento = datetime.fromisoformat(timestamp) if timestamp else datetime.now()
+    timestamp = momento.isoformat()
+    formatted_time = momento.strftime('%Y-%m-%d %H:%M:%S')
+    cursor = conn.cursor()
+    cursor.execute('''INSERT INTO nfc_readings (device_info, nfc_data, timestamp, formatted_time, ip_address, user_agent, client_scan_id)
+                      VALUES (?, ?, ?, ?, ?, ?, ?)
+                      ON CONFLICT (client_scan_id) WHERE client_scan_id IS NOT NULL DO NOTHING''',
+                   (json.dumps(device_info), json.dumps(nfc_data), timestamp, formatted_time, ip_address, user_agent, client_scan_id))
+    if not cursor.rowcount:
+        return lectura_por_client_scan_id(conn, client_scan_id)
+    reading_id = cursor.lastrowid
+    registrar_rollup(conn, timestamp, tipo_escaneo(nfc_data), dispositivo, ip_address)
+    return {'id': reading_id, 'device_info': device_info, 'nfc_data': nfc_data, 'timestamp': timestamp,
+            'formatted_time': formatted_time, 'ip_address': ip_address}
+
+
+def lectura_por_client_scan_id(conn, client_scan_id):
+    fila = conn.execute('SELECT id, timestamp FROM nfc_readings WHERE client_scan_id = ?', (client_scan_id,)).fetchone()
+    return {'id': fila[0], 'timestamp': fila[1], 'duplicado': True} if fila else None
+
+
+def _acumular_rollups(conn, tabla_lecturas):
+    for granularidad, largo in GRANULARIDADES.items():
+        conn.execute(f'''
+            INSERT INTO rollup_escaneos_{granularidad} (periodo, tipo, dispositivo, ip_address, lecturas)
+            SELECT substr(timestamp, 1, {largo}), {SQL_TIPO}, {SQL_DISPOSITIVO}, COALESCE(ip_address, ''), COUNT(*)
+            FROM {tabla_lecturas}
+            WHERE timestamp IS NOT NULL
+            GROUP BY 1, 2, 3, 4
+            ON CONFLICT (periodo, tipo, dispositivo, ip_address) DO UPDATE SET lecturas = lecturas + excluded.lecturas
+        ''')
+
+
+def reconstruir_rollups(ruta=TELEMETRIA_DATABASE_FILE, directorio=TELEMETRIA_DIR_ARCHIVO, solo_si_vacios=False):
+    """
+    Recalcula los agregados desde las lecturas del archivo caliente y de cada
+    archivo mensual. Con solo_si_vacios=True no hace nada si ya hay agregados
+    (así el arranque sólo los calcula la primera vez). Devuelve True si los recalculó.
+    """
+    with conexion(ruta) as conn:
+        crear_tablas(conn)
+        conn.commit()
+        conn.execute("BEGIN IMMEDIATE")
+        if solo_si_vacios and (conn.execute("SELECT 1 FROM rollup_escaneos_dia LIMIT 1").fetchone()
+                               or not conn.execute("SELECT 1 FROM nfc_readings LIMIT 1").fetchone()):
+            conn.rollback()
+            return False
+        for granularidad in GRANULARIDADES:
+            conn.execute(f"DELETE FROM rollup_escaneos_{granularidad}")
+        _acumular_rollups(conn, 'main.nfc_readings')
+        conn.commit()
+        for _, archivo in meses_archivados(conn):
+            if not os.path.exists(os.path.join(directorio, archivo)):
+                continue
+            with archivo_adjunto(conn, archivo, directorio) as alias:
+                conn.execute("BEGIN IMMEDIATE")
+                _acumular_rollups(conn, f'{alias}.nfc_readings')
+                conn.commit()
+        compactar_rollups(conn)
+    return True
+
+
+def compactar_rollups(conn, dias=None):
+    """Borra los agregados por minuto y por hora más antiguos que su retención."""
+    dias = dias or TELEMETRIA_ROLLUP_DIAS
+    eliminados = 0
+    for granularidad, n in dias.items():
+        corte = (datetime.now() - timedelta(days=n)).isoformat()[:GRANULARIDADES[granularidad]]
+        eliminados += conn.execute(f"DELETE FROM rollup_escaneos_{granularidad} WHERE periodo < ?", (corte,)).rowcount
+    conn.commit()
+    return eliminados
+
+
+def series_tendencia(conn, granularidad, desde, hasta=None, agrupar=None, filtros=None):
+    """
+    Serie de lecturas por período desde los agregados: {clave: [[periodo, lecturas], ...]}.
+    'agrupar' separa las series por tipo, dispositivo o ip_address (None = una serie 'total');
+    'filtros' restringe por esas mismas columnas, p. ej. {'tipo': 'QR'}.
+    """
+    if granularidad not in GRANULARIDADES:
+        raise ValueError(f'Granularidad no válida; use una de: {", ".join(GRANULARIDADES)}.')
+    if agrupar is not None and agrupar not in AGRUPACIONES_ROLLUP:
+        raise ValueError(f'Agrupación no válida; use una de: {", ".join(AGRUPACIONES_ROLLUP)}.')
+
+    largo = GRANULARIDADES[granularidad]
+    condiciones, params = ['periodo >= ?'], [desde[:largo]]
+    if hasta:
+        condiciones.append('periodo < ?')
+        params.append(hasta[:largo])
+    for columna, valor in (filtros or {}).items():
+        if columna in AGRUPACIONES_ROLLUP and valor:
+            condiciones.append(f'{columna} = ?')
+            params.append(valor.upper() if columna == 'tipo' else valor)
+
+    clave = agrupar or "'total'"
+    series = {}
+    for periodo, serie, lecturas in conn.execute(f"""
+            SELECT periodo, {clave}, SUM(lecturas)
+            FROM rollup_escaneos_{granularidad}
+            WHERE {' AND '.join(condiciones)}
+            GROUP BY periodo, {clave}
+            ORDER BY periodo""", params):
+        series.setdefault(serie, []).append([periodo, lecturas])
+    return series
+
+
+if __name__ == '__main__':
+    import sys
+    if 'rollups' in sys.argv[1:]:
+        reconstruir_rollups()
+        print('Agregados de escaneos recalculados.')
+    elif 'auto_vacuum' in sys.argv[1:]:
+        print('auto_vacuum incremental activado.' if activar_auto_vacuum() else 'El archivo ya tenía auto_vacuum incremental.')
+    else:
+        print(f'Lecturas archivadas: {archivar() or "ninguna"}')
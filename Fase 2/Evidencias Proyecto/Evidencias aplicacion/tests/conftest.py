@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+Fixtures comunes: una base de inventario en un archivo SQLite temporal con el
+esquema del volcado 'Base de datos i-tec' más las migraciones, como la deja
+init_inventory_db en producción.
+
+Los módulos se prueban sin app.py (que necesita db.py y autentificacion.py del
+despliegue); cada prueba abre sus propias conexiones al archivo temporal.
+"""
+import os
+import sqlite3
+import sys
+
+import pytest
+
+DIRECTORIO_APP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, DIRECTORIO_APP)
+
+import migraciones  # noqa: E402
+import registro_cambios  # noqa: E402
+from benchmarks.generar_datos import VOLCADO, _sentencias_volcado  # noqa: E402
+
+
+def conectar(ruta):
+    conn = sqlite3.connect(ruta, timeout=10)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+@pytest.fixture
+def ruta_bd(tmp_path):
+    ruta = str(tmp_path / 'inventario.db')
+    conn = sqlite3.connect(ruta)
+    for sentencia in _sentencias_volcado(VOLCADO)[0]:
+        conn.execute(sentencia)
+    conn.execute('PRAGMA journal_mode = WAL')
+    migraciones.aplicar(conn)
+    registro_cambios.actualizar_triggers(conn)
+    conn.close()
+    return ruta
+
+
+@pytest.fixture
+def conn(ruta_bd):
+    conn = conectar(ruta_bd)
+    yield conn
+    conn.close()
+
+
+@pytest.fixture
+def crear_producto(conn):
+    """crear_producto(nombre, stock=0, ubicacion=None) -> producto_id."""
+    def crear(nombre, stock=0, ubicacion=None):
+        cur = conn.execute("""
+            INSERT INTO productos (nombre, tipo_producto_id, numero_serie, numero_factura, fecha_compra,
+                                   valor_unitario, estado_equipo_id, ubicacion_fisica, activo, stock_actual)
+            VALUES (?, 1, ?, 'F-1', '2024-01-01', 1000, 1, ?, 1, ?)
+        """, (nombre, f'SN-{nombre}', ubicacion, stock))
+        conn.commit()
+        return cur.lastrowid
+    return crear
+
+
+@pytest.fixture
+def crear_tienda(conn):
+    def crear(nombre='Tienda 1'):
+        cur = conn.execute("INSERT INTO tiendas (nombre_tienda, direccion) VALUES (?, 'Av. Principal 1')", (nombre,))
+        conn.commit()
+        return cur.lastrowid
+    return crear
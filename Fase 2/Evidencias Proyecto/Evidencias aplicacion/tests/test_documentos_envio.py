@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""Confirmación de documentos de envío: todo o nada."""
+import pytest
+
+import documentos_envio
+
+
+@pytest.fixture
+def documento(conn, crear_producto, crear_tienda):
+    tienda_id = crear_tienda()
+    a, b = crear_producto('A', stock=5), crear_producto('B', stock=2)
+    documento_id = documentos_envio.crear_documento(conn, tienda_id, None)
+    documentos_envio.agregar_lineas(conn, documento_id, [(a, 2), (b, 1)])
+    documentos_envio.agregar_lineas(conn, documento_id, [(a, 1)])  # mismo producto: se acumula
+    return {'id': documento_id, 'tienda_id': tienda_id, 'a': a, 'b': b}
+
+
+def _stock(conn, producto_id):
+    return conn.execute("SELECT stock_actual FROM productos WHERE producto_id = ?", (producto_id,)).fetchone()[0]
+
+
+def test_confirmar_descuenta_stock_y_registra_los_envios(conn, documento):
+    assert {l['producto_id']: l['cantidad'] for l in documentos_envio.obtener_lineas(conn, documento['id'])} == \
+        {documento['a']: 3, documento['b']: 1}
+
+    exito, _, faltantes = documentos_envio.confirmar(conn, documento['id'], None)
+
+    assert exito and faltantes == []
+    assert (_stock(conn, documento['a']), _stock(conn, documento['b'])) == (2, 1)
+    envios = conn.execute("SELECT producto_id, tienda_id, cantidad_enviada FROM envios_tienda ORDER BY producto_id").fetchall()
+    assert [tuple(e) for e in envios] == [(documento['a'], documento['tienda_id'], 3), (documento['b'], documento['tienda_id'], 1)]
+    assert conn.execute("SELECT estado FROM documentos_envio WHERE documento_id = ?", (documento['id'],)).fetchone()[0] == 'Enviado'
+
+
+def test_un_documento_enviado_no_se_confirma_ni_modifica_otra_vez(conn, documento):
+    assert documentos_envio.confirmar(conn, documento['id'], None)[0]
+
+    exito, mensaje, _ = documentos_envio.confirmar(conn, documento['id'], None)
+    assert not exito and 'enviado' in mensaje
+    with pytest.raises(ValueError):
+        documentos_envio.agregar_lineas(conn, documento['id'], [(documento['a'], 1)])
+    assert _stock(conn, documento['a']) == 2
+    assert conn.execute("SELECT COUNT(*) FROM envios_tienda").fetchone()[0] == 2
+
+
+def test_sin_stock_suficiente_no_se_descuenta_nada(conn, documento):
+    conn.execute("UPDATE productos SET stock_actual = 0 WHERE producto_id = ?", (documento['b'],))
+    conn.commit()
+
+    exito, _, faltantes = documentos_envio.confirmar(conn, documento['id'], None)
+
+    assert not exito
+    assert [(f['producto_id'], f['solicitado'], f['disponible']) for f in faltantes] == [(documento['b'], 1, 0)]
+    assert _stock(conn, documento['a']) == 5
+    assert conn.execute("SELECT COUNT(*) FROM envios_tienda").fetchone()[0] == 0
+    assert conn.execute("SELECT estado FROM documentos_envio WHERE documento_id = ?", (documento['id'],)).fetchone()[0] == 'Borrador'
+
+
+def test_eliminar_borrador_no_toca_los_enviados(conn, documento):
+    documentos_envio.confirmar(conn, documento['id'], None)
+    borrador = documentos_envio.crear_documento(conn, documento['tienda_id'], None)
+    documentos_envio.agregar_lineas(conn, borrador, [(documento['a'], 1)])
+
+    documentos_envio.eliminar_borrador(conn, borrador)
+    documentos_envio.eliminar_borrador(conn, documento['id'])
+
+    assert [f[0] for f in conn.execute("SELECT documento_id FROM documentos_envio").fetchall()] == [documento['id']]
+    assert conn.execute("SELECT COUNT(*) FROM documentos_envio_lineas WHERE documento_id = ?", (borrador,)).fetchone()[0] == 0
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""Runner de migraciones: orden, idempotencia, atomicidad y procesos simultáneos."""
+import sqlite3
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import migraciones
+from conftest import conectar
+
+
+def _migracion(nombre, aplicar):
+    return SimpleNamespace(__name__=f'migraciones.{nombre}', aplicar=aplicar)
+
+
+def test_base_nueva_queda_en_la_ultima_version(ruta_bd):
+    conn = sqlite3.connect(ruta_bd)
+    try:
+        versiones = migraciones.versiones(conn)
+        assert [v[0] for v in versiones] == [v for v, _ in migraciones.MIGRACIONES]
+        assert {v[2] for v in versiones} == {'aplicada'}
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == migraciones.MIGRACIONES[-1][0]
+        assert migraciones.aplicar(conn) == []
+        # ANALYZE corre al final, fuera de las transacciones de cada migración.
+        assert conn.execute("SELECT COUNT(*) FROM sqlite_stat1").fetchone()[0] > 0
+    finally:
+        conn.close()
+
+
+def test_una_migracion_que_falla_no_deja_cambios(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'bd.db'))
+
+    def aplicar_con_error(cur):
+        cur.execute("CREATE TABLE a_medias (x)")
+        raise RuntimeError('falla a mitad')
+
+    lista = [(1, _migracion('m001_uno', lambda cur: cur.execute("CREATE TABLE uno (x)"))),
+             (2, _migracion('m002_falla', aplicar_con_error))]
+    with pytest.raises(RuntimeError):
+        migraciones.aplicar(conn, lista)
+
+    tablas = {f[0] for f in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()}
+    assert 'uno' in tablas and 'a_medias' not in tablas
+    assert [v[0] for v in migraciones.versiones(conn)] == [1]
+    assert not conn.in_transaction
+    conn.close()
+
+
+def test_bases_con_solo_user_version_no_repiten_migraciones(tmp_path, monkeypatch):
+    conn = sqlite3.connect(str(tmp_path / 'bd.db'))
+    conn.execute('PRAGMA user_version = 2')
+    llamadas = []
+    lista = [(v, _migracion(f'm00{v}', lambda cur, v=v: llamadas.append(v))) for v in (1, 2, 3)]
+    monkeypatch.setattr(migraciones, 'MIGRACIONES', lista)
+
+    assert migraciones.aplicar(conn) == [3]
+    assert llamadas == [3]
+    assert [v[0] for v in migraciones.versiones(conn)] == [1, 2, 3]
+    conn.close()
+
+
+def test_procesos_simultaneos_aplican_cada_version_una_vez(tmp_path):
+    ruta = str(tmp_path / 'bd.db')
+    sqlite3.connect(ruta).execute('PRAGMA journal_mode = WAL').fetchone()
+    llamadas, lock = [], threading.Lock()
+
+    def aplicar(version):
+        def funcion(cur):
+            with lock:
+                llamadas.append(version)
+            cur.execute(f"CREATE TABLE t{version} (x)")
+        return funcion
+
+    lista = [(v, _migracion(f'm00{v}', aplicar(v))) for v in (1, 2, 3)]
+    barrera = threading.Barrier(4)
+    aplicadas, errores = [], []
+
+    def arrancar():
+        conn = conectar(ruta)
+        try:
+            barrera.wait()
+            aplicadas.extend(migraciones.aplicar(conn, lista))
+        except Exception as e:
+            errores.append(e)
+        finally:
+            conn.close()
+
+    hilos = [threading.Thread(target=arrancar) for _ in range(4)]
+    for h in hilos:
+        h.start()
+    for h in hilos:
+        h.join()
+
+    assert errores == []
+    assert sorted(llamadas) == [1, 2, 3]
+    assert sorted(aplicadas) == [1, 2, 3]
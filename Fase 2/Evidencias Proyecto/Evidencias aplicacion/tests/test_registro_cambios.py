@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""Paginación de /api/sync y marca de compactación del flujo CDC."""
+import registro_cambios
+
+
+def _sincronizar(conn, desde, limite):
+    """Recorre las páginas como la app móvil; devuelve (páginas, filas por pk, eliminados, hasta)."""
+    paginas, filas, eliminados = 0, {}, set()
+    while True:
+        pagina = registro_cambios.leer_cambios(conn, desde, limite)
+        paginas += 1
+        productos = pagina['cambios'].get('productos', {'columnas': [], 'filas': [], 'eliminados': []})
+        for fila in productos['filas']:
+            filas[fila[0]] = dict(zip(productos['columnas'], fila))
+        eliminados.update(productos['eliminados'])
+        desde = pagina['hasta']
+        if not pagina['mas']:
+            return paginas, filas, eliminados, desde
+
+
+def test_paginas_completas_y_sin_repetir(conn, crear_producto):
+    ids = [crear_producto(f'P{i}', stock=i) for i in range(7)]
+
+    paginas, filas, eliminados, hasta = _sincronizar(conn, 0, limite=3)
+
+    assert paginas == 3
+    assert sorted(filas) == ids and not eliminados
+    assert hasta == registro_cambios.ultima_secuencia(conn)
+    assert registro_cambios.leer_cambios(conn, hasta)['cambios'] == {}
+
+
+def test_desde_la_ultima_secuencia_llega_solo_el_estado_final(conn, crear_producto):
+    ids = [crear_producto(f'P{i}') for i in range(3)]
+    _, _, _, hasta = _sincronizar(conn, 0, limite=100)
+
+    for stock in (1, 2, 3):
+        conn.execute("UPDATE productos SET stock_actual = ? WHERE producto_id = ?", (stock, ids[0]))
+    conn.execute("DELETE FROM productos WHERE producto_id = ?", (ids[1],))
+    conn.commit()
+
+    pagina = registro_cambios.leer_cambios(conn, hasta)
+    productos = pagina['cambios']['productos']
+    assert [dict(zip(productos['columnas'], f))['stock_actual'] for f in productos['filas']] == [3]
+    assert productos['eliminados'] == [ids[1]]
+    assert not pagina['mas']
+
+
+def test_compactar_conserva_el_ultimo_cambio_y_marca_hasta_donde_borro(conn, crear_producto):
+    producto_id = crear_producto('A')
+    for stock in (1, 2):
+        conn.execute("UPDATE productos SET stock_actual = ? WHERE producto_id = ?", (stock, producto_id))
+    conn.execute("UPDATE registro_cambios SET fecha = datetime('now', '-30 days')")
+    conn.commit()
+    ultima = registro_cambios.ultima_secuencia(conn)
+    assert registro_cambios.compactado_hasta(conn) == 0
+
+    assert registro_cambios.compactar(conn, dias_retencion=7) == 2
+
+    assert registro_cambios.compactado_hasta(conn) == ultima - 1
+    # La sincronización desde cero sigue recibiendo la fila con su estado actual.
+    _, filas, _, _ = _sincronizar(conn, 0, limite=10)
+    assert filas[producto_id]['stock_actual'] == 2
+    # En el flujo CDC sólo queda el último cambio; compactar de nuevo no mueve la marca.
+    assert [e['seq'] for e in registro_cambios.leer_eventos(conn, 0)] == [ultima]
+    assert registro_cambios.compactar(conn, dias_retencion=7) == 0
+    assert registro_cambios.compactado_hasta(conn) == ultima - 1
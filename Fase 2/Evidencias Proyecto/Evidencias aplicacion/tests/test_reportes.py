@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Cola de reportes: dueño por intento, latido y reasignación de los abandonados."""
+import os
+
+import pytest
+
+import reportes
+
+
+@pytest.fixture(autouse=True)
+def directorio_reportes(tmp_path, monkeypatch):
+    monkeypatch.setattr(reportes, 'REPORTES_DIR', str(tmp_path / 'reportes'))
+    monkeypatch.setattr(reportes, '_proceso', lambda: 'host-a:100')
+
+
+@pytest.fixture
+def reporte_id(conn):
+    reporte_id, reutilizado = reportes.solicitar(conn, 'mantenimientos_pendientes', {}, None)
+    assert not reutilizado
+    return reporte_id
+
+
+def _envejecer_latido(conn, reporte_id, segundos):
+    conn.execute("UPDATE reportes SET latido = datetime('now', 'localtime', ?) WHERE reporte_id = ?",
+                 (f'-{segundos} seconds', reporte_id))
+    conn.commit()
+
+
+def test_un_reporte_en_curso_con_latido_no_se_toma_dos_veces(conn, reporte_id):
+    assert reportes.solicitar(conn, 'mantenimientos_pendientes', {}, None) == (reporte_id, True)
+
+    tomado = reportes.tomar_siguiente(conn)
+    assert (tomado['reporte_id'], tomado['estado'], tomado['intento'], tomado['proceso']) == \
+        (reporte_id, 'En proceso', 1, 'host-a:100')
+    assert reportes.tomar_siguiente(conn) is None
+
+    # El latido lo renueva sólo el proceso dueño.
+    _envejecer_latido(conn, reporte_id, 60)
+    assert reportes.renovar_latidos(conn) == 1
+    assert reportes.tomar_siguiente(conn) is None
+
+
+def test_un_latido_vencido_pasa_el_reporte_a_otro_intento(conn, reporte_id, monkeypatch):
+    viejo = reportes.tomar_siguiente(conn)
+    reportes.avanzar(conn, reporte_id, viejo['intento'], 10, 'Mantenimientos abiertos')
+    (descripcion, sql, parametros), = reportes.etapas(viejo)
+    reportes.calcular_etapa(conn, reporte_id, viejo['intento'], sql, parametros, True)
+
+    _envejecer_latido(conn, reporte_id, reportes.VENCIMIENTO_LATIDO + 5)
+    monkeypatch.setattr(reportes, '_proceso', lambda: 'host-b:200')
+    assert reportes.renovar_latidos(conn) == 0
+    nuevo = reportes.tomar_siguiente(conn)
+    assert (nuevo['reporte_id'], nuevo['intento'], nuevo['proceso']) == (reporte_id, 2, 'host-b:200')
+
+    # El intento anterior ya no puede avanzar ni publicar su resultado.
+    with pytest.raises(reportes.ReporteReasignado):
+        reportes.avanzar(conn, reporte_id, viejo['intento'], 50, descripcion)
+    with pytest.raises(reportes.ReporteReasignado):
+        reportes.terminar(conn, reporte_id, viejo['intento'], 0)
+    reportes.fallar(conn, reporte_id, viejo['intento'], 'no debe quedar')
+    assert reportes.obtener(conn, reporte_id)['estado'] == 'En proceso'
+
+    filas = reportes.calcular_etapa(conn, reporte_id, nuevo['intento'], sql, parametros, True)
+    reportes.terminar(conn, reporte_id, nuevo['intento'], filas)
+
+    final = reportes.obtener(conn, reporte_id)
+    assert (final['estado'], final['progreso'], final['intento']) == ('Listo', 100, 2)
+    assert os.path.exists(reportes.ruta_resultado(reporte_id))
+    assert reportes._parciales(reporte_id) == []
+
+
+def test_fallar_marca_error_solo_en_el_intento_vigente(conn, reporte_id):
+    tomado = reportes.tomar_siguiente(conn)
+    reportes.fallar(conn, reporte_id, tomado['intento'], 'sin espacio en disco')
+
+    final = reportes.obtener(conn, reporte_id)
+    assert (final['estado'], final['error']) == ('Error', 'sin espacio en disco')
+    assert reportes.tomar_siguiente(conn) is None
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+"""Confirmación de retiros en lote: agrupada por producto y sin sumar dos veces."""
+import threading
+
+import pytest
+
+import retiros_tienda
+from conftest import conectar
+
+
+@pytest.fixture
+def retiros(conn, crear_producto, crear_tienda):
+    """30 retiros pendientes de 2 unidades repartidos entre 3 productos con stock 10."""
+    tienda_id = crear_tienda()
+    productos = [crear_producto(n, stock=10) for n in ('A', 'B', 'C')]
+    conn.executemany("INSERT INTO retiros_tienda (producto_id, tienda_id, cantidad_retirada) VALUES (?, ?, 2)",
+                     [(productos[i % 3], tienda_id) for i in range(30)])
+    conn.commit()
+    return productos
+
+
+def _stocks(conn, productos):
+    return [conn.execute("SELECT stock_actual FROM productos WHERE producto_id = ?", (p,)).fetchone()[0] for p in productos]
+
+
+def test_confirma_los_indicados_y_omite_los_procesados(conn, retiros):
+    resumen = retiros_tienda.confirmar_lote(conn, [1, 2, 3, 4, 999], usuario_id=7)
+    assert resumen == {'solicitados': 5, 'confirmados': 4, 'omitidos': 1,
+                       'productos_actualizados': 3, 'unidades_recibidas': 8}
+    assert _stocks(conn, retiros) == [14, 12, 12]
+
+    # Repetir la confirmación no vuelve a sumar stock.
+    assert retiros_tienda.confirmar_lote(conn, [1, 2], usuario_id=7)['confirmados'] == 0
+    assert _stocks(conn, retiros) == [14, 12, 12]
+    assert conn.execute("SELECT COUNT(*) FROM retiros_tienda WHERE estado = 'Completado' AND usuario_receptor_id = 7").fetchone()[0] == 4
+
+
+def test_confirmaciones_simultaneas_suman_cada_retiro_una_sola_vez(ruta_bd, conn, retiros):
+    hilos = 4
+    barrera = threading.Barrier(hilos)
+    resumenes, errores = [], []
+
+    def confirmar_todos(usuario_id):
+        conexion = conectar(ruta_bd)
+        try:
+            barrera.wait()
+            resumenes.append(retiros_tienda.confirmar_lote(conexion, None, usuario_id))
+        except Exception as e:
+            errores.append(e)
+        finally:
+            conexion.close()
+
+    trabajadores = [threading.Thread(target=confirmar_todos, args=(i,)) for i in range(hilos)]
+    for t in trabajadores:
+        t.start()
+    for t in trabajadores:
+        t.join()
+
+    assert errores == []
+    assert sum(r['confirmados'] for r in resumenes) == 30
+    assert sum(r['unidades_recibidas'] for r in resumenes) == 60
+    assert _stocks(conn, retiros) == [30, 30, 30]
+    assert conn.execute("SELECT COUNT(*) FROM retiros_tienda WHERE estado = 'Pendiente'").fetchone()[0] == 0
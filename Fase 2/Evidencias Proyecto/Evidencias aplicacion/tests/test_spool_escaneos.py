@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""Spool de escaneos: volver a cargar un segmento no duplica lecturas."""
+import pytest
+
+import telemetria
+from spool_escaneos import SpoolEscaneos
+
+
+@pytest.fixture
+def ruta_telemetria(tmp_path):
+    ruta = str(tmp_path / 'telemetria.db')
+    with telemetria.conexion(ruta) as conn:
+        telemetria.crear_tablas(conn)
+    return ruta
+
+
+def _cargador(ruta, fallar_despues=False):
+    """Como NFCDatabase.save_readings_lote; con fallar_despues simula una caída tras el commit."""
+    def cargar(entradas):
+        guardadas = []
+        with telemetria.conexion(ruta) as conn:
+            for e in entradas:
+                lectura = telemetria.insertar_lectura(conn, e['device_info'], e['nfc_data'], e['ip_address'],
+                                                      e['user_agent'], e['dispositivo'], e['client_scan_id'],
+                                                      e['timestamp'])
+                if not lectura.get('duplicado'):
+                    guardadas.append((e, lectura))
+        if fallar_despues:
+            raise OSError('proceso caído antes de borrar el segmento')
+        return guardadas
+    return cargar
+
+
+def _entrada(contenido, client_scan_id=None):
+    return {'device_info': {'deviceId': 'lector-1'}, 'nfc_data': {'type': 'NFC', 'content': contenido},
+            'ip_address': '10.0.0.5', 'user_agent': 'pytest', 'dispositivo': 'lector-1',
+            'client_scan_id': client_scan_id, 'timestamp': '2025-03-01T10:00:00'}
+
+
+def _lecturas(ruta):
+    with telemetria.conexion(ruta) as conn:
+        return conn.execute("SELECT COUNT(*) FROM nfc_readings").fetchone()[0]
+
+
+def test_recargar_un_segmento_no_duplica_lecturas(tmp_path, ruta_telemetria):
+    spool = SpoolEscaneos(str(tmp_path / 'spool'))
+    guardadas = [spool.agregar(_entrada('A', 'cel-1')), spool.agregar(_entrada('B')), spool.agregar(_entrada('B'))]
+    # Sin client_scan_id del dispositivo se usa el del spool, distinto para cada entrada.
+    assert guardadas[1]['client_scan_id'] != guardadas[2]['client_scan_id']
+    spool.rotar()
+
+    with pytest.raises(OSError):
+        spool.drenar(_cargador(ruta_telemetria, fallar_despues=True))
+    assert spool.pendientes() == 1
+    assert _lecturas(ruta_telemetria) == 3
+
+    assert spool.drenar(_cargador(ruta_telemetria)) == []
+    assert spool.pendientes() == 0
+    assert _lecturas(ruta_telemetria) == 3
+    with telemetria.conexion(ruta_telemetria) as conn:
+        assert conn.execute("SELECT SUM(lecturas) FROM rollup_escaneos_dia").fetchone()[0] == 3
+
+
+def test_no_se_drena_el_segmento_que_otro_proceso_escribe(tmp_path, ruta_telemetria):
+    directorio = str(tmp_path / 'spool')
+    escritor, drenador = SpoolEscaneos(directorio), SpoolEscaneos(directorio)
+    escritor.agregar(_entrada('A', 'cel-1'))
+
+    assert drenador.drenar(_cargador(ruta_telemetria)) == []
+    assert drenador.pendientes() == 1
+
+    escritor.rotar()
+    cargadas = drenador.drenar(_cargador(ruta_telemetria))
+    assert [e['client_scan_id'] for e, _ in cargadas] == ['cel-1']
+    assert drenador.pendientes() == 0
+
+
+def test_una_linea_incompleta_se_descarta(tmp_path, ruta_telemetria):
+    spool = SpoolEscaneos(str(tmp_path / 'spool'))
+    spool.agregar(_entrada('A', 'cel-1'))
+    spool.rotar()
+    segmento = next((tmp_path / 'spool').glob('*.jsonl'))
+    with open(segmento, 'ab') as f:
+        f.write(b'{"client_scan_id": "cel-2", "nfc_')
+
+    assert [e['client_scan_id'] for e, _ in spool.drenar(_cargador(ruta_telemetria))] == ['cel-1']
+    assert _lecturas(ruta_telemetria) == 1
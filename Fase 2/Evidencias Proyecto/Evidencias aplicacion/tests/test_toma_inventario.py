@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Diferencias incrementales de una toma de inventario, también entre procesos."""
+import pytest
+
+from conftest import conectar
+from toma_inventario import RegistroTomas
+
+
+@pytest.fixture
+def bodega(crear_producto):
+    """Dos productos esperados en la bodega B1 (2 y 1 unidades) y uno en otra ubicación."""
+    return {
+        'a': crear_producto('A', stock=2, ubicacion='B1'),
+        'b': crear_producto('B', stock=1, ubicacion='B1'),
+        'c': crear_producto('C', stock=5, ubicacion='B2'),
+    }
+
+
+def test_cada_escaneo_actualiza_las_diferencias(conn, bodega):
+    registro = RegistroTomas()
+    toma = registro.abrir(conn, 'Bodega', 'B1')
+    assert toma.esperado == {bodega['a']: 2, bodega['b']: 1}
+
+    resultados = [registro.registrar_escaneo(conn, toma, codigo, producto_id)[0]
+                  for codigo, producto_id in (('SN-A', bodega['a']), ('SN-A', bodega['a']), ('SN-A', bodega['a']),
+                                              ('SN-C', bodega['c']), ('XYZ', None))]
+
+    assert [r['resultado'] for r in resultados] == ['encontrado', 'encontrado', 'duplicado', 'inesperado', 'desconocido']
+    assert [r['faltante'] for r in resultados[:2]] == [1, 0]
+    assert toma.faltantes == {bodega['b']: 1}
+    assert toma.resumen() == {'toma_id': toma.toma_id, 'estado': 'Abierta', 'esperados': 3, 'encontrados': 2,
+                              'faltantes': 1, 'duplicados': 1, 'inesperados': 2}
+
+
+def test_otro_proceso_solo_aplica_los_escaneos_nuevos(ruta_bd, bodega):
+    conn_1, conn_2 = conectar(ruta_bd), conectar(ruta_bd)
+    try:
+        proceso_1, proceso_2 = RegistroTomas(), RegistroTomas()
+        toma_1 = proceso_1.abrir(conn_1, 'Bodega', 'B1')
+        proceso_1.registrar_escaneo(conn_1, toma_1, 'SN-A', bodega['a'])
+
+        # El segundo proceso reconstruye la sesión desde los escaneos persistidos.
+        toma_2 = proceso_2.obtener(conn_2, toma_1.toma_id)
+        assert toma_2.ultimo_escaneo_id == toma_1.ultimo_escaneo_id
+        assert toma_2.faltantes == toma_1.faltantes
+
+        # Su escaneo devuelve sólo su propio cambio y el primero lo recibe al sincronizar.
+        cambios = proceso_2.registrar_escaneo(conn_2, toma_2, 'SN-B', bodega['b'])
+        assert [(c['resultado'], c['producto_id']) for c in cambios] == [('encontrado', bodega['b'])]
+        assert proceso_1.obtener(conn_1, toma_1.toma_id) is toma_1
+        assert toma_1.resumen() == toma_2.resumen()
+        assert toma_1.resumen()['faltantes'] == 1
+    finally:
+        conn_1.close()
+        conn_2.close()
+
+
+def test_una_toma_cerrada_rechaza_escaneos_y_sale_de_memoria(ruta_bd, bodega):
+    conn_1, conn_2 = conectar(ruta_bd), conectar(ruta_bd)
+    try:
+        proceso_1, proceso_2 = RegistroTomas(), RegistroTomas()
+        toma_1 = proceso_1.abrir(conn_1, 'Bodega', 'B1')
+        toma_2 = proceso_2.obtener(conn_2, toma_1.toma_id)
+        proceso_1.cerrar(conn_1, toma_1)
+
+        with pytest.raises(ValueError):
+            proceso_2.registrar_escaneo(conn_2, toma_2, 'SN-A', bodega['a'])
+        assert toma_2.estado == 'Cerrada'
+        assert proceso_2.obtener(conn_2, toma_1.toma_id) is not toma_2
+        assert conn_2.execute("SELECT COUNT(*) FROM tomas_inventario_escaneos").fetchone()[0] == 0
+    finally:
+        conn_1.close()
+        conn_2.close()
@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+"""
+Sesiones de toma de inventario (conteo físico) alimentadas por escaneos.
+
+Una sesión fija al abrirse el stock esperado de una ubicación (bodega o tienda)
+y lo compara contra los escaneos que llegan por la API. Las diferencias
+(faltantes, inesperados y duplicados) se actualizan escaneo a escaneo, sin
+recalcular el conjunto completo.
+"""
+import threading
+from collections import Counter
+
+TIPOS_UBICACION = ('Bodega', 'Tienda')
+
+# Stock esperado en bodega: productos cuya ubicación física coincide.
+SQL_ESPERADO_BODEGA = """
+    SELECT producto_id, stock_actual AS cantidad
+    FROM productos
+    WHERE ubicacion_fisica = ? AND stock_actual > 0
+"""
+
+# Stock esperado en tienda: envíos menos retiros ya completados.
+SQL_ESPERADO_TIENDA = """
+    SELECT producto_id, SUM(cantidad) AS cantidad
+    FROM (
+        SELECT producto_id, cantidad_enviada AS cantidad
+        FROM envios_tienda WHERE tienda_id = ?
+        UNION ALL
+        SELECT producto_id, -cantidad_retirada
+        FROM retiros_tienda WHERE tienda_id = ? AND estado = 'Completado'
+    )
+    GROUP BY producto_id
+    HAVING SUM(cantidad) > 0
+"""
+
+
+class TomaInventario:
+    """Estado en memoria de una sesión: esperado, escaneado y diferencias."""
+
+    def __init__(self, toma_id, tipo_ubicacion, ubicacion, estado, esperado):
+        self.toma_id = toma_id
+        self.tipo_ubicacion = tipo_ubicacion
+        self.ubicacion = ubicacion
+        self.estado = estado
+        self.esperado = dict(esperado)      # producto_id -> cantidad esperada
+        self.escaneado = Counter()          # producto_id -> escaneos válidos
+        self.faltantes = dict(esperado)     # producto_id -> cantidad aún no vista
+        self.duplicados = Counter()         # producto_id -> escaneos sobre lo esperado
+        self.inesperados = Counter()        # producto_id -> escaneos de productos no esperados
+        self.desconocidos = Counter()       # código -> escaneos que no resuelven a un producto
+        self.ultimo_escaneo_id = 0
+        self.lock = threading.Lock()
+
+    def aplicar(self, producto_id, codigo):
+        """Aplica un escaneo a las diferencias y devuelve el cambio producido."""
+        if producto_id is None:
+            self.desconocidos[codigo] += 1
+            return {'resultado': 'desconocido', 'codigo': codigo}
+        if producto_id not in self.esperado:
+            self.inesperados[producto_id] += 1
+            return {'resultado': 'inesperado', 'producto_id': producto_id, 'codigo': codigo}
+
+        self.escaneado[producto_id] += 1
+        if self.escaneado[producto_id] > self.esperado[producto_id]:
+            self.duplicados[producto_id] += 1
+            return {'resultado': 'duplicado', 'producto_id': producto_id, 'codigo': codigo}
+
+        restante = self.esperado[producto_id] - self.escaneado[producto_id]
+        if restante:
+            self.faltantes[producto_id] = restante
+        else:
+            del self.faltantes[producto_id]
+        return {'resultado': 'encontrado', 'producto_id': producto_id, 'codigo': codigo, 'faltante': restante}
+
+    def resumen(self):
+        return {
+            'toma_id': self.toma_id,
+            'estado': self.estado,
+            'esperados': sum(self.esperado.values()),
+            'encontrados': sum(self.escaneado.values()) - sum(self.duplicados.values()),
+            'faltantes': sum(self.faltantes.values()),
+            'duplicados': sum(self.duplicados.values()),
+            'inesperados': sum(self.inesperados.values()) + sum(self.desconocidos.values()),
+        }
+
+    def reporte(self):
+        """Reporte completo de diferencias de la sesión."""
+        return {
+            'toma_id': self.toma_id,
+            'tipo_ubicacion': self.tipo_ubicacion,
+            'ubicacion': self.ubicacion,
+            'resumen': self.resumen(),
+            'faltantes': [{'producto_id': pid, 'cantidad': c} for pid, c in sorted(self.faltantes.items())],
+            'duplicados': [{'producto_id': pid, 'cantidad': c} for pid, c in sorted(self.duplicados.items())],
+            'inesperados': [{'producto_id': pid, 'cantidad': c} for pid, c in sorted(self.inesperados.items())],
+            'desconocidos': [{'codigo': cod, 'cantidad': c} for cod, c in sorted(self.desconocidos.items())],
+        }
+
+
+class RegistroTomas:
+    """
+    Mantiene las sesiones abiertas en memoria.
+
+    Los escaneos se persisten en 'tomas_inventario_escaneos' y cada sesión
+    recuerda el último escaneo aplicado, de modo que sólo se procesan las filas
+    nuevas. Así el estado se reconstruye tras un reinicio y se mantiene
+    consistente aunque varios procesos reciban escaneos de la misma sesión.
+    """
+
+    def __init__(self):
+        self._tomas = {}
+        self._lock = threading.Lock()
+
+    def abrir(self, conn, tipo_ubicacion, ubicacion, usuario_id=None):
+        """Crea una sesión y congela el stock esperado de la ubicación."""
+        if tipo_ubicacion not in TIPOS_UBICACION:
+            raise ValueError(f'Tipo de ubicación no válido: {tipo_ubicacion}')
+        if not ubicacion:
+            raise ValueError('La ubicación es obligatoria.')
+
+        cur = conn.cursor()
+        if tipo_ubicacion == 'Bodega':
+            filas = cur.execute(SQL_ESPERADO_BODEGA, (ubicacion,)).fetchall()
+        else:
+            try:
+                tienda_id = int(ubicacion)
+            except (TypeError, ValueError):
+                raise ValueError(f'Tienda no válida: {ubicacion}')
+            filas = cur.execute(SQL_ESPERADO_TIENDA, (tienda_id, tienda_id)).fetchall()
+
+        cur.execute("INSERT INTO tomas_inventario (tipo_ubicacion, ubicacion, usuario_id) VALUES (?, ?, ?)",
+                    (tipo_ubicacion, str(ubicacion), usuario_id))
+        toma_id = cur.lastrowid
+        cur.executemany("INSERT INTO tomas_inventario_esperado (toma_id, producto_id, cantidad) VALUES (?, ?, ?)",
+                        [(toma_id, f[0], f[1]) for f in filas])
+        conn.commit()
+
+        toma = TomaInventario(toma_id, tipo_ubicacion, str(ubicacion), 'Abierta', {f[0]: f[1] for f in filas})
+        with self._lock:
+            self._tomas[toma_id] = toma
+        return toma
+
+    def obtener(self, conn, toma_id):
+        """Devuelve la sesión al día con los escaneos persistidos, o None si no existe."""
+        with self._lock:
+            toma = self._tomas.get(toma_id)
+        if toma is None:
+            fila = conn.execute("SELECT tipo_ubicacion, ubicacion, estado FROM tomas_inventario WHERE toma_id = ?",
+                                (toma_id,)).fetchone()
+            if not fila:
+                return None
+            esperado = conn.execute("SELECT producto_id, cantidad FROM tomas_inventario_esperado WHERE toma_id = ?",
+                                    (toma_id,)).fetchall()
+            toma = TomaInventario(toma_id, fila[0], fila[1], fila[2], {e[0]: e[1] for e in esperado})
+            if toma.estado == 'Abierta':
+                # Sólo se guardan en memoria las sesiones abiertas; las cerradas se leen de la base.
+                with self._lock:
+                    toma = self._tomas.setdefault(toma_id, toma)
+        self._sincronizar(conn, toma)
+        return toma
+
+    def _sincronizar(self, conn, toma):
+        """Aplica los escaneos persistidos que la sesión aún no ha visto."""
+        with toma.lock:
+            nuevos = conn.execute("""
+                SELECT escaneo_id, producto_id, codigo FROM tomas_inventario_escaneos
+                WHERE toma_id = ? AND escaneo_id > ? ORDER BY escaneo_id
+            """, (toma.toma_id, toma.ultimo_escaneo_id)).fetchall()
+            cambios = []
+            for escaneo_id, producto_id, codigo in nuevos:
+                cambio = toma.aplicar(producto_id, codigo)
+                cambio['escaneo_id'] = escaneo_id
+                cambios.append(cambio)
+                toma.ultimo_escaneo_id = escaneo_id
+            return cambios
+
+    def registrar_escaneo(self, conn, toma, codigo, producto_id, reading_id=None):
+        """Persiste un escaneo de la sesión y devuelve los cambios que produjo."""
+        # La condición sobre el estado se evalúa en la misma sentencia: otro proceso pudo cerrar la sesión.
+        insertado = conn.execute("""
+            INSERT INTO tomas_inventario_escaneos (toma_id, reading_id, codigo, producto_id)
+            SELECT ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM tomas_inventario WHERE toma_id = ? AND estado = 'Abierta')
+        """, (toma.toma_id, reading_id, codigo, producto_id, toma.toma_id)).rowcount
+        conn.commit()
+        if not insertado:
+            toma.estado = 'Cerrada'
+            with self._lock:
+                self._tomas.pop(toma.toma_id, None)
+            raise ValueError(f'La toma de inventario {toma.toma_id} está cerrada.')
+        return self._sincronizar(conn, toma)
+
+    def cerrar(self, conn, toma):
+        conn.execute("UPDATE tomas_inventario SET estado = 'Cerrada', fecha_cierre = datetime('now') WHERE toma_id = ?",
+                     (toma.toma_id,))
+        conn.commit()
+        self._sincronizar(conn, toma)
+        toma.estado = 'Cerrada'
+        with self._lock:
+            self._tomas.pop(toma.toma_id, None)
+        return toma
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+"""
+Punto de entrada WSGI para producción.
+
+Con gunicorn (un proceso por instancia; Socket.IO necesita sesiones persistentes):
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Para varias instancias tras un balanceador, ver servidor_produccion.py.
+"""
+import os
+
+if os.environ.get('SOCKETIO_ASYNC_MODE', 'eventlet') == 'eventlet':
+    try:
+        import eventlet
+        eventlet.monkey_patch()
+    except ImportError:
+        pass
+
+from app import crear_app, socketio  # noqa: E402
+
+app = crear_app(inicializar_bd=os.environ.get('ITEC_INICIALIZAR_BD', '1') == '1')